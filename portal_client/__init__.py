@@ -9,8 +9,10 @@ from .branding import configure_branding_parser
 from .client_application_uploader import (
     configure_parser as configure_client_application_parser,
 )
+from .mirror import configure_mirror_parser
 from .organizations import configure_organizations_parser
 from .session_management import configure_session_management_parser
+from .upload_benchmark import configure_upload_benchmark_parser
 from .usergroups import configure_user_groups_parser
 from .users import configure_users_parser
 
@@ -45,6 +47,12 @@ client_application_parser = subparsers.add_parser(
 )
 configure_client_application_parser(client_application_parser)
 
+upload_benchmark_parser = subparsers.add_parser(
+    "upload-benchmark",
+    help="Measure upload throughput for different chunk sizes and concurrency levels",
+)
+configure_upload_benchmark_parser(upload_benchmark_parser)
+
 users_parser = subparsers.add_parser("users", help="Manage user accounts on Portal")
 configure_users_parser(users_parser)
 
@@ -59,5 +67,11 @@ organizations_parser = subparsers.add_parser(
 )
 configure_organizations_parser(organizations_parser)
 
+mirror_parser = subparsers.add_parser(
+    "mirror",
+    help="Query a local copy of users, groups, organizations and applications",
+)
+configure_mirror_parser(mirror_parser)
+
 vm_parser = subparsers.add_parser("vms", help="Manage Virtual Machines")
 configure_session_management_parser(vm_parser)
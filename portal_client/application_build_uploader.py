@@ -11,6 +11,7 @@ import backoff
 import requests
 
 from .defaults import get_portal_backend_endpoint
+from .http_session import get_session
 from .portal_chunked_upload import ChunkedUploader
 from .utils import get_authorization_header
 
@@ -29,13 +30,15 @@ class ApplicationBuildUploader:
         backoff.expo, requests.exceptions.ConnectionError, max_time=60
     )
     def publish_application_data(self, url, authorization_header, app_data):
-        response = requests.post(
+        response = get_session().post(
             url, json=app_data, headers={"Authorization": authorization_header}
         )
 
         return response
 
-    def upload_application_build(self, application_file, config_parameters):
+    def upload_application_build(
+        self, application_file, config_parameters, parallel_chunks=1, deduplicate=True
+    ):
         application_url = urljoin(self.base_url, "/api/applications/")
 
         authorization_header = get_authorization_header()
@@ -44,7 +47,11 @@ class ApplicationBuildUploader:
         uploader = ChunkedUploader(
             base_url=application_url, authorization_header=authorization_header
         )
-        application_zip_url = uploader.upload_chunked_file(file_path=application_file)
+        application_zip_url = uploader.upload_chunked_file(
+            file_path=application_file,
+            parallel_chunks=parallel_chunks,
+            deduplicate=deduplicate,
+        )
         config_parameters["application_archive"] = application_zip_url
 
         # upload chunked panoramic image
@@ -55,7 +62,7 @@ class ApplicationBuildUploader:
                     os.path.dirname(application_file) + "/" + panoramic_image_path
                 )
             panoramic_image_url = uploader.upload_chunked_file(
-                file_path=panoramic_image_path
+                file_path=panoramic_image_path, deduplicate=deduplicate
             )
             config_parameters["panoramic_preview_image"] = panoramic_image_url
 
@@ -131,6 +138,20 @@ def configure_parser(parser):
         help="ID(s) of any organization the app should be available in.",
         required=True,
     )
+
+    # upload options:
+    parser.add_argument(
+        "--parallel-chunks",
+        help="How many chunks to upload in parallel. Default is 1, i.e. one chunk after the other.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--no-deduplicate",
+        help="Always upload the files, even if identical content has been uploaded before.",
+        action="store_false",
+        dest="deduplicate",
+    )
     parser.set_defaults(func=main)
     return parser
 
@@ -157,10 +178,17 @@ def main(args):
 
     config_parameters = vars(args)
     del config_parameters["func"]
+    parallel_chunks = config_parameters.pop("parallel_chunks")
+    deduplicate = config_parameters.pop("deduplicate")
 
     # Upload application
     uploader = ApplicationBuildUploader(base_url=get_portal_backend_endpoint())
-    response = uploader.upload_application_build(application_archive, config_parameters)
+    response = uploader.upload_application_build(
+        application_archive,
+        config_parameters,
+        parallel_chunks=parallel_chunks,
+        deduplicate=deduplicate,
+    )
 
     print(response.text)
     if not response.ok:
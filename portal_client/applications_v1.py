@@ -2,20 +2,19 @@ import json
 from argparse import ArgumentParser
 from urllib.parse import urljoin
 
-import requests
-
 from portal_client.application_build_uploader import (
     configure_parser as configure_app_build_upload_parser,
 )
 from portal_client.defaults import get_portal_backend_endpoint
+from portal_client.http_session import get_session
 from portal_client.organization import organization_parser
-from portal_client.pagination import pagination_parser
+from portal_client.pagination import pagination_parser, print_list
 from portal_client.utils import get_authorization_header
 
 
 def list_applications_v1(**filters):
     applications_url = urljoin(get_portal_backend_endpoint(), "/api/applications/")
-    response = requests.get(
+    response = get_session().get(
         applications_url,
         headers={"Authorization": get_authorization_header()},
         params=filters,
@@ -29,21 +28,19 @@ def list_applications_v1(**filters):
 
 
 def list_applications_cli(args):
-    applications_response = list_applications_v1(
+    print_list(
+        list_applications_v1,
+        args,
         organization=args.organization,
-        page=args.page,
-        page_size=args.page_size,
         fulltext_search=args.search,
     )
 
-    print(json.dumps(applications_response))
-
 
 def upload_application_image(application_id, image_path):
     application_images_url = urljoin(
         get_portal_backend_endpoint(), f"/api/applications/{application_id}/images/"
     )
-    response = requests.post(
+    response = get_session().post(
         application_images_url,
         headers={"Authorization": get_authorization_header()},
         files={"image": open(image_path, "rb")},
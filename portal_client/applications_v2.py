@@ -1,24 +1,37 @@
 import json
+import sys
 from argparse import ArgumentParser
 import os
 import tempfile
-from tqdm import tqdm
-from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
 
 import requests
+from tqdm import tqdm
 
-from portal_client.defaults import get_portal_backend_endpoint
+from portal_client.build_cache import BuildCache
+from portal_client.defaults import get_http_pool_size, get_portal_backend_endpoint
+from portal_client.http_session import get_session
 from portal_client.organization import organization_parser
-from portal_client.pagination import pagination_parser
-from portal_client.portal_chunked_upload import ChunkedUploader
-from portal_client.utils import get_authorization_header
+from portal_client.pagination import pagination_parser, print_list
+from portal_client.portal_chunked_upload import ChunkedUploader, chunk_size_argument
+from portal_client.ranged_download import BandwidthLimiter, RangedDownloader
+from portal_client.remote_zip import (
+    describe_member,
+    diff_members,
+    extract_members,
+    open_remote_zip,
+)
+from portal_client.transfer_metrics import metrics_parser, open_transfer_metrics
+from portal_client.upload_benchmark import size_argument
+from portal_client.utils import get_authorization_header, read_ids
 
 
 def get_application(application_id):
     application_url = urljoin(
         get_portal_backend_endpoint(), f"/api/v2/applications/{application_id}/"
     )
-    response = requests.get(
+    response = get_session().get(
         application_url, headers={"Authorization": get_authorization_header()}
     )
 
@@ -34,7 +47,7 @@ def get_application_cli(args):
 
 def list_applications(**filters):
     applications_url = urljoin(get_portal_backend_endpoint(), "/api/v2/applications/")
-    response = requests.get(
+    response = get_session().get(
         applications_url,
         headers={"Authorization": get_authorization_header()},
         params=filters,
@@ -48,21 +61,19 @@ def list_applications(**filters):
 
 
 def list_applications_cli(args):
-    applications_response = list_applications(
+    print_list(
+        list_applications,
+        args,
         organization=args.organization,
-        page=args.page,
-        page_size=args.page_size,
         fulltext_search=args.search,
     )
 
-    print(json.dumps(applications_response))
-
 
 def get_application_build(build_id):
     application_build_url = urljoin(
         get_portal_backend_endpoint(), f"/api/v2/application-builds/{build_id}/"
     )
-    response = requests.get(
+    response = get_session().get(
         application_build_url,
         headers={"Authorization": get_authorization_header()},
     )
@@ -77,13 +88,34 @@ def get_application_build_cli(args):
     print(json.dumps(build_response))
 
 
-def download_application_build(id, filepath=None):
-    build_info = get_application_build(id)
+# fields of a build's metadata giving the archive's digest, by hash algorithm, if Portal provides them
+_BUILD_DIGEST_FIELDS = ("md5", "sha256")
+
+
+def download_application_build(
+    id,
+    filepath=None,
+    metrics=None,
+    connections=4,
+    use_cache=True,
+    delete_corrupt=False,
+    build_info=None,
+    bandwidth_limiter=None,
+    progress=None,
+):
+    if build_info is None:
+        build_info = get_application_build(id)
     url = build_info.get("application_archive")
     if not url:
         raise ValueError("No URL found for the specified build ID.")
 
-    if not filepath:
+    cache = BuildCache() if use_cache and not filepath else None
+    if cache is not None:
+        cached_path = cache.lookup(id, build_info)
+        if cached_path is not None:
+            return cached_path
+        target_path = cache.target_path(id, os.path.basename(urlsplit(url).path))
+    elif not filepath:
         filename = os.path.basename(url)
         temp_dir = os.path.join(tempfile.gettempdir(), "innoactive-portal", id)
         os.makedirs(temp_dir, exist_ok=True)
@@ -91,32 +123,197 @@ def download_application_build(id, filepath=None):
     else:
         target_path = filepath
 
-    response = requests.get(
-        url, headers={"Authorization": get_authorization_header()}, stream=True
-    )
-    response.raise_for_status()
+    downloader = RangedDownloader(
+        authorization_header=get_authorization_header(),
+        connections=connections,
+        metrics=metrics,
+        bandwidth_limiter=bandwidth_limiter,
+        progress=progress,
+    )
+    downloader.download(
+        url,
+        target_path,
+        expected_size=build_info.get("size", build_info.get("file_size")),
+        expected_digests={
+            algorithm: build_info[algorithm]
+            for algorithm in _BUILD_DIGEST_FIELDS
+            if build_info.get(algorithm)
+        },
+        delete_corrupt=delete_corrupt,
+    )
+    if cache is not None:
+        cache.store(id, build_info, target_path)
+    return target_path
+
 
-    total = int(response.headers.get("content-length", 0))
+def download_application_builds(
+    ids,
+    output_dir=None,
+    parallel_builds=2,
+    max_bandwidth=None,
+    metrics=None,
+    **download_options,
+):
+    """
+    downloads several builds at once: their metadata is fetched concurrently, their archives are downloaded
+    ``parallel_builds`` at a time, sharing a progress bar and (optionally) a bandwidth limit
+
+    :param output_dir: directory to download the builds to (as ``<output_dir>/<id>/<archive name>``), otherwise
+        they are downloaded to the build cache
+    :param max_bandwidth: the combined download throughput not to exceed, in bytes per second
+    :param download_options: further options for ``download_application_build``, e.g. ``connections``
+    :return: a dict per build, in the order of the given ids, holding either the downloaded file's "path" or the
+        "error" the download failed with
+    """
+    ids = list(dict.fromkeys(ids))
+    with ThreadPoolExecutor(max_workers=get_http_pool_size()) as executor:
+        build_infos = [
+            executor.submit(get_application_build, build_id) for build_id in ids
+        ]
+
+    bandwidth_limiter = BandwidthLimiter(max_bandwidth) if max_bandwidth else None
+
+    def download(build_id, build_info, progress):
+        build_info = build_info.result()
+        filepath = None
+        if output_dir:
+            archive_url = build_info.get("application_archive") or ""
+            filepath = os.path.join(
+                output_dir, build_id, os.path.basename(urlsplit(archive_url).path)
+            )
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        return download_application_build(
+            build_id,
+            filepath,
+            metrics=metrics,
+            build_info=build_info,
+            bandwidth_limiter=bandwidth_limiter,
+            progress=progress,
+            **download_options,
+        )
+
+    results = []
     with (
-        open(target_path, "wb") as f,
         tqdm(
-            desc=target_path, total=total, unit="iB", unit_scale=True, unit_divisor=1024
-        ) as bar,
+            desc=f"{len(ids)} builds",
+            total=0,
+            unit="iB",
+            unit_scale=True,
+            unit_divisor=1024,
+        ) as progress,
+        ThreadPoolExecutor(max_workers=parallel_builds) as executor,
     ):
-        for data in response.iter_content(chunk_size=1024):
-            size = f.write(data)
-            bar.update(size)
-
-    return target_path
+        downloads = [
+            executor.submit(download, build_id, build_info, progress)
+            for build_id, build_info in zip(ids, build_infos)
+        ]
+        for build_id, build_download in zip(ids, downloads):
+            try:
+                results.append({"id": build_id, "path": build_download.result()})
+            except (requests.RequestException, OSError, ValueError) as error:
+                # a single build failing does not stop the others
+                results.append({"id": build_id, "error": str(error)})
+    return results
 
 
 def download_application_build_cli(args):
-    downloaded_file_path = download_application_build(args.id, args.filepath)
-    print(downloaded_file_path)
+    ids = args.ids + (read_ids(args.ids_from) if args.ids_from else [])
+    if not ids:
+        raise ValueError("Specify the ID of at least one build to download.")
+    if len(ids) > 1 and args.filepath:
+        raise ValueError(
+            "--filepath only applies to downloading a single build, use --output-dir instead."
+        )
+    metrics = open_transfer_metrics(
+        args.metrics_file,
+        args.metrics_format,
+        "download",
+        args.filepath or (ids[0] if len(ids) == 1 else f"{len(ids)} builds"),
+    )
+    try:
+        if len(ids) == 1 and not args.output_dir:
+            results = [
+                {
+                    "id": ids[0],
+                    "path": download_application_build(
+                        ids[0],
+                        args.filepath,
+                        metrics=metrics,
+                        connections=args.connections,
+                        use_cache=args.use_cache,
+                        delete_corrupt=args.delete_corrupt,
+                        bandwidth_limiter=BandwidthLimiter(args.max_bandwidth)
+                        if args.max_bandwidth
+                        else None,
+                    ),
+                }
+            ]
+        else:
+            results = download_application_builds(
+                ids,
+                output_dir=args.output_dir,
+                parallel_builds=args.parallel_builds,
+                max_bandwidth=args.max_bandwidth,
+                metrics=metrics,
+                connections=args.connections,
+                use_cache=args.use_cache,
+                delete_corrupt=args.delete_corrupt,
+            )
+    finally:
+        if metrics is not None:
+            metrics.close()
+
+    failed = [result for result in results if "error" in result]
+    for result in results:
+        if "path" in result:
+            print(result["path"])
+        else:
+            print(
+                f"Failed to download build {result['id']}: {result['error']}",
+                file=sys.stderr,
+            )
+    if failed:
+        sys.exit(f"{len(failed)} of {len(results)} builds failed to download")
+
+
+def open_application_build_archive(id):
+    """
+    :return: the build's archive as a ``zipfile.ZipFile``, reading only the parts of it that are needed via range
+        requests
+    """
+    url = get_application_build(id).get("application_archive")
+    if not url:
+        raise ValueError("No URL found for the specified build ID.")
+    return open_remote_zip(url, authorization_header=get_authorization_header())
+
+
+def list_application_build_files_cli(args):
+    with open_application_build_archive(args.id) as archive:
+        print(json.dumps([describe_member(info) for info in archive.infolist()]))
+
+
+def extract_application_build_files_cli(args):
+    with open_application_build_archive(args.id) as archive:
+        for extracted_path in extract_members(archive, args.members, args.output_dir):
+            print(extracted_path)
+
+
+def diff_application_builds_cli(args):
+    with (
+        open_application_build_archive(args.id) as archive,
+        open_application_build_archive(args.other_id) as other_archive,
+    ):
+        print(json.dumps(diff_members(archive, other_archive)))
 
 
 def upload_application_build(
-    application_archive, chunk_size_bytes, **application_build_data
+    application_archive,
+    chunk_size_bytes,
+    resume=False,
+    parallel_chunks=1,
+    deduplicate=True,
+    metrics=None,
+    **application_build_data,
 ):
     application_url = urljoin(
         get_portal_backend_endpoint(), "/api/v2/application-builds/"
@@ -126,15 +323,21 @@ def upload_application_build(
 
     # upload chunked application
     uploader = ChunkedUploader(
-        base_url=application_url, authorization_header=authorization_header
+        base_url=application_url,
+        authorization_header=authorization_header,
+        metrics=metrics,
     )
     application_zip_url = uploader.upload_chunked_file(
-        file_path=application_archive, chunk_size_bytes=chunk_size_bytes
+        file_path=application_archive,
+        chunk_size_bytes=chunk_size_bytes,
+        resume=resume,
+        parallel_chunks=parallel_chunks,
+        deduplicate=deduplicate,
     )
     application_build_data["application_archive"] = application_zip_url
 
     # publish application build data
-    response = requests.post(
+    response = get_session().post(
         application_url,
         headers={"Authorization": authorization_header},
         json=application_build_data,
@@ -149,7 +352,19 @@ def upload_application_build(
 def upload_application_build_cli(args):
     build_data = vars(args)
     del build_data["func"]
-    application_build_upload_response = upload_application_build(**build_data)
+    metrics = open_transfer_metrics(
+        build_data.pop("metrics_file"),
+        build_data.pop("metrics_format"),
+        "upload",
+        build_data["application_archive"],
+    )
+    try:
+        application_build_upload_response = upload_application_build(
+            metrics=metrics, **build_data
+        )
+    finally:
+        if metrics is not None:
+            metrics.close()
     print(json.dumps(application_build_upload_response))
 
 
@@ -161,7 +376,7 @@ def update_launch_configuration(application_id, platforms, build_id):
     for platform in platforms:
         url = urljoin(get_portal_backend_endpoint(),
                       f"/api/v2/applications/{application_id}/launch-configurations/{platform}/")
-        response = requests.patch(url, headers={"Authorization": authorization_header}, json=body)
+        response = get_session().patch(url, headers={"Authorization": authorization_header}, json=body)
         if not response.ok:
             print(response.json())
         response.raise_for_status()
@@ -204,14 +419,32 @@ def _configure_applications_v2_builds_parser(build_parser: ArgumentParser):
     )
     _configure_applications_v2_builds_get_subparser(get_subparser)
 
-    upload_subparser = build_subparsers.add_parser("upload", help="Upload a new build")
+    upload_subparser = build_subparsers.add_parser(
+        "upload", help="Upload a new build", parents=[metrics_parser]
+    )
     _configure_applications_v2_builds_upload_subparser(upload_subparser)
 
     download_subparser = build_subparsers.add_parser(
-        "download", help="Download an application build"
+        "download", help="Download an application build", parents=[metrics_parser]
     )
     _configure_applications_v2_builds_download_subparser(download_subparser)
 
+    ls_subparser = build_subparsers.add_parser(
+        "ls", help="List the files in an application build's archive"
+    )
+    _configure_applications_v2_builds_ls_subparser(ls_subparser)
+
+    extract_subparser = build_subparsers.add_parser(
+        "extract",
+        help="Extract single files from an application build's archive without downloading all of it",
+    )
+    _configure_applications_v2_builds_extract_subparser(extract_subparser)
+
+    diff_subparser = build_subparsers.add_parser(
+        "diff", help="Compare the files in two application builds' archives"
+    )
+    _configure_applications_v2_builds_diff_subparser(diff_subparser)
+
     return build_parser
 
 
@@ -307,11 +540,30 @@ def _configure_applications_v2_builds_upload_subparser(
 
     applications_upload_build_parser.add_argument(
         "--chunk-size",
-        help="Chunk size in bytes for the upload. Default is 2 MiB.",
-        type=int,
+        help="Chunk size in bytes for the upload, or 'auto' to adapt it to the measured throughput during the upload. Default is 2 MiB.",
+        type=chunk_size_argument,
         dest="chunk_size_bytes",
         default=2 * 1024 * 1024,
     )
+    applications_upload_build_parser.add_argument(
+        "--resume",
+        help="Resume a previously interrupted upload of the same archive instead of starting over.",
+        action="store_true",
+        default=False,
+    )
+    applications_upload_build_parser.add_argument(
+        "--parallel-chunks",
+        help="How many chunks to upload in parallel. Default is 1, i.e. one chunk after the other.",
+        type=int,
+        dest="parallel_chunks",
+        default=1,
+    )
+    applications_upload_build_parser.add_argument(
+        "--no-deduplicate",
+        help="Always upload the archive, even if identical content has been uploaded before.",
+        action="store_false",
+        dest="deduplicate",
+    )
 
     applications_upload_build_parser.set_defaults(func=upload_application_build_cli)
 
@@ -320,17 +572,98 @@ def _configure_applications_v2_builds_download_subparser(
     download_parser: ArgumentParser,
 ):
     download_parser.add_argument(
-        "id",
-        help="ID of the build to download.",
+        "ids",
+        help="IDs of the builds to download.",
+        nargs="*",
+        metavar="id",
+    )
+    download_parser.add_argument(
+        "--ids-from",
+        help="File to read further build IDs from, one per line. Use - to read them from stdin.",
     )
     download_parser.add_argument(
         "--filepath",
-        help="Path to save the downloaded file.",
+        help="Path to save the downloaded file. Only applies to downloading a single build.",
+    )
+    download_parser.add_argument(
+        "--output-dir",
+        help="Directory to save the downloaded builds to, as <output-dir>/<id>/<archive name>.",
+    )
+    download_parser.add_argument(
+        "--parallel-builds",
+        help="How many builds to download at the same time. Default is 2.",
+        type=int,
+        default=2,
+    )
+    download_parser.add_argument(
+        "--max-bandwidth",
+        help="Combined download throughput not to exceed, in bytes per second, optionally suffixed with K, M or G, "
+        "e.g. 50M.",
+        type=size_argument,
+    )
+    download_parser.add_argument(
+        "--connections",
+        help="How many parts of each build to download in parallel, if the server supports range requests. Default is 4.",
+        type=int,
+        default=4,
+    )
+    download_parser.add_argument(
+        "--no-cache",
+        help="Download the build even if it is in the local build cache already. Only applies without --filepath and "
+        "--output-dir.",
+        action="store_false",
+        dest="use_cache",
+    )
+    download_parser.add_argument(
+        "--delete-corrupt",
+        help="Delete the downloaded file if it does not match the build's size or checksum. By default it is kept as "
+        "<filepath>.part for inspection.",
+        action="store_true",
     )
 
     download_parser.set_defaults(func=download_application_build_cli)
 
 
+def _configure_applications_v2_builds_ls_subparser(ls_parser: ArgumentParser):
+    ls_parser.add_argument(
+        "id",
+        help="ID of the build to list the files of.",
+    )
+    ls_parser.set_defaults(func=list_application_build_files_cli)
+
+
+def _configure_applications_v2_builds_extract_subparser(
+    extract_parser: ArgumentParser,
+):
+    extract_parser.add_argument(
+        "id",
+        help="ID of the build to extract files from.",
+    )
+    extract_parser.add_argument(
+        "members",
+        help="Paths of the files within the archive to extract, glob patterns like '*.json' are supported.",
+        nargs="+",
+    )
+    extract_parser.add_argument(
+        "--output-dir",
+        help="Directory to extract the files to. Default is the current directory.",
+        default=".",
+    )
+    extract_parser.set_defaults(func=extract_application_build_files_cli)
+
+
+def _configure_applications_v2_builds_diff_subparser(diff_parser: ArgumentParser):
+    diff_parser.add_argument(
+        "id",
+        help="ID of the build to compare.",
+    )
+    diff_parser.add_argument(
+        "other_id",
+        help="ID of the build to compare it with.",
+    )
+    diff_parser.set_defaults(func=diff_application_builds_cli)
+
+
 def configure_applications_v2_parser(parser: ArgumentParser):
     application_parser = parser.add_subparsers(
         description="List and manage applications on Portal"
@@ -358,6 +691,7 @@ def configure_applications_v2_parser(parser: ArgumentParser):
     upload_build_parser = application_parser.add_parser(
         "upload-build",
         help="Upload a new application build, alias for 'builds upload'",
+        parents=[metrics_parser],
     )
     _configure_applications_v2_builds_upload_subparser(upload_build_parser)
 
@@ -3,15 +3,14 @@ import json
 from argparse import ArgumentParser
 from urllib.parse import urljoin
 
-import requests
-
 from .defaults import get_portal_backend_endpoint
+from .http_session import get_session
 from .utils import get_authorization_header
 
 
 def get_branding(organization_id=None):
     branding_url = urljoin(get_portal_backend_endpoint(), "/api/branding/")
-    response = requests.get(
+    response = get_session().get(
         branding_url,
         headers={"Authorization": get_authorization_header()},
         params={"organization": organization_id},
@@ -40,7 +39,7 @@ def update_branding(organization_id, **kwargs):
         if key in kwargs:
             files[key] = kwargs.pop(key)
     branding_url = urljoin(get_portal_backend_endpoint(), "/api/branding/")
-    response = requests.put(
+    response = get_session().put(
         branding_url,
         data=kwargs,
         headers={"Authorization": get_authorization_header()},
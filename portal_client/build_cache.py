@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import threading
+import time
+from os import path
+from urllib.parse import urlsplit
+
+from .defaults import get_build_cache_size, get_portal_cache_dir
+
+# fields of a build's metadata which change whenever its archive does, if Portal provides them
+_BUILD_FINGERPRINT_FIELDS = ("size", "file_size", "md5", "sha256", "checksum", "etag")
+
+
+def build_fingerprint(build_info):
+    """
+    :return: the parts of a build's metadata identifying the content of its archive, i.e. the archive's storage url
+        (without the query string, which changes for signed urls) and whichever size or hash fields are available
+    """
+    scheme, netloc, url_path, _, _ = urlsplit(build_info.get("application_archive", ""))
+    fingerprint = {"url": f"{scheme}://{netloc}{url_path}"}
+    for field in _BUILD_FINGERPRINT_FIELDS:
+        if build_info.get(field) is not None:
+            fingerprint[field] = build_info[field]
+    return fingerprint
+
+
+class BuildCache:
+    """
+    On-disk cache of downloaded build archives, keyed by build id.
+
+    A cached archive is only used if the build's metadata still matches the metadata it has been downloaded with
+    and the file is still complete. Once the cached archives exceed ``max_size`` bytes, the least recently used ones
+    are evicted.
+    """
+
+    # guards the index against concurrent downloads within the same process, e.g. of a batch of builds
+    _lock = threading.Lock()
+
+    def __init__(self, cache_dir=None, max_size=None):
+        if cache_dir is None:
+            cache_dir = path.join(get_portal_cache_dir(), "builds")
+        self.cache_dir = cache_dir
+        self.max_size = max_size if max_size is not None else get_build_cache_size()
+        self.index_path = path.join(cache_dir, "index.json")
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, index):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write to a temporary file first, so concurrent downloads never read a half-written index
+        temporary_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as index_file:
+            json.dump(index, index_file)
+        os.replace(temporary_path, self.index_path)
+
+    def target_path(self, build_id, file_name):
+        """
+        :return: the path to download the build's archive to, for storing it in the cache afterwards
+        """
+        build_dir = path.join(self.cache_dir, str(build_id))
+        os.makedirs(build_dir, exist_ok=True)
+        return path.join(build_dir, file_name)
+
+    def lookup(self, build_id, build_info):
+        """
+        :return: the path of the build's cached archive or None if it is not cached (anymore)
+        """
+        with self._lock:
+            index = self._load()
+            entry = index.get(str(build_id))
+            if entry is None:
+                return None
+            if (
+                entry["fingerprint"] != build_fingerprint(build_info)
+                or not path.isfile(entry["path"])
+                or path.getsize(entry["path"]) != entry["size"]
+            ):
+                self._evict(index, str(build_id))
+                self._save(index)
+                return None
+            entry["last_used"] = time.time()
+            self._save(index)
+            return entry["path"]
+
+    def store(self, build_id, build_info, file_path):
+        """
+        records the build's archive downloaded to ``file_path`` (as returned by ``target_path``) and evicts the least recently used archives if the
+        cache has grown too large
+        """
+        with self._lock:
+            index = self._load()
+            index[str(build_id)] = {
+                "path": file_path,
+                "size": path.getsize(file_path),
+                "fingerprint": build_fingerprint(build_info),
+                "last_used": time.time(),
+            }
+            cache_size = sum(entry["size"] for entry in index.values())
+            for evicted_id in sorted(index, key=lambda key: index[key]["last_used"]):
+                if cache_size <= self.max_size or evicted_id == str(build_id):
+                    break
+                cache_size -= index[evicted_id]["size"]
+                self._evict(index, evicted_id)
+            self._save(index)
+
+    def _evict(self, index, build_id):
+        index.pop(build_id)
+        shutil.rmtree(path.join(self.cache_dir, build_id), ignore_errors=True)
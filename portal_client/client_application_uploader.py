@@ -9,6 +9,7 @@ import backoff
 import requests
 
 from .defaults import get_portal_backend_endpoint
+from .http_session import get_session
 from .portal_chunked_upload import ChunkedUploader
 from .utils import get_authorization_header
 
@@ -23,19 +24,21 @@ class ClientApplicationApiClient:
     def __init__(self, base_url) -> None:
         self.base_url = urljoin(base_url, "/api/client-applications/")
 
-    def upload_version_binary(self, binary_path):
+    def upload_version_binary(self, binary_path, deduplicate=True):
         # upload binary in chunks
         uploader = ChunkedUploader(
             base_url=self.base_url,
             authorization_header=get_authorization_header(),
         )
-        return uploader.upload_chunked_file(file_path=binary_path)
+        return uploader.upload_chunked_file(
+            file_path=binary_path, deduplicate=deduplicate
+        )
 
     @backoff.on_exception(
         backoff.expo, requests.exceptions.ConnectionError, max_time=60
     )
     def create_client_application_version(self, slug, **version_data):
-        return requests.post(
+        return get_session().post(
             urljoin(self.base_url, f"{slug}/versions/"),
             data=version_data,
             headers={"Authorization": get_authorization_header()},
@@ -45,13 +48,13 @@ class ClientApplicationApiClient:
         backoff.expo, requests.exceptions.ConnectionError, max_time=60
     )
     def retrieve_client_application_version(self, slug, version):
-        return requests.get(urljoin(self.base_url, f"{slug}/versions/{version}/"))
+        return get_session().get(urljoin(self.base_url, f"{slug}/versions/{version}/"))
 
     @backoff.on_exception(
         backoff.expo, requests.exceptions.ConnectionError, max_time=60
     )
     def set_version_as_current(self, slug, version):
-        return requests.patch(
+        return get_session().patch(
             urljoin(self.base_url, f"{slug}/"),
             data={"current_version": version},
             headers={"Authorization": get_authorization_header()},
@@ -89,6 +92,12 @@ def configure_parser(parser):
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--no-deduplicate",
+        help="Always upload the binary, even if identical content has been uploaded before.",
+        action="store_false",
+        dest="deduplicate",
+    )
     parser.set_defaults(func=main)
     return parser
 
@@ -110,7 +119,9 @@ def main(args):
         print(check_response.text)
         exit(1)
 
-    binary_url = client_applications_api.upload_version_binary(args.binary)
+    binary_url = client_applications_api.upload_version_binary(
+        args.binary, deduplicate=args.deduplicate
+    )
     response = client_applications_api.create_client_application_version(
         args.slug,
         version=args.version,
@@ -1,4 +1,4 @@
-from os import getenv
+from os import getenv, path
 
 
 def get_portal_backend_endpoint():
@@ -9,3 +9,39 @@ def get_portal_session_management_endpoint():
     return getenv(
         "PORTAL_SESSION_MANAGEMENT_ENDPOINT", "https://session-management.innoactive.io"
     )
+
+
+def get_portal_cache_dir():
+    return getenv(
+        "PORTAL_CACHE_DIR",
+        path.join(
+            getenv("XDG_CACHE_HOME", path.join(path.expanduser("~"), ".cache")),
+            "innoactive-portal",
+        ),
+    )
+
+
+def get_http_pool_size():
+    return int(getenv("PORTAL_HTTP_POOL_SIZE", "16"))
+
+
+def get_http_timeout():
+    return float(getenv("PORTAL_HTTP_TIMEOUT", "300"))
+
+
+def get_build_cache_size():
+    return int(getenv("PORTAL_BUILD_CACHE_SIZE", str(20 * 1024**3)))
+
+
+def get_http_cache_enabled():
+    return getenv("PORTAL_HTTP_CACHE", "").lower() in ("1", "true", "yes")
+
+
+def get_http_cache_stale_ttl():
+    return float(getenv("PORTAL_HTTP_CACHE_STALE_TTL", "0"))
+
+
+def get_mirror_database():
+    return getenv(
+        "PORTAL_MIRROR_DATABASE", path.join(get_portal_cache_dir(), "mirror.sqlite3")
+    )
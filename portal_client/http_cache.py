@@ -0,0 +1,178 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from os import path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .defaults import get_portal_cache_dir
+
+_MAX_AGE = re.compile(r"(?:^|,)\s*max-age\s*=\s*(\d+)", re.IGNORECASE)
+_STALE_WHILE_REVALIDATE = re.compile(
+    r"(?:^|,)\s*stale-while-revalidate\s*=\s*(\d+)", re.IGNORECASE
+)
+
+
+def _cache_control(headers):
+    """
+    :return: the directives of a response's Cache-Control header relevant to the cache, i.e. whether it may be stored,
+        whether it always needs to be revalidated, for how many seconds it is fresh and for how many seconds it may be
+        used while it is being revalidated once it has become stale
+    """
+    cache_control = headers.get("Cache-Control", "")
+    directives = {
+        directive.strip().lower().split("=")[0]
+        for directive in cache_control.split(",")
+    }
+    max_age = _MAX_AGE.search(cache_control)
+    stale_while_revalidate = _STALE_WHILE_REVALIDATE.search(cache_control)
+    return {
+        "no_store": "no-store" in directives,
+        "no_cache": "no-cache" in directives,
+        "max_age": int(max_age[1]) if max_age else 0,
+        "stale_while_revalidate": int(stale_while_revalidate[1])
+        if stale_while_revalidate
+        else None,
+    }
+
+
+class HttpCache:
+    """
+    On-disk cache of GET responses, keyed by url (including the query string) and the credentials they have been
+    requested with.
+
+    Responses are served from the cache without a request for as long as their ``Cache-Control: max-age`` says they
+    are fresh. Afterwards (or right away for responses without a max-age or with ``no-cache``), they are revalidated
+    with ``If-None-Match`` / ``If-Modified-Since``, so an unchanged response costs a ``304 Not Modified`` rather than
+    its whole body. Stale responses may be served for up to ``stale_ttl`` seconds (or the response's
+    ``stale-while-revalidate``) while being revalidated in the background. Responses with ``no-store`` are never
+    stored.
+
+    Entries are replaced atomically, so several processes can share the cache.
+
+    :param stale_ttl: for how many seconds a stale response may be served while it is being revalidated
+    """
+
+    def __init__(self, cache_dir=None, stale_ttl=0):
+        if cache_dir is None:
+            cache_dir = path.join(get_portal_cache_dir(), "http")
+        self.cache_dir = cache_dir
+        self.stale_ttl = stale_ttl
+
+    def _entry_path(self, url, headers):
+        # the credentials are only part of the key as a hash, they are never written to disk
+        identity = hashlib.sha256(headers.get("Authorization", "").encode()).hexdigest()
+        key = hashlib.sha256(f"{identity} {url}".encode()).hexdigest()
+        return path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    @staticmethod
+    def _load(entry_path):
+        try:
+            with open(entry_path, "r", encoding="utf-8") as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        entry["headers"] = CaseInsensitiveDict(entry["headers"])
+        return entry
+
+    @staticmethod
+    def _save(entry_path, entry):
+        os.makedirs(path.dirname(entry_path), exist_ok=True)
+        # write to a temporary file first, so concurrent processes never read a half-written entry
+        temporary_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as entry_file:
+            json.dump(dict(entry, headers=dict(entry["headers"])), entry_file)
+        os.replace(temporary_path, entry_path)
+
+    def get(self, url, headers, send):
+        """
+        :param url: the request's url, including its query string
+        :param headers: the request's headers
+        :param send: function sending the request with the given extra headers, returning the response
+        :return: the response, either from the cache or from the server
+        """
+        entry_path = self._entry_path(url, headers)
+        entry = self._load(entry_path)
+        if entry is None:
+            return self._store(entry_path, send({}))
+
+        age = time.time() - entry["stored_at"]
+        cache_control = _cache_control(entry["headers"])
+        if not cache_control["no_cache"] and age < cache_control["max_age"]:
+            return self._response(entry, url)
+
+        stale_ttl = cache_control["stale_while_revalidate"]
+        if stale_ttl is None:
+            stale_ttl = self.stale_ttl
+        if not cache_control["no_cache"] and age < cache_control["max_age"] + stale_ttl:
+            threading.Thread(
+                target=self._revalidate,
+                args=(entry_path, entry, url, send),
+                name="http-cache-revalidation",
+            ).start()
+            return self._response(entry, url)
+
+        return self._revalidate(entry_path, entry, url, send)
+
+    def _revalidate(self, entry_path, entry, url, send):
+        conditional_headers = {}
+        if entry["headers"].get("ETag"):
+            conditional_headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            conditional_headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        response = send(conditional_headers)
+        if response.status_code != requests.codes.not_modified:
+            return self._store(entry_path, response)
+
+        # the stored response is still valid, as of now and with the server's updated caching headers
+        for header in ("Cache-Control", "ETag", "Last-Modified", "Date", "Expires"):
+            if header in response.headers:
+                entry["headers"][header] = response.headers[header]
+        entry["stored_at"] = time.time()
+        self._save(entry_path, entry)
+        return self._response(entry, url)
+
+    def _store(self, entry_path, response):
+        cache_control = _cache_control(response.headers)
+        if (
+            response.status_code != requests.codes.ok
+            or cache_control["no_store"]
+            or not (
+                cache_control["max_age"]
+                or response.headers.get("ETag")
+                or response.headers.get("Last-Modified")
+            )
+        ):
+            return response
+        self._save(
+            entry_path,
+            {
+                "status": response.status_code,
+                "headers": {
+                    header: value
+                    for header, value in response.headers.items()
+                    # the content is stored decoded already
+                    if header.lower() not in ("content-encoding", "content-length")
+                },
+                "content": base64.b64encode(response.content).decode("ascii"),
+                "stored_at": time.time(),
+            },
+        )
+        return response
+
+    @staticmethod
+    def _response(entry, url):
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = "OK"
+        response.url = url
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = base64.b64decode(entry["content"])
+        response.from_cache = True
+        return response
@@ -0,0 +1,84 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .defaults import (
+    get_http_cache_enabled,
+    get_http_cache_stale_ttl,
+    get_http_pool_size,
+    get_http_timeout,
+)
+from .http_cache import HttpCache
+
+
+class PortalSession(requests.Session):
+    """
+    requests session keeping connections alive and pooled, so consecutive API calls and chunk uploads do not pay for
+    a new TCP and TLS handshake each. Requests without an explicit timeout use the session's default timeout.
+
+    If a ``HttpCache`` is given, GET requests (except streamed and range requests, i.e. file downloads) go through
+    it
+    """
+
+    def __init__(self, pool_size=10, timeout=None, cache=None):
+        super().__init__()
+        self.timeout = timeout
+        self.cache = cache
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        headers = kwargs.get("headers") or {}
+        if (
+            self.cache is not None
+            and method.upper() == "GET"
+            and not kwargs.get("stream")
+            and "Range" not in headers
+        ):
+            prepared_url = requests.PreparedRequest()
+            prepared_url.prepare_url(url, kwargs.pop("params", None))
+
+            def send(conditional_headers):
+                return super(PortalSession, self).request(
+                    method,
+                    prepared_url.url,
+                    **dict(kwargs, headers=dict(headers, **conditional_headers)),
+                )
+
+            return self.cache.get(prepared_url.url, headers, send)
+        return super().request(method, url, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    :return: the session shared by the whole client, created on first use
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = PortalSession(
+                pool_size=get_http_pool_size(),
+                timeout=get_http_timeout(),
+                cache=HttpCache(stale_ttl=get_http_cache_stale_ttl())
+                if get_http_cache_enabled()
+                else None,
+            )
+        return _session
+
+
+def is_retryable(response):
+    """
+    :return: whether the response asks to try again later, i.e. for 429 Too Many Requests and server errors
+    """
+    return (
+        response.status_code == requests.codes.too_many_requests
+        or response.status_code >= 500
+    )
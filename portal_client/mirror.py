@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from .applications_v2 import list_applications
+from .defaults import get_mirror_database
+from .organizations import list_organizations
+from .pagination import iterate_results
+from .usergroups import list_usergroups
+from .users import list_users
+
+# what to mirror, by table: the list function to fetch it with and the fields to extract into indexed columns
+_MIRRORED_TABLES = {
+    "users": (list_users, ("email",)),
+    "usergroups": (list_usergroups, ("name", "organization")),
+    "organizations": (list_organizations, ("name",)),
+    "applications": (list_applications, ("name", "organization")),
+}
+
+# tables relating users to the organizations and groups they are members of, by the user field listing them
+_MEMBERSHIP_TABLES = {
+    "organizations": ("organization_members", "organization_id"),
+    "groups": ("group_members", "group_id"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (id PRIMARY KEY, email, data NOT NULL, hash NOT NULL);
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+CREATE TABLE IF NOT EXISTS usergroups (id PRIMARY KEY, name, organization, data NOT NULL, hash NOT NULL);
+CREATE INDEX IF NOT EXISTS usergroups_organization ON usergroups (organization);
+CREATE TABLE IF NOT EXISTS organizations (id PRIMARY KEY, name, data NOT NULL, hash NOT NULL);
+CREATE TABLE IF NOT EXISTS applications (id PRIMARY KEY, name, organization, data NOT NULL, hash NOT NULL);
+CREATE INDEX IF NOT EXISTS applications_organization ON applications (organization);
+CREATE TABLE IF NOT EXISTS organization_members (
+    organization_id, user_id, PRIMARY KEY (organization_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS organization_members_user_id ON organization_members (user_id);
+CREATE TABLE IF NOT EXISTS group_members (group_id, user_id, PRIMARY KEY (group_id, user_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS group_members_user_id ON group_members (user_id);
+CREATE TABLE IF NOT EXISTS syncs (name PRIMARY KEY, synced_at NOT NULL, count NOT NULL);
+"""
+
+
+def _id(value):
+    # related objects are given either by their id or nested
+    return value.get("id") if isinstance(value, dict) else value
+
+
+def _connect(database):
+    os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+    connection = sqlite3.connect(database)
+    # readers (e.g. a running query) do not block the sync and vice versa
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _sync_table(connection, table, page_size, workers):
+    """
+    Helper function mirroring every object of a list endpoint into its table within a single transaction, writing only
+    the objects which have been added, changed or removed since the last sync
+
+    :return: how many objects have been added, changed and removed as well as how many there are in total
+    """
+    list_function, columns = _MIRRORED_TABLES[table]
+    known_hashes = dict(connection.execute(f"SELECT id, hash FROM {table}"))
+    stats = {"added": 0, "changed": 0, "removed": 0, "total": 0}
+    with connection:
+        for mirrored_object in iterate_results(list_function, page_size, workers):
+            object_id = mirrored_object["id"]
+            data = json.dumps(mirrored_object, sort_keys=True)
+            data_hash = hashlib.sha1(data.encode()).hexdigest()
+            stats["total"] += 1
+            known_hash = known_hashes.pop(object_id, None)
+            if known_hash == data_hash:
+                continue
+            stats["added" if known_hash is None else "changed"] += 1
+            connection.execute(
+                f"INSERT OR REPLACE INTO {table} (id, {', '.join(columns)}, data, hash) "
+                f"VALUES (?, {', '.join('?' for _ in columns)}, ?, ?)",
+                (
+                    object_id,
+                    *(_id(mirrored_object.get(column)) for column in columns),
+                    data,
+                    data_hash,
+                ),
+            )
+            if table == "users":
+                _sync_memberships(connection, mirrored_object)
+
+        # whatever has not been listed anymore has been deleted on Portal
+        for object_id in known_hashes:
+            connection.execute(f"DELETE FROM {table} WHERE id = ?", (object_id,))
+            if table == "users":
+                _sync_memberships(connection, {"id": object_id})
+        stats["removed"] = len(known_hashes)
+        connection.execute(
+            "INSERT OR REPLACE INTO syncs (name, synced_at, count) VALUES (?, ?, ?)",
+            (table, time.time(), stats["total"]),
+        )
+    return stats
+
+
+def _sync_memberships(connection, user):
+    for field, (membership_table, related_column) in _MEMBERSHIP_TABLES.items():
+        connection.execute(
+            f"DELETE FROM {membership_table} WHERE user_id = ?", (user["id"],)
+        )
+        connection.executemany(
+            f"INSERT OR IGNORE INTO {membership_table} ({related_column}, user_id) VALUES (?, ?)",
+            [(_id(related), user["id"]) for related in user.get(field) or []],
+        )
+
+
+def sync_mirror(database=None, tables=None, page_size=100, workers=4):
+    """
+    mirrors users, user groups, organizations and applications into a local SQLite database. Each table is replaced
+    within a transaction of its own, so queries running at the same time see either the previous or the new state
+
+    :param tables: names of the tables to sync, all of them by default
+    :return: how many objects have been added, changed and removed, by table
+    """
+    connection = _connect(database or get_mirror_database())
+    try:
+        return {
+            table: _sync_table(connection, table, page_size, workers)
+            for table in tables or _MIRRORED_TABLES
+        }
+    finally:
+        connection.close()
+
+
+def query_mirror(sql, parameters=(), database=None):
+    """
+    runs a (read-only) SQL query against the local mirror
+
+    :return: generator of the resulting rows as dicts
+    """
+    database = Path(database or get_mirror_database()).resolve()
+    if not database.exists():
+        raise ValueError(
+            f"There is no mirror at {database} yet, run `innoactive-portal mirror sync` first."
+        )
+    connection = sqlite3.connect(f"{database.as_uri()}?mode=ro", uri=True)
+    connection.row_factory = sqlite3.Row
+    try:
+        for row in connection.execute(sql, parameters):
+            yield dict(row)
+    finally:
+        connection.close()
+
+
+def sync_mirror_cli(args):
+    print(
+        json.dumps(
+            sync_mirror(
+                database=args.database,
+                tables=args.tables,
+                page_size=args.page_size,
+                workers=args.workers,
+            )
+        )
+    )
+
+
+def query_mirror_cli(args):
+    for row in query_mirror(args.sql, args.parameters, database=args.database):
+        print(json.dumps(row))
+
+
+def configure_mirror_parser(parser: ArgumentParser):
+    mirror_parser = parser.add_subparsers(
+        description="Keep a local copy of Portal's users, groups, organizations and applications to query"
+    )
+
+    database_parser = ArgumentParser(add_help=False)
+    database_parser.add_argument(
+        "--database",
+        help="Path of the SQLite database holding the mirror. Default is $PORTAL_MIRROR_DATABASE or mirror.sqlite3 "
+        "in the cache directory.",
+    )
+
+    sync_parser = mirror_parser.add_parser(
+        "sync",
+        help="Fetches users, groups, organizations and applications into the local mirror",
+        parents=[database_parser],
+    )
+    sync_parser.add_argument(
+        "--only",
+        help="Only sync the given tables. Default is to sync all of them.",
+        nargs="+",
+        choices=list(_MIRRORED_TABLES),
+        dest="tables",
+    )
+    sync_parser.add_argument(
+        "--page-size",
+        help="How many objects to fetch per request. Default is 100.",
+        type=int,
+        default=100,
+    )
+    sync_parser.add_argument(
+        "--workers",
+        help="How many pages to fetch at the same time. Default is 4.",
+        type=int,
+        default=4,
+    )
+    sync_parser.set_defaults(func=sync_mirror_cli)
+
+    query_parser = mirror_parser.add_parser(
+        "query",
+        help="Runs an SQL query against the local mirror and prints the resulting rows as JSON lines",
+        parents=[database_parser],
+    )
+    query_parser.add_argument(
+        "sql",
+        help="The SQL query, e.g. \"SELECT email FROM users WHERE email LIKE '%%@example.org'\"",
+    )
+    query_parser.add_argument(
+        "parameters",
+        help="Values for the query's ? placeholders.",
+        nargs="*",
+    )
+    query_parser.set_defaults(func=query_mirror_cli)
+
+    return mirror_parser
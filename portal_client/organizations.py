@@ -1,17 +1,15 @@
-import json
 from argparse import ArgumentParser
 from urllib.parse import urljoin
 
-import requests
-
 from .defaults import get_portal_backend_endpoint
-from .pagination import pagination_parser
+from .http_session import get_session
+from .pagination import pagination_parser, print_list
 from .utils import get_authorization_header
 
 
 def list_organizations(**filters):
     organizations_url = urljoin(get_portal_backend_endpoint(), "/api/organizations/")
-    response = requests.get(
+    response = get_session().get(
         organizations_url,
         headers={"Authorization": get_authorization_header()},
         params=filters,
@@ -26,12 +24,7 @@ def list_organizations(**filters):
 
 
 def list_organizations_cli(args):
-    organizations_response = list_organizations(
-        page=args.page,
-        page_size=args.page_size,
-    )
-
-    print(json.dumps(organizations_response))
+    print_list(list_organizations, args)
 
 
 def configure_organizations_parser(parser: ArgumentParser):
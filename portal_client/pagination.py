@@ -1,4 +1,8 @@
 import argparse
+import json
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 pagination_parser = argparse.ArgumentParser(add_help=False)
 pagination_group = pagination_parser.add_argument_group(
@@ -13,3 +17,80 @@ pagination_group.add_argument(
     help="The page of results to fetch (based on --page-size)",
     default=1,
 )
+pagination_group.add_argument(
+    "--all",
+    action="store_true",
+    help="Fetch every page (of --page-size results) instead of a single one and write one JSON object per result "
+    "and line",
+)
+pagination_group.add_argument(
+    "--workers",
+    type=int,
+    help="With --all, how many pages to fetch at the same time",
+    default=4,
+)
+
+
+def iterate_pages(list_function, page_size, workers=1, **filters):
+    """
+    fetches every page of a paginated list endpoint. Once the first page tells the total count of results, the
+    remaining pages are fetched by several workers at once, up to ``workers`` pages ahead of the one being processed.
+    Pages are returned in order nonetheless
+
+    :param list_function: function fetching a page of results, e.g. ``list_users``
+    :param workers: how many pages to fetch at the same time
+    :return: generator of the pages' responses
+    """
+
+    def fetch(page):
+        return list_function(page=page, page_size=page_size, **filters)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        response = fetch(1)
+        count = response.get("count")
+        last_page = -(-count // page_size) if isinstance(count, int) else 1
+        next_page = 2
+        pending = deque()
+        while response is not None:
+            if (
+                not pending
+                and next_page > last_page
+                and response.get("next")
+                and response.get("results")
+            ):
+                # there is no count or it is outdated by now, continue page by page
+                last_page = next_page
+            while len(pending) < workers and next_page <= last_page:
+                pending.append(executor.submit(fetch, next_page))
+                next_page += 1
+            yield response
+            response = pending.popleft().result() if pending else None
+
+
+def iterate_results(list_function, page_size, workers=1, **filters):
+    """
+    :return: generator of the results of every page of a paginated list endpoint, see ``iterate_pages``
+    """
+    for response in iterate_pages(list_function, page_size, workers, **filters):
+        yield from response["results"]
+
+
+def print_list(list_function, args, **filters):
+    """
+    prints the page of results selected by the pagination arguments as JSON or, with ``--all``, every result as a
+    line of JSON, page by page as they are fetched
+    """
+    if not args.all:
+        print(
+            json.dumps(
+                list_function(page=args.page, page_size=args.page_size, **filters)
+            )
+        )
+        return
+    for response in iterate_pages(
+        list_function, args.page_size, args.workers, **filters
+    ):
+        for result in response["results"]:
+            print(json.dumps(result))
+        # hand every page on right away, e.g. to a pipe
+        sys.stdout.flush()
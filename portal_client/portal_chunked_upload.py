@@ -1,40 +1,331 @@
+import base64
 import hashlib
-from io import BytesIO
-from os import path
+import mmap
+import queue
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from os import fstat, path
 from urllib.parse import urljoin
+from uuid import uuid4
 
 import backoff
 import requests
 from tqdm import tqdm
 
+from .http_session import get_session
+from .upload_index import UploadIndex
+from .upload_journal import UploadJournal
+
 
 def _generate_md5_hash_for_file_at_path(file_path):
     """
     computes md5 hash for file at given path
     """
-    block_size = 65536
+    block_size = 1 << 20
     hashing_function = hashlib.md5()
     with open(file_path, "rb") as afile:
-        buf = afile.read(block_size)
-        while len(buf) > 0:
+        for buf in iter(lambda: afile.read(block_size), b""):
             hashing_function.update(buf)
-            buf = afile.read(block_size)
     return hashing_function.hexdigest()
 
 
+class _BackgroundHasher:
+    """
+    computes an md5 hash on a background thread, fed with the chunks in the order they are uploaded so that hashing
+    overlaps with waiting for the network instead of requiring a second pass over the file
+    """
+
+    def __init__(self, max_pending_chunks=4):
+        self._hashing_function = hashlib.md5()
+        # bounded, so we never hold more than a few chunks in memory if hashing falls behind
+        self._pending_chunks = queue.Queue(maxsize=max_pending_chunks)
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def _consume(self):
+        for data in iter(self._pending_chunks.get, None):
+            self._hashing_function.update(data)
+
+    def update(self, data):
+        self._pending_chunks.put(data)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._pending_chunks.put(None)
+            self._thread.join()
+
+    def hexdigest(self):
+        self.close()
+        return self._hashing_function.hexdigest()
+
+
+AUTO_CHUNK_SIZE = "auto"
+
+
+def chunk_size_argument(value):
+    """
+    argparse type for chunk sizes, either a number of bytes or "auto" for adapting the chunk size during the upload
+    """
+    if value == AUTO_CHUNK_SIZE:
+        return value
+    return int(value)
+
+
+class _AdaptiveChunkSizer:
+    """
+    adapts the chunk size to the measured goodput of the connection: starting small, the chunk size is doubled as long
+    as larger chunks noticeably increase the goodput (i.e. the per-request round trip stops dominating). Chunks taking
+    longer than ``max_chunk_seconds`` to be acknowledged, or being rejected for their size, shrink the chunk size again
+    """
+
+    def __init__(
+        self,
+        initial_chunk_size=1 << 20,
+        min_chunk_size=256 << 10,
+        max_chunk_size=32 << 20,
+        max_chunk_seconds=20,
+        min_goodput_gain=1.1,
+    ):
+        self.chunk_size = initial_chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.max_chunk_seconds = max_chunk_seconds
+        self.min_goodput_gain = min_goodput_gain
+        self.settled = False
+        # smoothed goodput in bytes per second, by chunk size
+        self._goodput = {}
+
+    def record(self, chunk_size, seconds):
+        if seconds <= 0:
+            return
+        goodput = chunk_size / seconds
+        previous_goodput = self._goodput.get(chunk_size)
+        self._goodput[chunk_size] = (
+            goodput
+            if previous_goodput is None
+            else 0.7 * previous_goodput + 0.3 * goodput
+        )
+
+        if chunk_size != self.chunk_size:
+            # a measurement for a chunk size we have already moved away from (e.g. a trailing chunk)
+            return
+
+        if seconds > self.max_chunk_seconds:
+            # chunks take too long, making every retry expensive
+            self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+            self.settled = True
+            return
+
+        smaller_goodput = self._goodput.get(self.chunk_size // 2)
+        if smaller_goodput is not None and (
+            self._goodput[self.chunk_size] < smaller_goodput * self.min_goodput_gain
+        ):
+            # doubling did not pay off, the smaller size is (about) as good
+            self.chunk_size //= 2
+            self.settled = True
+        elif not self.settled and self.chunk_size * 2 <= self.max_chunk_size:
+            self.chunk_size *= 2
+
+    def reject(self, chunk_size):
+        """
+        lowers the maximum chunk size after the server refused a chunk of the given size
+
+        :return: False if the chunk size cannot be lowered any further
+        """
+        if chunk_size <= self.min_chunk_size:
+            return False
+        self.max_chunk_size = max(self.min_chunk_size, chunk_size // 2)
+        self.chunk_size = min(self.chunk_size, self.max_chunk_size)
+        return True
+
+
+class _ChunkReader:
+    """
+    reads a file chunk by chunk from a memory mapping of the file, so chunks are views onto the file's pages rather
+    than copies of them. Every byte is fed to the hasher exactly once, even if the reader is moved back to re-read a
+    part of the file which has been read before
+    """
+
+    def __init__(self, _file, hasher=None):
+        if fstat(_file.fileno()).st_size > 0:
+            self._mapping = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mapping)
+        else:
+            # empty files cannot be memory mapped
+            self._mapping = None
+            self._view = memoryview(b"")
+        self._hasher = hasher
+        self._offset = 0
+        self._hashed_offset = 0
+        # the views handed out, which need to be released before the mapping can be closed
+        self._slices = {}
+
+    def _slice(self, start, end):
+        view = self._view[start:end]
+        key = id(view)
+        self._slices[key] = weakref.ref(
+            view, lambda _, key=key: self._slices.pop(key, None)
+        )
+        return view
+
+    def tell(self):
+        return self._offset
+
+    def read(self, size):
+        start = self._offset
+        piece = self._slice(start, start + size)
+        self._offset = start + len(piece)
+        if self._hasher is not None and self._offset > self._hashed_offset:
+            self._hasher.update(self._slice(self._hashed_offset, self._offset))
+            self._hashed_offset = self._offset
+        return piece
+
+    def seek(self, offset):
+        if self._hasher is not None and offset > self._hashed_offset:
+            # skipping ahead still requires the skipped part of the file to be hashed
+            self._hasher.update(self._slice(self._hashed_offset, offset))
+            self._hashed_offset = offset
+        self._offset = offset
+
+    def close(self):
+        """
+        releases all chunks handed out and unmaps the file, so it is no longer locked (e.g. on Windows).
+        Must only be called once the chunks are neither being hashed nor sent anymore
+        """
+        for view_reference in list(self._slices.values()):
+            view = view_reference()
+            if view is not None:
+                view.release()
+        self._slices.clear()
+        self._view.release()
+        if self._mapping is not None:
+            self._mapping.close()
+
+
+class _MultipartChunkBody:
+    """
+    multipart/form-data request body with a single file field, streaming the chunk straight from the buffer it is
+    backed by. Sending (or re-sending) a chunk thus does not require copying it
+    """
+
+    def __init__(self, field_name, file_name, chunk):
+        boundary = uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._preamble = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{_quote(file_name)}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        self._chunk = chunk
+        self._epilogue = f"\r\n--{boundary}--\r\n".encode()
+
+    def __len__(self):
+        return (
+            len(self._preamble) + memoryview(self._chunk).nbytes + len(self._epilogue)
+        )
+
+    def __iter__(self):
+        yield self._preamble
+        yield self._chunk
+        yield self._epilogue
+
+
+def _quote(file_name):
+    return file_name.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+def _chunk_digest(chunk):
+    """
+    :return: the chunk's md5 digest, base64 encoded as expected in a ``Content-MD5`` header
+    """
+    return base64.b64encode(hashlib.md5(chunk).digest()).decode()
+
+
+def _chunk_arrived_corrupted(response):
+    """
+    :return: whether the server refused a chunk because it does not match the digest it has been sent with
+    """
+    if response.status_code != requests.codes.bad_request:
+        return False
+    try:
+        details = response.json()
+    except ValueError:
+        return False
+    return isinstance(details, dict) and details.get("code") == "chunk_digest_mismatch"
+
+
+def _record_first_chunk_retry(details):
+    """
+    backoff handler counting retries of the first chunk in the uploader's transfer metrics (if any)
+    """
+    uploader = details["args"][0]
+    if uploader.metrics is not None:
+        uploader.metrics.record_retry(0)
+
+
+def _record_chunk_retry(details):
+    """
+    backoff handler counting retries of a subsequent chunk in the uploader's transfer metrics (if any)
+    """
+    uploader, offset = details["args"][:2]
+    if uploader.metrics is not None:
+        uploader.metrics.record_retry(offset)
+
+
 class ChunkedUploader:
-    def __init__(self, base_url, authorization_header):
+    def __init__(self, base_url, authorization_header, session=None, metrics=None):
+        """
+        :param metrics: optional ``TransferMetrics`` to record the latency, size and retries of every chunk in
+        """
         self.base_url = base_url
         self.authorization_header = authorization_header
+        # chunks are sent through a pooled session, so they reuse the connection instead of reconnecting each time
+        self.session = session if session is not None else get_session()
+        self.metrics = metrics
 
     def upload_chunked_file(
-        self, file_path, early_return_on_error=True, md5=None, chunk_size_bytes=2 << 20
+        self,
+        file_path,
+        early_return_on_error=True,
+        md5=None,
+        chunk_size_bytes=2 << 20,
+        resume=False,
+        parallel_chunks=1,
+        max_buffered_bytes=64 << 20,
+        deduplicate=True,
+        verify_existing=True,
     ):
+        """
+        uploads the file in chunks and returns the url it has been stored at
+
+        :param deduplicate: reuse the url of an earlier upload of identical content (as recorded in the local upload
+            index) instead of uploading the file again
+        :param verify_existing: check that the url of an earlier upload still exists on the server before reusing it
+        """
+        upload_index = UploadIndex() if deduplicate else None
+        if upload_index is not None:
+            file_url, md5 = self._find_uploaded_copy(
+                upload_index, file_path, md5, verify_existing
+            )
+            if file_url is not None:
+                print(
+                    f"Skipping upload of {file_path}, reusing earlier upload {file_url}",
+                    file=sys.stderr,
+                )
+                return file_url
+
         response = self._chunked_upload_file(
             file_path,
             early_return_on_error=early_return_on_error,
             md5=md5,
             chunk_size_bytes=chunk_size_bytes,
+            resume=resume,
+            parallel_chunks=parallel_chunks,
+            max_buffered_bytes=max_buffered_bytes,
+            upload_index=upload_index,
         )
         if response.status_code != requests.codes.ok:
             print(response.text)
@@ -47,110 +338,461 @@ class ChunkedUploader:
         early_return_on_error=True,
         md5=None,
         chunk_size_bytes=2 << 20,
+        resume=False,
+        parallel_chunks=1,
+        max_buffered_bytes=64 << 20,
+        upload_index=None,
     ):
         """
         create generic models with chunkeduploads
 
-        :param chunk_size_bytes: default value is 2 MiB
+        The md5 hash required for committing the upload is computed while the chunks are being sent, so the file is
+        only read once.
+
+        :param md5: explicit md5 hash to commit the upload with, skips hashing the file's contents
+        :param chunk_size_bytes: default value is 2 MiB, "auto" adapts the chunk size to the measured throughput
+        :param resume: keep a journal of the upload's progress and continue a previously interrupted upload of the
+            same file from the offset last acknowledged by the server
+        :param parallel_chunks: how many chunks to keep in flight at the same time. Falls back to uploading one
+            chunk after the other if the server rejects chunks arriving out of order
+        :param max_buffered_bytes: upper bound for the memory held by chunks in flight, default value is 64 MiB
+        :param upload_index: index to record the committed upload in, for later uploads of the same content
         """
 
         chunked_upload_url_suffix = "chunked_uploads/"
         chunked_upload_commit_suffix = "commit/"
 
-        # initial post request to create a new chunked upload instance on the backend side
+        initial_url = urljoin(self.base_url, chunked_upload_url_suffix)
+        journal = UploadJournal(file_path, self.base_url) if resume else None
+
         file_size = path.getsize(file_path)
-        with open(file_path, "rb") as _file:
-
-            def read_chunk():
-                return _file.read(chunk_size_bytes)
-
-            # reset the offset
-            offset = 0
-
-            # Initialize tqdm progress bar
-            with tqdm(
-                desc=f"Uploading {path.basename(file_path)}",
-                total=file_size,
-                unit="iB",
-                unit_scale=True,
-                unit_divisor=1024,
-            ) as bar:
-                # First chunk returns some special information
-                chunk = BytesIO(read_chunk())
-                chunk.name = path.basename(file_path)
-                initial_url = urljoin(self.base_url, chunked_upload_url_suffix)
-                response = self._upload_first_chunk_of_file(chunk, initial_url)
-                bar.update(
-                    len(chunk.getvalue())
-                )  # Update progress bar for the first chunk
-
-                if (
-                    response.status_code is not requests.codes.ok
-                    and early_return_on_error
-                ):
-                    return response
+        # auto-generate the md5 hash (unless an explicit hash has been provided for testing reason)
+        hasher = _BackgroundHasher() if md5 is None else None
+        reader = None
+        try:
+            with open(file_path, "rb") as _file:
+                reader = _ChunkReader(_file, hasher)
+                file_name = path.basename(file_path)
 
-                # fill md5sum and upload_id received from server, required for subsequent requests
-                upload_id = response.json()["upload_id"]
+                sizer = (
+                    _AdaptiveChunkSizer()
+                    if chunk_size_bytes == AUTO_CHUNK_SIZE
+                    else None
+                )
 
-                # remember the upload offset
-                offset = response.json()["offset"]
+                def read_chunk():
+                    return reader.read(
+                        sizer.chunk_size if sizer is not None else chunk_size_bytes
+                    )
 
-                # Continue with other chunks (every other chunk needs to also reference the upload's id
-                chunk_count = 0
+                # reset the offset
+                offset = 0
 
-                add_chunk_url = urljoin(initial_url, "{0}/".format(upload_id))
+                # Initialize tqdm progress bar
+                with tqdm(
+                    desc=f"Uploading {path.basename(file_path)}",
+                    total=file_size,
+                    unit="iB",
+                    unit_scale=True,
+                    unit_divisor=1024,
+                ) as bar:
+                    resumed_upload = self._find_resumable_upload(journal, initial_url)
+                    if resumed_upload is not None:
+                        upload_id, offset = resumed_upload
+                        # the hash needs to cover the already uploaded part of the file as well
+                        reader.seek(offset)
+                        bar.update(offset)
+                    else:
+                        # initial post request to create a new chunked upload instance on the backend side,
+                        # the first chunk returns some special information
+                        while True:
+                            chunk = read_chunk()
+                            chunk_started_at = time.monotonic()
+                            response = self._upload_first_chunk_of_file(
+                                chunk, file_name, initial_url
+                            )
+                            self._record_chunk(
+                                0, len(chunk), chunk_started_at, response
+                            )
+                            if not self._retry_with_smaller_chunk(
+                                sizer, response, len(chunk)
+                            ):
+                                break
+                            reader.seek(0)
+                        bar.update(
+                            len(chunk)
+                        )  # Update progress bar for the first chunk
 
-                for piece in iter(read_chunk, b""):
-                    chunk_count += 1
-                    chunk = BytesIO(piece)
-                    chunk.name = path.basename(file_path)
+                        if (
+                            response.status_code is not requests.codes.ok
+                            and early_return_on_error
+                        ):
+                            return response
 
-                    if len(piece) == 0:
-                        break
-                    response = self._upload_chunk(
-                        offset, file_size, chunk, len(piece), add_chunk_url
-                    )
-                    if (
-                        response.status_code is not requests.codes.ok
-                        and early_return_on_error
-                    ):
-                        return response
-                    # update the offset
-                    offset = response.json()["offset"]
-                    bar.update(len(piece))
+                        # fill md5sum and upload_id received from server, required for subsequent requests
+                        upload_id = response.json()["upload_id"]
+
+                        # remember the upload offset
+                        offset = response.json()["offset"]
+                        if journal is not None:
+                            journal.record(upload_id, offset)
+
+                    # Continue with other chunks (every other chunk needs to also reference the upload's id
+                    chunk_count = 0
+
+                    add_chunk_url = urljoin(initial_url, "{0}/".format(upload_id))
+
+                    if parallel_chunks > 1:
+                        response, offset = self._upload_chunks_in_parallel(
+                            read_chunk,
+                            offset,
+                            file_size,
+                            parallel_chunks,
+                            max_buffered_bytes,
+                            sizer,
+                            add_chunk_url,
+                            file_name,
+                            upload_id,
+                            journal,
+                            bar,
+                        )
+                        if response is not None and early_return_on_error:
+                            return response
+                        # continue sequentially with whatever the server has not acknowledged yet
+                        reader.seek(offset)
+
+                    while True:
+                        piece = read_chunk()
+                        if len(piece) == 0:
+                            break
+                        chunk_count += 1
+                        chunk_started_at = time.monotonic()
+                        response = self._upload_chunk(
+                            offset,
+                            file_size,
+                            piece,
+                            len(piece),
+                            add_chunk_url,
+                            file_name,
+                        )
+                        self._record_chunk(
+                            offset, len(piece), chunk_started_at, response
+                        )
+                        if self._retry_with_smaller_chunk(sizer, response, len(piece)):
+                            reader.seek(offset)
+                            continue
+                        if (
+                            response.status_code is not requests.codes.ok
+                            and early_return_on_error
+                        ):
+                            return response
+                        # update the offset
+                        offset = response.json()["offset"]
+                        if journal is not None:
+                            journal.record(upload_id, offset)
+                        if sizer is not None:
+                            sizer.record(
+                                len(piece), time.monotonic() - chunk_started_at
+                            )
+                        bar.update(len(piece))
+
+                    if sizer is not None:
+                        tqdm.write(
+                            f"Settled on a chunk size of {sizer.chunk_size} bytes",
+                            file=sys.stderr,
+                        )
+        finally:
+            if hasher is not None:
+                hasher.close()
+            if reader is not None:
+                reader.close()
 
         # final post including the file's md5 hash
         commit_chunked_upload_url = urljoin(add_chunk_url, chunked_upload_commit_suffix)
-        # auto-generate the md5 hash (unless an explicit hash has been provided for testing reason)
         if md5 is None:
-            md5 = _generate_md5_hash_for_file_at_path(file_path)
+            md5 = hasher.hexdigest()
         response = self._commit_chunked_upload(md5, commit_chunked_upload_url)
+        if response.status_code == requests.codes.ok:
+            if journal is not None:
+                journal.discard()
+            if upload_index is not None:
+                upload_index.store(
+                    file_path, self.base_url, md5, response.json()["file_url"]
+                )
 
         return response
 
+    def _find_uploaded_copy(self, upload_index, file_path, md5, verify_existing):
+        """
+        Looks up an earlier upload of the file's content in the upload index
+
+        The file is only hashed up front if it is unknown to the index while content of the same size is known,
+        otherwise the hash is taken from the index or computed during the upload as usual.
+
+        :return: tuple of the url of an earlier upload (or None) and the file's md5 hash (if already known)
+        """
+        if md5 is None:
+            md5 = upload_index.lookup_md5(file_path)
+        if md5 is None and upload_index.has_content_of_size(path.getsize(file_path)):
+            md5 = _generate_md5_hash_for_file_at_path(file_path)
+        if md5 is None:
+            return None, None
+
+        file_url = upload_index.lookup_file_url(self.base_url, md5)
+        if file_url is None:
+            return None, md5
+        if verify_existing and not self._uploaded_file_exists(file_url):
+            upload_index.forget(self.base_url, md5)
+            return None, md5
+        return file_url, md5
+
+    @backoff.on_exception(
+        backoff.expo, requests.exceptions.ConnectionError, max_time=60
+    )
+    def _uploaded_file_exists(self, file_url):
+        """
+        Helper function checking whether a previously uploaded file is still available on the server
+
+        :param file_url: the url the file has been committed to
+        :return: True if the file still exists
+        """
+        response = self.session.head(
+            file_url,
+            headers={"Authorization": self.authorization_header},
+            allow_redirects=True,
+        )
+        return response.ok
+
+    def _record_chunk(self, offset, chunk_size, started_at, response):
+        if self.metrics is not None:
+            self.metrics.record_chunk(
+                offset, chunk_size, time.monotonic() - started_at, response.status_code
+            )
+
+    @staticmethod
+    def _retry_with_smaller_chunk(sizer, response, chunk_size):
+        """
+        Helper function deciding whether a chunk refused for its size should be sent again in smaller chunks
+
+        :param sizer: the adaptive chunk sizer (if the chunk size is adapted at all)
+        :param response: the response to the chunk's upload
+        :param chunk_size: the size of the refused chunk
+        :return: True if the chunk size has been lowered and the chunk should be retried
+        """
+        return (
+            sizer is not None
+            and response.status_code == requests.codes.request_entity_too_large
+            and sizer.reject(chunk_size)
+        )
+
+    def _upload_chunks_in_parallel(
+        self,
+        read_chunk,
+        offset,
+        file_size,
+        max_chunks_in_flight,
+        max_buffered_bytes,
+        sizer,
+        url,
+        file_name,
+        upload_id,
+        journal,
+        bar,
+    ):
+        """
+        Helper function uploading the remaining chunks of a file with several chunk uploads in flight at the same time
+
+        Chunks may be acknowledged out of order, the upload only counts as progressed up to the first chunk which has
+        not been acknowledged yet. Once the server rejects a chunk (e.g. because it does not accept chunks arriving
+        ahead of their predecessors), no further chunks are sent and the offset the server actually holds is returned
+        so the upload can be continued sequentially from there.
+
+        :param read_chunk: returns the next chunk to upload
+        :param offset: the offset up to which the server has acknowledged the upload
+        :param max_chunks_in_flight: how many chunk uploads to run in parallel
+        :param max_buffered_bytes: upper bound for the size of all chunks in flight
+        :param sizer: the adaptive chunk sizer to report chunk timings to (if any)
+        :param url: the chunked upload's endpoint
+        :param file_name: the name of the file the chunks belong to
+        :return: tuple of the response of a failed chunk upload (or None) and the offset up to which the upload has
+            been acknowledged
+        """
+        # chunks acknowledged ahead of the contiguously acknowledged offset, mapping their start to their end
+        acknowledged_chunks = {}
+        chunks_in_flight = {}
+        bytes_in_flight = 0
+        next_offset = offset
+        failed_response = None
+
+        with ThreadPoolExecutor(max_workers=max_chunks_in_flight) as executor:
+            while True:
+                while (
+                    failed_response is None
+                    and len(chunks_in_flight) < max_chunks_in_flight
+                    and (not chunks_in_flight or bytes_in_flight < max_buffered_bytes)
+                ):
+                    piece = read_chunk()
+                    if not piece:
+                        break
+                    future = executor.submit(
+                        self._upload_chunk,
+                        next_offset,
+                        file_size,
+                        piece,
+                        len(piece),
+                        url,
+                        file_name,
+                    )
+                    chunks_in_flight[future] = (
+                        next_offset,
+                        len(piece),
+                        time.monotonic(),
+                    )
+                    bytes_in_flight += len(piece)
+                    next_offset += len(piece)
+
+                if not chunks_in_flight:
+                    break
+
+                done, _ = wait(chunks_in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, chunk_size, started_at = chunks_in_flight.pop(future)
+                    bytes_in_flight -= chunk_size
+                    response = future.result()
+                    self._record_chunk(start, chunk_size, started_at, response)
+                    if response.status_code != requests.codes.ok:
+                        if (
+                            sizer is not None
+                            and response.status_code
+                            == requests.codes.request_entity_too_large
+                        ):
+                            sizer.reject(chunk_size)
+                        if failed_response is None:
+                            failed_response, failed_offset = response, start
+                        continue
+                    acknowledged_chunks[start] = start + chunk_size
+                    if sizer is not None:
+                        sizer.record(chunk_size, time.monotonic() - started_at)
+                    bar.update(chunk_size)
+
+                acknowledged_offset = offset
+                while offset in acknowledged_chunks:
+                    offset = acknowledged_chunks.pop(offset)
+                if journal is not None and offset != acknowledged_offset:
+                    journal.record(upload_id, offset)
+
+        if failed_response is None:
+            return None, offset
+
+        # the server is the authority on which data it has accepted
+        response = self._retrieve_chunked_upload(url)
+        if response.status_code != requests.codes.ok:
+            return failed_response, offset
+        server_offset = response.json()["offset"]
+        if self.metrics is not None:
+            self.metrics.record_sequential_fallback()
+        tqdm.write(
+            f"Chunk upload at offset {failed_offset} rejected, continuing sequentially from offset {server_offset}",
+            file=sys.stderr,
+        )
+        bar.update(server_offset - bar.n)
+        return None, server_offset
+
+    def _find_resumable_upload(self, journal, url):
+        """
+        Looks up a previously interrupted upload of the journal's file and reconciles it with the server
+
+        :param journal: the upload's journal (if resuming uploads is enabled at all)
+        :param url: the chunked uploads endpoint
+        :return: tuple of upload_id and the offset last acknowledged by the server or None if the upload cannot be
+            resumed
+        """
+        if journal is None:
+            return None
+        entry = journal.load()
+        if entry is None:
+            return None
+
+        response = self._retrieve_chunked_upload(
+            urljoin(url, "{0}/".format(entry["upload_id"]))
+        )
+        if response.status_code in (requests.codes.not_found, requests.codes.gone):
+            # the upload is unknown to (or has been expired by) the server, start over
+            journal.discard()
+            return None
+        if not response.ok:
+            # keep the journal, the upload may well be resumable once the server is reachable again
+            print(response.text)
+            response.raise_for_status()
+
+        # the server is the authority on how much data it has received, the journal may lag behind by one chunk
+        return entry["upload_id"], response.json()["offset"]
+
     @backoff.on_exception(
         backoff.expo, requests.exceptions.ConnectionError, max_time=60
     )
-    def _upload_first_chunk_of_file(self, chunk: BytesIO, url):
+    def _retrieve_chunked_upload(self, url):
+        """
+        Helper function retrieving the current state (including its offset) of a chunked upload from the server
+
+        :param url: the chunked upload's endpoint
+        :return: the chunked upload's details
+        """
+        return self.session.get(
+            url, headers={"Authorization": self.authorization_header}
+        )
+
+    @backoff.on_predicate(
+        backoff.constant,
+        _chunk_arrived_corrupted,
+        interval=0,
+        max_tries=4,
+        on_backoff=_record_first_chunk_retry,
+    )
+    @backoff.on_exception(
+        backoff.expo,
+        requests.exceptions.ConnectionError,
+        max_time=60,
+        on_backoff=_record_first_chunk_retry,
+    )
+    def _upload_first_chunk_of_file(self, chunk: memoryview, file_name, url):
         """
         Helper function that takes care of the initial step of the chunked upload process which includes posting the
         first chunk to the given endpoint and retrieving back some reference for the further uploading process
 
         :param chunk: the chunk of the file to be uploaded
+        :param file_name: the name of the file to be uploaded
         :param url: the endpoint to which the data should be posted
         :return: outcome of the first chunk uploading process including the upload_id for later referene on further chunks
         """
-        return requests.post(
+        # a new body on every attempt, so retries send the chunk from its start again
+        body = _MultipartChunkBody("chunk", file_name, chunk)
+        return self.session.post(
             url,
-            files={"chunk": _clone_chunk(chunk)},
-            headers={"Authorization": self.authorization_header},
+            data=body,
+            headers={
+                "Authorization": self.authorization_header,
+                "Content-Type": body.content_type,
+                # lets the server refuse a chunk corrupted in transit, so it is retried on its own instead of failing
+                # the whole upload on commit
+                "Content-MD5": _chunk_digest(chunk),
+            },
         )
 
+    @backoff.on_predicate(
+        backoff.constant,
+        _chunk_arrived_corrupted,
+        interval=0,
+        max_tries=4,
+        on_backoff=_record_chunk_retry,
+    )
     @backoff.on_exception(
-        backoff.expo, requests.exceptions.ConnectionError, max_time=60
+        backoff.expo,
+        requests.exceptions.ConnectionError,
+        max_time=60,
+        on_backoff=_record_chunk_retry,
     )
-    def _upload_chunk(self, offset, file_size, chunk, chunk_size, url):
+    def _upload_chunk(self, offset, file_size, chunk, chunk_size, url, file_name):
         """
         Helper function that takes care of uploading the subsequent chunks in the chunked upload process
 
@@ -159,13 +801,18 @@ class ChunkedUploader:
         :param chunk: the chunk of the file to be uploaded
         :param chunk: the chunk's size in bytes
         :param url: the endpoint to which the data should be posted
+        :param file_name: the name of the file to be uploaded
         :return: outcome of the chunk uploading process
         """
-        return requests.put(
+        # a new body on every attempt, so retries send the chunk from its start again
+        body = _MultipartChunkBody("chunk", file_name, chunk)
+        return self.session.put(
             url,
-            files={"chunk": _clone_chunk(chunk)},
+            data=body,
             headers={
                 "Authorization": self.authorization_header,
+                "Content-Type": body.content_type,
+                "Content-MD5": _chunk_digest(chunk),
                 "Content-Range": "bytes %(start)s-%(chunk_size)s/%(file_size)s"
                 % {
                     "start": offset,
@@ -173,7 +820,7 @@ class ChunkedUploader:
                     "file_size": file_size,
                 },
                 "Content-Disposition": 'filename="%(file_name)s"'
-                % {"file_name": chunk.name},
+                % {"file_name": file_name},
             },
         )
 
@@ -187,15 +834,8 @@ class ChunkedUploader:
         :param md5: the md5 hash of the uploaded file's contents (used for verification on the server side)
         :return:
         """
-        return requests.post(
+        return self.session.post(
             url,
             files={"md5": ("", md5)},
             headers={"Authorization": self.authorization_header},
         )
-
-
-def _clone_chunk(chunk: BytesIO) -> BytesIO:
-    # we need to copy the chunk as otherwise, if we retry the function because of an error, the bytes would already be read to the end, resulting in an empty file
-    chunk_copy = BytesIO(chunk.getbuffer())
-    chunk_copy.name = chunk.name
-    return chunk_copy
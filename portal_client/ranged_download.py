@@ -0,0 +1,606 @@
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import backoff
+import requests
+from tqdm import tqdm
+
+from .http_session import get_session
+
+_CONTENT_RANGE = re.compile(r"bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+)")
+
+
+def _record_range_retry(details):
+    """
+    backoff handler counting retries of a byte range in the downloader's transfer metrics (if any)
+    """
+    downloader, range_start = details["args"][0], details["args"][3]
+    if downloader.metrics is not None:
+        downloader.metrics.record_retry(range_start)
+
+
+class DownloadSidecar:
+    """
+    Small record next to a partially downloaded ``.part`` file, allowing an interrupted download to be resumed later
+    on. It records the file's url, length and ETag (or modification date) as well as which byte ranges have been
+    written completely already.
+
+    The url is compared without its query string, as signed storage urls change with every request for them.
+    """
+
+    def __init__(self, part_path):
+        self.sidecar_path = f"{part_path}.json"
+
+    @staticmethod
+    def _identity(url, length, validator, range_size):
+        scheme, netloc, url_path, _, _ = urlsplit(url)
+        return {
+            "url": f"{scheme}://{netloc}{url_path}",
+            "length": length,
+            "validator": validator,
+            "range_size": range_size,
+        }
+
+    def load(self, url, length, validator, range_size):
+        """
+        :return: the starts of the byte ranges already downloaded, if the sidecar has been written for the same
+            version of the same file (otherwise an empty set)
+        """
+        if not validator:
+            # without an ETag or modification date, there is no telling whether the file is still the same
+            return set()
+        try:
+            with open(self.sidecar_path, "r", encoding="utf-8") as sidecar_file:
+                entry = json.load(sidecar_file)
+        except (OSError, ValueError):
+            return set()
+        identity = self._identity(url, length, validator, range_size)
+        if any(entry.get(key) != value for key, value in identity.items()):
+            return set()
+        return set(entry.get("completed_ranges", []))
+
+    def record(self, url, length, validator, range_size, completed_ranges):
+        entry = dict(
+            self._identity(url, length, validator, range_size),
+            completed_ranges=sorted(completed_ranges),
+        )
+        # write to a temporary file first, so a crash never leaves a half-written sidecar behind
+        temporary_path = f"{self.sidecar_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as sidecar_file:
+            json.dump(entry, sidecar_file)
+        os.replace(temporary_path, self.sidecar_path)
+
+    def discard(self):
+        try:
+            os.remove(self.sidecar_path)
+        except FileNotFoundError:
+            pass
+
+
+class _OrderedHasher:
+    """
+    hashes a file while its byte ranges are being written, possibly out of order. Data written right at the offset
+    hashed so far is hashed straight away, data written ahead of it is read back from the (page cached) file once the
+    hashed offset has caught up with it
+    """
+
+    def __init__(self, file_path, algorithms):
+        self._file_path = file_path
+        self._hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self._offset = 0
+        # how far each range being written has been written, by the range's start
+        self._written = {}
+        self._lock = threading.Lock()
+
+    def update(self, range_start, offset, data):
+        """
+        to be called once the data has been written to the file at the given offset
+        """
+        with self._lock:
+            self._written[range_start] = offset + len(data)
+            if offset == self._offset:
+                for hashing_function in self._hashes.values():
+                    hashing_function.update(data)
+                self._offset += len(data)
+            self._catch_up()
+
+    def mark_written(self, range_start, range_end):
+        """
+        to be called for ranges which have been written before, e.g. by an earlier, interrupted download
+        """
+        with self._lock:
+            self._written[range_start] = range_end + 1
+            self._catch_up()
+
+    def _catch_up(self):
+        for start, written in sorted(self._written.items()):
+            if written <= self._offset:
+                del self._written[start]
+            elif start <= self._offset:
+                self._read_back(written)
+
+    def _read_back(self, end):
+        with open(self._file_path, "rb") as _file:
+            _file.seek(self._offset)
+            while self._offset < end:
+                data = _file.read(min(1 << 20, end - self._offset))
+                for hashing_function in self._hashes.values():
+                    hashing_function.update(data)
+                self._offset += len(data)
+
+    def hexdigests(self):
+        with self._lock:
+            return {
+                algorithm: hashing_function.hexdigest()
+                for algorithm, hashing_function in self._hashes.items()
+            }
+
+
+def _digests_from_headers(response):
+    """
+    :return: the file's digests by algorithm (as hex strings), as far as the response's headers state them
+    """
+    digests = {}
+    # Google Cloud Storage states the whole object's hashes, even for range requests
+    for google_hash in response.headers.get("x-goog-hash", "").split(","):
+        algorithm, _, value = google_hash.strip().partition("=")
+        if algorithm == "md5" and value:
+            digests["md5"] = base64.b64decode(value).hex()
+    # Content-MD5 is the digest of the response's body, so only of the whole file if it is not a range of it
+    if response.status_code == requests.codes.ok and response.headers.get(
+        "Content-MD5"
+    ):
+        digests["md5"] = base64.b64decode(response.headers["Content-MD5"]).hex()
+    return digests
+
+
+class BandwidthLimiter:
+    """
+    Token bucket limiting the combined throughput of all downloads sharing it. Safe to be used from several threads
+    at once
+
+    :param bytes_per_second: the throughput not to exceed on average
+    """
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self._available = 0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        """
+        blocks until the given number of bytes may have been transferred without exceeding the limit
+        """
+        with self._lock:
+            now = time.monotonic()
+            # unused bandwidth is saved up for a second at most, so an idle phase does not allow a burst afterwards
+            self._available = min(
+                self.bytes_per_second,
+                self._available + (now - self._updated_at) * self.bytes_per_second,
+            )
+            self._updated_at = now
+            # going into debt makes whoever comes next wait for it as well
+            self._available -= size
+            wait = -self._available / self.bytes_per_second
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RangedDownloader:
+    """
+    Downloads a file over several connections at once, each fetching a different byte range of the file and writing
+    it to its position in the (preallocated) target file. Servers not supporting range requests are downloaded from
+    in a single stream instead.
+
+    The file is downloaded to ``<target_path>.part`` first and only renamed to the target path once complete. If a
+    download gets interrupted, the next download to the same target path continues with the byte ranges missing, as
+    long as the file has not changed on the server in the meantime.
+
+    The file is hashed while it is being written and verified against the size and digests given (or stated by the
+    server's response headers) before it is renamed to the target path.
+
+    :param connections: how many byte ranges to fetch at the same time
+    :param range_size: size of the byte ranges the file is split into, in bytes
+    :param metrics: optional ``TransferMetrics`` to record every byte range in
+    :param bandwidth_limiter: optional ``BandwidthLimiter`` to share with other downloads
+    :param progress: optional progress bar to share with other downloads, instead of one per file
+    """
+
+    # shared, as the progress bar may be shared between downloaders
+    _bar_lock = threading.Lock()
+
+    def __init__(
+        self,
+        authorization_header=None,
+        session=None,
+        connections=4,
+        range_size=8 << 20,
+        metrics=None,
+        bandwidth_limiter=None,
+        progress=None,
+    ):
+        self.headers = (
+            {"Authorization": authorization_header} if authorization_header else {}
+        )
+        self.session = session if session is not None else get_session()
+        self.connections = connections
+        self.range_size = range_size
+        self.metrics = metrics
+        self.bandwidth_limiter = bandwidth_limiter
+        self.progress = progress
+
+    def download(
+        self,
+        url,
+        target_path,
+        expected_size=None,
+        expected_digests=None,
+        delete_corrupt=False,
+    ):
+        """
+        downloads the file at the given url to the target path
+
+        :param expected_size: the file's size in bytes, if known
+        :param expected_digests: the file's digests as hex strings by algorithm (e.g. "md5", "sha256"), if known
+        :param delete_corrupt: delete the downloaded file if it does not match the expected size or digests,
+            otherwise it is left at ``<target_path>.part`` for inspection
+        :return: the target path
+        """
+        # the first range doubles as probe: servers supporting ranges answer with 206 and the file's total size
+        response = self.session.get(
+            url,
+            headers=dict(self.headers, Range=f"bytes=0-{self.range_size - 1}"),
+            stream=True,
+        )
+        content_range = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        expected_digests = dict(
+            _digests_from_headers(response), **(expected_digests or {})
+        )
+        if response.status_code == requests.codes.ok:
+            # ranges are not supported, the server is sending the whole file already
+            return self._download_stream(
+                url,
+                target_path,
+                expected_size,
+                expected_digests,
+                delete_corrupt,
+                response,
+            )
+        if response.status_code != requests.codes.partial_content or not content_range:
+            response.close()
+            return self._download_stream(
+                url, target_path, expected_size, expected_digests, delete_corrupt
+            )
+
+        total = int(content_range["total"])
+        if expected_size is not None and total != expected_size:
+            response.close()
+            raise ValueError(
+                f"{url} is {total} bytes large instead of the expected {expected_size} bytes"
+            )
+        ranges = [
+            (start, min(start + self.range_size, total) - 1)
+            for start in range(0, total, self.range_size)
+        ]
+        # make sure every range is taken from the same version of the file
+        validator = _strong_validator(response)
+
+        part_path = f"{target_path}.part"
+        sidecar = DownloadSidecar(part_path)
+        completed_ranges = sidecar.load(url, total, validator, self.range_size)
+        if (
+            completed_ranges
+            and os.path.isfile(part_path)
+            and os.path.getsize(part_path) == total
+        ):
+            tqdm.write(
+                f"Resuming download of {target_path}, {len(completed_ranges)} of {len(ranges)} parts are complete",
+                file=sys.stderr,
+            )
+        else:
+            completed_ranges = set()
+            with open(part_path, "wb") as target:
+                # preallocate, so every range can be written to its position right away
+                target.truncate(total)
+        hasher = (
+            _OrderedHasher(part_path, expected_digests) if expected_digests else None
+        )
+        if hasher is not None:
+            for start, end in ranges:
+                if start in completed_ranges:
+                    hasher.mark_written(start, end)
+        sidecar_lock = threading.Lock()
+
+        def record_completed_range(start):
+            with sidecar_lock:
+                completed_ranges.add(start)
+                if validator:
+                    sidecar.record(
+                        url, total, validator, self.range_size, completed_ranges
+                    )
+
+        with (
+            self._progress_bar(
+                target_path,
+                total,
+                initial=sum(
+                    end - start + 1
+                    for start, end in ranges
+                    if start in completed_ranges
+                ),
+            ) as bar,
+            ThreadPoolExecutor(max_workers=self.connections) as executor,
+        ):
+            if 0 in completed_ranges:
+                response.close()
+            futures = [
+                executor.submit(
+                    self._download_range,
+                    url,
+                    part_path,
+                    start,
+                    end,
+                    validator,
+                    bar,
+                    hasher,
+                    response if start == 0 else None,
+                    record_completed_range,
+                )
+                for start, end in ranges
+                if start not in completed_ranges
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        try:
+            self._verify(
+                part_path,
+                total,
+                hasher,
+                expected_digests,
+                delete_corrupt=delete_corrupt,
+            )
+        finally:
+            # a corrupt download is not worth resuming
+            sidecar.discard()
+        os.replace(part_path, target_path)
+        return target_path
+
+    def _download_stream(
+        self,
+        url,
+        target_path,
+        expected_size,
+        expected_digests,
+        delete_corrupt,
+        response=None,
+    ):
+        """
+        Helper function downloading the whole file in a single stream, for servers not supporting range requests
+
+        :param response: an already requested response for the whole file, if any
+        """
+        if response is None:
+            response = self.session.get(url, headers=self.headers, stream=True)
+            expected_digests = dict(_digests_from_headers(response), **expected_digests)
+        response.raise_for_status()
+
+        total = int(response.headers.get("content-length", 0))
+        if expected_size is not None and total and total != expected_size:
+            response.close()
+            raise ValueError(
+                f"{url} is {total} bytes large instead of the expected {expected_size} bytes"
+            )
+        part_path = f"{target_path}.part"
+        hasher = (
+            _OrderedHasher(part_path, expected_digests) if expected_digests else None
+        )
+        with (
+            response,
+            open(part_path, "wb") as target,
+            self._progress_bar(target_path, total) as bar,
+        ):
+            offset = chunk_offset = 0
+            chunk_started_at = time.monotonic()
+            for data in response.iter_content(chunk_size=1 << 20):
+                size = target.write(data)
+                if hasher is not None:
+                    hasher.update(0, offset, data)
+                with self._bar_lock:
+                    bar.update(size)
+                if self.bandwidth_limiter is not None:
+                    self.bandwidth_limiter.consume(size)
+                offset += size
+                # the stream is reported to the metrics in pieces the size of a range
+                if offset - chunk_offset >= self.range_size:
+                    self._record_chunk(chunk_offset, offset, chunk_started_at, response)
+                    chunk_offset, chunk_started_at = offset, time.monotonic()
+            if offset > chunk_offset:
+                self._record_chunk(chunk_offset, offset, chunk_started_at, response)
+
+        self._verify(
+            part_path,
+            offset,
+            hasher,
+            expected_digests,
+            expected_size=expected_size,
+            delete_corrupt=delete_corrupt,
+        )
+        os.replace(part_path, target_path)
+        return target_path
+
+    def _progress_bar(self, target_path, total, initial=0):
+        """
+        Helper function returning the progress bar to report the download of a file to
+        """
+        if self.progress is None:
+            return tqdm(
+                desc=target_path,
+                total=total,
+                initial=initial,
+                unit="iB",
+                unit_scale=True,
+                unit_divisor=1024,
+            )
+        with self._bar_lock:
+            self.progress.total += total
+            self.progress.update(initial)
+        return contextlib.nullcontext(self.progress)
+
+    @staticmethod
+    def _verify(
+        part_path,
+        size,
+        hasher,
+        expected_digests,
+        expected_size=None,
+        delete_corrupt=False,
+    ):
+        """
+        Helper function checking the downloaded file against its expected size and digests
+
+        :raise ValueError: if the file does not match
+        """
+        mismatches = []
+        if expected_size is not None and size != expected_size:
+            mismatches.append(f"size is {size} instead of {expected_size}")
+        if hasher is not None:
+            for algorithm, hexdigest in hasher.hexdigests().items():
+                if hexdigest != expected_digests[algorithm].lower():
+                    mismatches.append(
+                        f"{algorithm} is {hexdigest} instead of {expected_digests[algorithm]}"
+                    )
+        if mismatches:
+            if delete_corrupt:
+                os.remove(part_path)
+            raise ValueError(
+                f"Downloaded file {part_path} is corrupt, its {' and '.join(mismatches)}"
+            )
+
+    def _record_chunk(self, start, end, started_at, response):
+        if self.metrics is not None:
+            self.metrics.record_chunk(
+                start, end - start, time.monotonic() - started_at, response.status_code
+            )
+
+    def _download_range(
+        self,
+        url,
+        part_path,
+        start,
+        end,
+        validator,
+        bar,
+        hasher=None,
+        response=None,
+        on_complete=None,
+    ):
+        """
+        Helper function downloading a byte range of the file to its position in the target file
+
+        :param start: the first byte of the range
+        :param end: the last byte of the range (inclusive)
+        :param validator: ETag or modification date the file is expected to still have
+        :param hasher: hasher to feed the range's data to, if the file is to be verified
+        :param response: an already requested response for the range, if any
+        :param on_complete: called with the range's start once it has been written completely
+        """
+        started_at = time.monotonic()
+        with open(part_path, "r+b") as target:
+            target.seek(start)
+            if response is not None:
+                try:
+                    self._write_response(response, target, start, end, bar, hasher)
+                except (
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                ):
+                    # continue from where the response broke off
+                    pass
+            if target.tell() <= end:
+                response = self._fetch_range(
+                    url, target, start, end, validator, bar, hasher
+                )
+        self._record_chunk(start, end + 1, started_at, response)
+        if on_complete is not None:
+            on_complete(start)
+
+    @backoff.on_exception(
+        backoff.expo,
+        (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+        max_time=60,
+        on_backoff=_record_range_retry,
+    )
+    def _fetch_range(self, url, target, start, end, validator, bar, hasher):
+        """
+        Helper function requesting the rest of a byte range, continuing from the target file's current position (so a
+        retry does not fetch what has already been written)
+
+        :return: the range's response
+        """
+        position = target.tell()
+        headers = dict(self.headers, Range=f"bytes={position}-{end}")
+        if validator:
+            headers["If-Range"] = validator
+        response = self.session.get(url, headers=headers, stream=True)
+        response.raise_for_status()
+        content_range = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        if (
+            response.status_code != requests.codes.partial_content
+            or not content_range
+            or int(content_range["start"]) != position
+        ):
+            response.close()
+            raise requests.exceptions.HTTPError(
+                f"Expected bytes {position}-{end} of {url}, the file may have changed during the download",
+                response=response,
+            )
+        self._write_response(response, target, start, end, bar, hasher)
+        return response
+
+    def _write_response(self, response, target, start, end, bar, hasher):
+        with response:
+            for data in response.iter_content(chunk_size=1 << 20):
+                offset = target.tell()
+                size = target.write(data)
+                if hasher is not None:
+                    # the hasher may read the data back from the file
+                    target.flush()
+                    hasher.update(start, offset, data)
+                with self._bar_lock:
+                    bar.update(size)
+                if self.bandwidth_limiter is not None:
+                    self.bandwidth_limiter.consume(size)
+        if target.tell() <= end:
+            raise requests.exceptions.ChunkedEncodingError(
+                f"Byte range ended at {target.tell()} instead of {end + 1}"
+            )
+
+
+def _strong_validator(response):
+    """
+    :return: the response's ETag (unless it is a weak one, which cannot be used for range requests) or modification
+        date
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
@@ -0,0 +1,246 @@
+import fnmatch
+import io
+import itertools
+import os
+import zipfile
+
+import backoff
+import requests
+
+from .http_session import get_session
+from .ranged_download import _CONTENT_RANGE, _strong_validator
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    Read-only, seekable file backed by HTTP range requests, e.g. to open a remote ZIP archive with ``zipfile`` without
+    downloading all of it.
+
+    The file's tail is fetched right away, as that is where ZIP archives keep their central directory. Reads elsewhere
+    are served from a streamed range response, which is continued for as long as reads follow each other, so
+    reading a member of an archive front to back only takes a single request. Use ``prefetch`` to announce how far
+    such a read is going to go.
+
+    :param tail_size: how many bytes to fetch from the end of the file right away
+    """
+
+    def __init__(
+        self, url, authorization_header=None, session=None, tail_size=64 << 10
+    ):
+        super().__init__()
+        self.url = url
+        self.session = session or get_session()
+        self.headers = {}
+        if authorization_header:
+            self.headers["Authorization"] = authorization_header
+        self._position = 0
+        self._stream = None
+
+        # a suffix range, which servers answer with the whole file if it is shorter than that
+        response = self._get(f"bytes=-{tail_size}")
+        content_range = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        if response.status_code != requests.codes.partial_content or not content_range:
+            response.close()
+            raise ValueError(f"{url} does not support range requests")
+        self.size = int(content_range["total"])
+        self._tail_start = int(content_range["start"])
+        self._tail = response.content
+        self._validator = _strong_validator(response)
+
+    @backoff.on_exception(
+        backoff.expo, requests.exceptions.ConnectionError, max_time=60
+    )
+    def _get(self, byte_range, validator=None):
+        headers = dict(self.headers, Range=byte_range)
+        if validator:
+            headers["If-Range"] = validator
+        response = self.session.get(self.url, headers=headers, stream=True)
+        response.raise_for_status()
+        return response
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._position = offset
+        return self._position
+
+    def prefetch(self, start, end):
+        """
+        starts streaming the given byte range (end exclusive), so that reading it takes a single request
+        """
+        self._open_stream(start, min(end, self._tail_start))
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        # keep reading until the buffer is full, zipfile does not expect short reads
+        while filled < len(view) and self._position < self.size:
+            if self._position >= self._tail_start:
+                data = self._tail[self._position - self._tail_start :][
+                    : len(view) - filled
+                ]
+            else:
+                if self._stream is None or self._stream_position != self._position:
+                    self._open_stream(
+                        self._position,
+                        min(
+                            self._position + max(len(view) - filled, 64 << 10),
+                            self._tail_start,
+                        ),
+                    )
+                data = self._read_stream(len(view) - filled)
+            view[filled : filled + len(data)] = data
+            filled += len(data)
+            self._position += len(data)
+        return filled
+
+    def _open_stream(self, start, end):
+        self._close_stream()
+        if start >= end:
+            return
+        response = self._get(f"bytes={start}-{end - 1}", self._validator)
+        content_range = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        if (
+            response.status_code != requests.codes.partial_content
+            or not content_range
+            or int(content_range["start"]) != start
+        ):
+            response.close()
+            # the server ignored If-Range, so the file has changed since it has been opened
+            raise requests.HTTPError(
+                f"{self.url} has changed while reading it", response=response
+            )
+        self._stream = response
+        self._stream_chunks = response.iter_content(chunk_size=64 << 10)
+        self._stream_buffer = b""
+        self._stream_position = start
+
+    def _read_stream(self, size):
+        if not self._stream_buffer:
+            self._stream_buffer = next(self._stream_chunks, b"")
+            if not self._stream_buffer:
+                self._close_stream()
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"Range of {self.url} ended early at {self._position}"
+                )
+        data, self._stream_buffer = (
+            self._stream_buffer[:size],
+            self._stream_buffer[size:],
+        )
+        self._stream_position += len(data)
+        return data
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def close(self):
+        self._close_stream()
+        super().close()
+
+
+class _RemoteZipFile(zipfile.ZipFile):
+    def close(self):
+        # zipfile leaves files it has been given open
+        remote_file = self.fp
+        super().close()
+        if remote_file is not None:
+            remote_file.close()
+
+
+def open_remote_zip(url, authorization_header=None, session=None):
+    """
+    :return: the ZIP archive at the given url, as a ``zipfile.ZipFile`` reading only the parts of it that are needed
+    """
+    remote_file = RemoteFile(url, authorization_header, session)
+    try:
+        return _RemoteZipFile(remote_file)
+    except Exception:
+        remote_file.close()
+        raise
+
+
+def describe_member(info):
+    """
+    :return: a ZIP archive member's name, size and checksum as a dict
+    """
+    return {
+        "name": info.filename,
+        "size": info.file_size,
+        "compressed_size": info.compress_size,
+        "crc": f"{info.CRC:08x}",
+        "modified": "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(*info.date_time),
+    }
+
+
+def extract_members(archive, patterns, output_dir="."):
+    """
+    extracts the members of a remote ZIP archive matching any of the given names or glob patterns, fetching each
+    of them in a single request
+
+    :param archive: remote ZIP archive, see ``open_remote_zip``
+    :return: the paths of the extracted files
+    :raise KeyError: if a pattern does not match any member
+    """
+    infos = archive.infolist()
+    selected = []
+    for pattern in patterns:
+        matches = [
+            info
+            for info in infos
+            if info.filename == pattern or fnmatch.fnmatchcase(info.filename, pattern)
+        ]
+        if not matches:
+            raise KeyError(f"There is no member matching {pattern!r} in the archive")
+        selected.extend(info for info in matches if info not in selected)
+
+    # each member's local header and data reach up to where the next member (or the central directory) starts
+    offsets = sorted({info.header_offset for info in infos} | {archive.start_dir})
+    member_ends = dict(itertools.pairwise(offsets))
+
+    extracted_paths = []
+    for info in sorted(selected, key=lambda info: info.header_offset):
+        archive.fp.prefetch(info.header_offset, member_ends[info.header_offset])
+        extracted_paths.append(archive.extract(info, output_dir))
+    return extracted_paths
+
+
+def diff_members(archive, other_archive):
+    """
+    compares the members of two ZIP archives by their names, sizes and checksums
+
+    :return: a dict listing the names of the members only in the first ("removed") or only in the second archive
+        ("added") as well as the members differing between both ("changed")
+    """
+    members = {info.filename: info for info in archive.infolist()}
+    other_members = {info.filename: info for info in other_archive.infolist()}
+    changed = []
+    for name in sorted(members.keys() & other_members.keys()):
+        info, other_info = members[name], other_members[name]
+        if (info.file_size, info.CRC) != (other_info.file_size, other_info.CRC):
+            changed.append(
+                {
+                    "name": name,
+                    "size": [info.file_size, other_info.file_size],
+                    "crc": [f"{info.CRC:08x}", f"{other_info.CRC:08x}"],
+                }
+            )
+    return {
+        "added": sorted(other_members.keys() - members.keys()),
+        "removed": sorted(members.keys() - other_members.keys()),
+        "changed": changed,
+    }
@@ -2,18 +2,183 @@
 # Session management API client for Portal
 
 import argparse
+import heapq
 import json
 import logging
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urljoin
 
 import backoff
 import requests
 
 from .defaults import get_portal_session_management_endpoint
-from .utils import get_bearer_authorization_header
+from .http_session import get_session, is_retryable
+from .utils import get_bearer_authorization_header, read_ids
 
 logging.getLogger("backoff").addHandler(logging.StreamHandler())
 
+_DURATION_SUFFIXES = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+# names the session management service may give a VM's expiration time
+_EXPIRATION_FIELDS = ("expiration", "expirationTime", "expiresAt", "expires_at")
+
+_UTC_SUFFIX = re.compile(r"[Zz]$")
+_FRACTION = re.compile(r"\.(\d+)")
+
+# the session management service's timespans, e.g. 01:30:00 or 1.00:00:00 for a day
+_TIMESPAN = re.compile(
+    r"^(?:(?P<days>\d+)\.)?(?P<hours>\d+):(?P<minutes>\d{2}):(?P<seconds>\d{2}(?:\.\d+)?)$"
+)
+
+_VM_FILTER = re.compile(r"^(?P<field>[^!=]+)(?P<operator>!?=)(?P<value>.*)$")
+
+
+def duration_argument(value):
+    """
+    argparse type for durations in seconds, optionally suffixed with s, m, h or d, e.g. 90s or 15m
+    """
+    multiplier = _DURATION_SUFFIXES.get(value[-1:].lower())
+    if multiplier is None:
+        return float(value)
+    return float(value[:-1]) * multiplier
+
+
+def vm_filter_argument(value):
+    """
+    argparse type for VM filters, i.e. FIELD=VALUE or FIELD!=VALUE
+
+    :return: the field, whether it has to equal the value and the value
+    """
+    match = _VM_FILTER.match(value)
+    if match is None:
+        raise argparse.ArgumentTypeError(
+            f"invalid filter {value!r}, expected FIELD=VALUE or FIELD!=VALUE"
+        )
+    return match["field"].strip(), match["operator"] == "=", match["value"].strip()
+
+
+def _timespan_seconds(timespan):
+    """
+    :return: the number of seconds of a timespan as taken by ``extend_vm_expiration``, None if it cannot be parsed
+    """
+    match = _TIMESPAN.match(str(timespan).strip())
+    if match is None:
+        return None
+    return timedelta(
+        days=int(match["days"] or 0),
+        hours=int(match["hours"]),
+        minutes=int(match["minutes"]),
+        seconds=float(match["seconds"]),
+    ).total_seconds()
+
+
+def get_vms(list_vms_response):
+    """
+    :return: the VMs of a ``list_vms`` response
+    """
+    if isinstance(list_vms_response, dict):
+        return list_vms_response.get("vms") or []
+    return list_vms_response
+
+
+def get_vm_expiration(vm):
+    """
+    :return: when the VM expires as an aware datetime, None if it does not tell
+    """
+    for field in _EXPIRATION_FIELDS:
+        if vm.get(field):
+            return _parse_timestamp(vm[field])
+    return None
+
+
+def _parse_timestamp(value):
+    """
+    Helper function parsing an ISO 8601 timestamp, also in the forms older Pythons' ``datetime.fromisoformat`` does
+    not accept (a "Z" suffix, fractions of a second other than milli- or microseconds)
+
+    :return: the timestamp as an aware datetime (UTC unless it tells otherwise), None if it cannot be parsed
+    """
+    if not isinstance(value, str):
+        return None
+    value = _UTC_SUFFIX.sub("+00:00", value.strip())
+    value = _FRACTION.sub(lambda match: f".{match[1][:6]:0<6}", value)
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def select_vms(vms, ids=None, filters=(), expiring_within=None, now=None):
+    """
+    selects VMs from a list of them
+
+    :param ids: only select the VMs with the given ids
+    :param filters: only select the VMs matching all of the given filters, see ``vm_filter_argument``
+    :param expiring_within: only select the VMs expiring within the given number of seconds (or which have expired)
+    :return: the selected VMs, in the order of the list
+    """
+    now = now or datetime.now(timezone.utc)
+    ids = set(ids) if ids is not None else None
+    selected_vms = []
+    for vm in vms:
+        if ids is not None and str(vm.get("id")) not in ids:
+            continue
+        if any(
+            (str(vm.get(field)) == value) != equal for field, equal, value in filters
+        ):
+            continue
+        if expiring_within is not None:
+            expiration = get_vm_expiration(vm)
+            if (
+                expiration is None
+                or (expiration - now).total_seconds() > expiring_within
+            ):
+                continue
+        selected_vms.append(vm)
+    return selected_vms
+
+
+def diff_vms(previous_vms, vms, ignored_fields=()):
+    """
+    compares two snapshots of VMs, keyed by their id
+
+    :param ignored_fields: fields whose changes do not count, e.g. ones changing all the time
+    :return: list of events, i.e. which VMs have been "added" or "removed" and which fields of a VM have "changed"
+        (with their old and new value)
+    """
+    events = []
+    for vm_id, vm in vms.items():
+        previous_vm = previous_vms.get(vm_id)
+        if previous_vm is None:
+            events.append({"event": "added", "id": vm_id, "vm": vm})
+            continue
+        changes = {
+            field: {"old": previous_vm.get(field), "new": vm.get(field)}
+            for field in previous_vm.keys() | vm.keys()
+            if field not in ignored_fields and previous_vm.get(field) != vm.get(field)
+        }
+        if changes:
+            events.append(
+                {
+                    "event": "changed",
+                    "id": vm_id,
+                    "changes": dict(sorted(changes.items())),
+                }
+            )
+    events.extend(
+        {"event": "removed", "id": vm_id, "vm": previous_vm}
+        for vm_id, previous_vm in previous_vms.items()
+        if vm_id not in vms
+    )
+    return events
+
 
 class SessionManagementApiClient:
     """
@@ -25,34 +190,36 @@ class SessionManagementApiClient:
             base_url = get_portal_session_management_endpoint()
         self.base_url = base_url
 
+    @backoff.on_predicate(backoff.expo, is_retryable, max_time=300)
     @backoff.on_exception(
         backoff.expo, requests.exceptions.ConnectionError, max_time=60
     )
-    def list_vms(self, organization_id):
-        """
-        List VMs for an organization
-        """
-        response = requests.get(
+    def _get_vms(self, organization_id):
+        return get_session().get(
             urljoin(self.base_url, "/VirtualMachines"),
             headers={"Authorization": get_bearer_authorization_header()},
             params={"organization_id": organization_id},
             timeout=30,
         )
 
+    def list_vms(self, organization_id):
+        """
+        List VMs for an organization
+        """
+        response = self._get_vms(organization_id)
+
         if not response.ok:
             print(response.json())
         response.raise_for_status()
 
         return response.json()
 
+    @backoff.on_predicate(backoff.expo, is_retryable, max_time=300)
     @backoff.on_exception(
         backoff.expo, requests.exceptions.ConnectionError, max_time=60
     )
-    def extend_vm_expiration(self, vm_id, organization_id, timespan):
-        """
-        Extend the expiration time of a VM
-        """
-        response = requests.put(
+    def _put_vm_expiration(self, vm_id, organization_id, timespan):
+        return get_session().put(
             urljoin(self.base_url, f"/VirtualMachines/{vm_id}/Expiration"),
             headers={"Authorization": get_bearer_authorization_header()},
             params={"organization_id": organization_id},
@@ -60,12 +227,184 @@ class SessionManagementApiClient:
             timeout=30,
         )
 
+    def extend_vm_expiration(self, vm_id, organization_id, timespan):
+        """
+        Extend the expiration time of a VM
+        """
+        response = self._put_vm_expiration(vm_id, organization_id, timespan)
+
         if not response.ok:
             print(response.json())
         response.raise_for_status()
 
         return response.json()
 
+    def extend_vm_expirations(self, vm_ids, organization_id, timespan, workers=8):
+        """
+        Extend the expiration time of several VMs, up to ``workers`` at the same time
+
+        :return: generator of each VM's result in the order of the ids, i.e. its id and either the response or the
+            error the extension failed with
+        """
+
+        def extend(vm_id):
+            try:
+                response = self._put_vm_expiration(vm_id, organization_id, timespan)
+            except requests.exceptions.RequestException as error:
+                return {"id": vm_id, "status": "error", "error": str(error)}
+            try:
+                body = response.json()
+            except ValueError:
+                body = response.text
+            if not response.ok:
+                return {"id": vm_id, "status": "error", "error": body}
+            return {"id": vm_id, "status": "extended", "response": body}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(extend, vm_ids)
+
+
+def _poll_vms(client, organization_id):
+    """
+    Helper function listing the VMs of an organization for long-running commands, which have to outlive a failing
+    request rather than end with it
+
+    :return: tuple of the VMs keyed by their id (None if they could not be listed) and the error listing them failed
+        with
+    """
+    try:
+        response = client._get_vms(organization_id)
+        response.raise_for_status()
+        return {vm["id"]: vm for vm in get_vms(response.json())}, None
+    except (requests.exceptions.RequestException, ValueError) as error:
+        return None, str(error)
+
+
+def watch_vms(
+    client, organization_id, min_interval=2, max_interval=60, ignored_fields=()
+):
+    """
+    polls the VMs of an organization, keeping the last snapshot in memory. While nothing changes, the time between
+    polls doubles up to ``max_interval`` seconds, after a change it goes back to ``min_interval`` seconds. The VMs
+    there are at first count as added. A failed poll is reported as an "error" event and backed off from like a poll
+    without changes
+
+    :return: generator of lists of events (see ``diff_vms``), one per poll which found changes or failed
+    """
+    vms = {}
+    interval = min_interval
+    while True:
+        polled_vms, error = _poll_vms(client, organization_id)
+        if polled_vms is None:
+            interval = min(interval * 2, max_interval)
+            yield [{"event": "error", "error": error}]
+            time.sleep(interval)
+            continue
+        previous_vms, vms = vms, polled_vms
+        events = diff_vms(previous_vms, vms, ignored_fields)
+        if events:
+            interval = min_interval
+            yield events
+        else:
+            interval = min(interval * 2, max_interval)
+        time.sleep(interval)
+
+
+def keep_vms_alive(
+    client,
+    organization_id,
+    timespan,
+    min_remaining,
+    refresh_interval=300,
+    retry_delay=60,
+    workers=8,
+    now=None,
+    sleep=time.sleep,
+):
+    """
+    keeps the VMs of an organization from expiring, extending each of them only once it is about to expire. The VMs
+    are kept in a queue ordered by when they need to be extended, which is refreshed from the list of VMs every
+    ``refresh_interval`` seconds to learn about new and deleted VMs
+
+    :param timespan: by how much to extend a VM, as for ``extend_vm_expiration``
+    :param min_remaining: how many seconds before its expiration a VM is extended
+    :param retry_delay: after how many seconds to try again once extending a VM or listing the VMs has failed, or to
+        list the VMs again if an extension's response does not tell the new expiration time
+    :param now: function returning the current time as an aware datetime
+    :param sleep: function waiting for the given number of seconds
+    :return: generator of an event per extension, i.e. whether the VM has been "extended" (and until when, if known)
+        or the "error" it failed with, and of an "error" event per failed listing of the VMs
+    """
+    timespan_seconds = _timespan_seconds(timespan)
+    if timespan_seconds is None or timespan_seconds <= min_remaining:
+        # the extended VMs would be due again right away
+        raise ValueError(
+            f"The extension timespan {timespan} has to be longer than the minimum remaining time of "
+            f"{min_remaining:g} seconds."
+        )
+    now = now or (lambda: datetime.now(timezone.utc))
+    min_remaining = timedelta(seconds=min_remaining)
+    expirations = {}
+    queue = []
+    next_refresh = now()
+    while True:
+        current_time = now()
+        if current_time >= next_refresh:
+            vms, error = _poll_vms(client, organization_id)
+            if vms is None:
+                # keep extending the VMs known so far, and list them again soon
+                next_refresh = current_time + timedelta(seconds=retry_delay)
+                yield {"event": "error", "error": error}
+            else:
+                expirations = {}
+                for vm_id, vm in vms.items():
+                    expiration = get_vm_expiration(vm)
+                    if expiration is not None:
+                        expirations[vm_id] = expiration
+                queue = [
+                    (expiration - min_remaining, vm_id)
+                    for vm_id, expiration in expirations.items()
+                ]
+                heapq.heapify(queue)
+                next_refresh = current_time + timedelta(seconds=refresh_interval)
+
+        due_vm_ids = []
+        while queue and queue[0][0] <= current_time:
+            due_vm_ids.append(heapq.heappop(queue)[1])
+        if not due_vm_ids:
+            wake_up_time = min(queue[0][0], next_refresh) if queue else next_refresh
+            sleep(max((wake_up_time - current_time).total_seconds(), 0))
+            continue
+
+        retry_time = current_time + timedelta(seconds=retry_delay)
+        for result in client.extend_vm_expirations(
+            due_vm_ids, organization_id, timespan, workers=workers
+        ):
+            vm_id = result["id"]
+            if result["status"] == "error":
+                heapq.heappush(queue, (retry_time, vm_id))
+                yield {"event": "error", "id": vm_id, "error": result["error"]}
+                continue
+            expiration = (
+                get_vm_expiration(result["response"])
+                if isinstance(result["response"], dict)
+                else None
+            )
+            if expiration is None or expiration <= expirations[vm_id]:
+                # learn the new expiration time from the list of VMs, without extending the VM again meanwhile
+                next_refresh = min(next_refresh, retry_time)
+            else:
+                expirations[vm_id] = expiration
+                # not sooner than a retry, should the service have extended the VM by less than asked for
+                heapq.heappush(
+                    queue, (max(expiration - min_remaining, retry_time), vm_id)
+                )
+            yield {
+                "event": "extended",
+                "id": vm_id,
+                "expiration": expiration.isoformat() if expiration else None,
+            }
+
 
 def list_vms_cli(args):
     """CLI wrapper for listing VMs"""
@@ -77,10 +416,88 @@ def list_vms_cli(args):
 def extend_vm_expiration_cli(args):
     """CLI wrapper for extending VM expiration"""
     client = SessionManagementApiClient()
-    response = client.extend_vm_expiration(
-        vm_id=args.vm_id, organization_id=args.org_id, timespan=args.time
+    selectors = (
+        getattr(args, "all", False),
+        getattr(args, "ids_from", None),
+        getattr(args, "filters", None),
+        getattr(args, "expiring_within", None),
     )
-    print(json.dumps(response))
+    if not any(selectors):
+        if not args.vm_id:
+            sys.exit(
+                "Pass a VM id or select VMs with --all, --ids-from, --filter or --expiring-within"
+            )
+        response = client.extend_vm_expiration(
+            vm_id=args.vm_id, organization_id=args.org_id, timespan=args.time
+        )
+        print(json.dumps(response))
+        return
+    if args.vm_id:
+        sys.exit(
+            "Pass either a VM id or --all, --ids-from, --filter and --expiring-within"
+        )
+
+    ids = list(dict.fromkeys(read_ids(args.ids_from))) if args.ids_from else None
+    if ids is not None and not args.filters and args.expiring_within is None:
+        # there is nothing to select by but the ids, no need to list the VMs
+        vm_ids = ids
+    else:
+        vms = get_vms(client.list_vms(organization_id=args.org_id))
+        vm_ids = [
+            vm["id"] for vm in select_vms(vms, ids, args.filters, args.expiring_within)
+        ]
+    if args.dry_run:
+        for vm_id in vm_ids:
+            print(json.dumps({"id": vm_id, "status": "selected"}))
+        return
+
+    failures = 0
+    for result in client.extend_vm_expirations(
+        vm_ids, args.org_id, args.time, workers=args.workers
+    ):
+        failures += result["status"] == "error"
+        print(json.dumps(result))
+    if failures:
+        sys.exit(f"{failures} of {len(vm_ids)} VMs could not be extended")
+
+
+def watch_vms_cli(args):
+    """CLI wrapper for watching VMs"""
+    client = SessionManagementApiClient()
+    try:
+        for events in watch_vms(
+            client,
+            args.org_id,
+            min_interval=args.interval,
+            max_interval=args.max_interval,
+            ignored_fields=set(args.ignored_fields),
+        ):
+            for event in events:
+                print(json.dumps(event))
+            # hand every change on right away, e.g. to a pipe
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+
+def keep_vms_alive_cli(args):
+    """CLI wrapper for keeping VMs alive"""
+    client = SessionManagementApiClient()
+    try:
+        for event in keep_vms_alive(
+            client,
+            args.org_id,
+            args.time,
+            min_remaining=args.min_remaining,
+            refresh_interval=args.refresh,
+            workers=args.workers,
+        ):
+            print(json.dumps(event))
+            sys.stdout.flush()
+    except ValueError as error:
+        sys.exit(str(error))
+    except KeyboardInterrupt:
+        pass
 
 
 def configure_session_management_parser(parser: argparse.ArgumentParser):
@@ -98,17 +515,129 @@ def configure_session_management_parser(parser: argparse.ArgumentParser):
 
     # vm extend-expiration command
     vm_extend_parser = vm_parser.add_parser(
-        "extend-expiration", help="Extend the expiration time of a VM"
+        "extend-expiration",
+        help="Extend the expiration time of a VM, or of several VMs selected with --all, --ids-from, --filter and "
+        "--expiring-within",
+    )
+    vm_extend_parser.add_argument(
+        "vm_id", nargs="?", help="ID of the VM to extend expiration for"
     )
-    vm_extend_parser.add_argument("vm_id", help="ID of the VM to extend expiration for")
     vm_extend_parser.add_argument(
         "--org-id", type=int, required=True, help="Organization ID"
     )
     vm_extend_parser.add_argument(
         "--time", type=str, required=True, help="Extension timespan in format HH:MM:SS"
     )
+    selection_group = vm_extend_parser.add_argument_group(
+        "selection",
+        "Extend several VMs at once, selected from the organization's VMs (filters combine with each other and "
+        "with --ids-from)",
+    )
+    selection_group.add_argument(
+        "--all", action="store_true", help="Extend every VM of the organization"
+    )
+    selection_group.add_argument(
+        "--ids-from",
+        metavar="FILE",
+        help="Extend the VMs listed in the given file, one id per line. Use - to read from stdin.",
+    )
+    selection_group.add_argument(
+        "--filter",
+        metavar="FIELD=VALUE",
+        type=vm_filter_argument,
+        action="append",
+        default=[],
+        dest="filters",
+        help="Only extend VMs whose field has (or with != has not) the given value, e.g. status=running. May be "
+        "given several times.",
+    )
+    selection_group.add_argument(
+        "--expiring-within",
+        metavar="DURATION",
+        type=duration_argument,
+        help="Only extend VMs expiring within the given duration, e.g. 30m",
+    )
+    selection_group.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="How many VMs to extend at the same time. Default is 8.",
+    )
+    selection_group.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print which VMs would be extended",
+    )
     vm_extend_parser.set_defaults(func=extend_vm_expiration_cli)
 
+    # vm watch command
+    vm_watch_parser = vm_parser.add_parser(
+        "watch",
+        help="Poll the VMs of an organization and print a line of JSON whenever a VM is added, removed or changed",
+    )
+    vm_watch_parser.add_argument(
+        "--org-id", type=int, required=True, help="Organization ID to watch VMs for"
+    )
+    vm_watch_parser.add_argument(
+        "--interval",
+        metavar="DURATION",
+        type=duration_argument,
+        default=2,
+        help="Time between polls after a change, e.g. 5s. Default is 2s.",
+    )
+    vm_watch_parser.add_argument(
+        "--max-interval",
+        metavar="DURATION",
+        type=duration_argument,
+        default=60,
+        help="Time between polls the interval grows to while nothing changes, e.g. 5m. Default is 60s.",
+    )
+    vm_watch_parser.add_argument(
+        "--ignore-field",
+        metavar="FIELD",
+        action="append",
+        default=[],
+        dest="ignored_fields",
+        help="Do not report changes of the given field. May be given several times.",
+    )
+    vm_watch_parser.set_defaults(func=watch_vms_cli)
+
+    # vm keepalive command
+    vm_keepalive_parser = vm_parser.add_parser(
+        "keepalive",
+        help="Keep the VMs of an organization from expiring, extending each of them just before it expires",
+    )
+    vm_keepalive_parser.add_argument(
+        "--org-id",
+        type=int,
+        required=True,
+        help="Organization ID to keep VMs alive for",
+    )
+    vm_keepalive_parser.add_argument(
+        "--time", type=str, required=True, help="Extension timespan in format HH:MM:SS"
+    )
+    vm_keepalive_parser.add_argument(
+        "--min-remaining",
+        metavar="DURATION",
+        type=duration_argument,
+        default=15 * 60,
+        help="How long before its expiration to extend a VM, e.g. 10m. Default is 15m.",
+    )
+    vm_keepalive_parser.add_argument(
+        "--refresh",
+        metavar="DURATION",
+        type=duration_argument,
+        default=5 * 60,
+        help="How often to list the VMs to learn about new and deleted ones, e.g. 1m. Default is 5m.",
+    )
+    vm_keepalive_parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="How many VMs to extend at the same time. Default is 8.",
+    )
+    vm_keepalive_parser.set_defaults(func=keep_vms_alive_cli)
+
     return vm_parser
 
 
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from os import path
+
+METRICS_FORMATS = ("jsonl", "prometheus-textfile")
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    # nearest-rank percentile
+    rank = max(1, -(-len(sorted_values) * percentile // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class _JsonLinesMetricsWriter:
+    """
+    appends every chunk event and the final summary to the metrics file as they happen, one JSON object per line
+    """
+
+    def __init__(self, metrics_file):
+        self._metrics_file = metrics_file
+
+    def _append(self, event):
+        # appending line by line keeps the file readable while the transfer is running, even across processes
+        with open(self._metrics_file, "a", encoding="utf-8") as metrics_file:
+            metrics_file.write(json.dumps(event) + "\n")
+
+    def write_chunk(self, event):
+        self._append(dict(event, event="chunk"))
+
+    def write_summary(self, summary):
+        self._append(dict(summary, event="summary"))
+
+
+class _PrometheusTextfileMetricsWriter:
+    """
+    writes the final summary in the text format read by the node exporter's textfile collector. Prometheus scrapes
+    values rather than events, so chunk events only show up aggregated into the summary's latency quantiles
+    """
+
+    def __init__(self, metrics_file):
+        self._metrics_file = metrics_file
+
+    def write_chunk(self, event):
+        pass
+
+    def write_summary(self, summary):
+        labels = f'direction="{summary["direction"]}",name="{_escape_label(summary["name"])}"'
+        lines = []
+
+        def add_metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP innoactive_portal_transfer_{name} {help_text}")
+            lines.append(f"# TYPE innoactive_portal_transfer_{name} {metric_type}")
+            for suffix, extra_labels, value in samples:
+                if value is not None:
+                    lines.append(
+                        f"innoactive_portal_transfer_{name}{suffix}{{{labels}{extra_labels}}} {value}"
+                    )
+
+        add_metric(
+            "bytes",
+            "gauge",
+            "Bytes transferred successfully.",
+            [("", "", summary["bytes"])],
+        )
+        add_metric(
+            "duration_seconds",
+            "gauge",
+            "Duration of the transfer.",
+            [("", "", summary["seconds"])],
+        )
+        add_metric(
+            "throughput_bytes_per_second",
+            "gauge",
+            "Average throughput of the transfer.",
+            [("", "", summary["throughput"])],
+        )
+        add_metric(
+            "chunk_latency_seconds",
+            "summary",
+            "Latency of the transfer's chunks.",
+            [
+                ("", ',quantile="0.5"', summary["latency_p50"]),
+                ("", ',quantile="0.95"', summary["latency_p95"]),
+                ("", ',quantile="0.99"', summary["latency_p99"]),
+                ("_sum", "", summary["latency_sum"]),
+                ("_count", "", summary["chunks"]),
+            ],
+        )
+        add_metric(
+            "retries",
+            "gauge",
+            "Retries of the transfer's chunks.",
+            [("", "", summary["retries"])],
+        )
+
+        # write to a temporary file first, so the collector never reads a half-written file
+        temporary_path = f"{self._metrics_file}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, self._metrics_file)
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_METRICS_WRITERS = {
+    "jsonl": _JsonLinesMetricsWriter,
+    "prometheus-textfile": _PrometheusTextfileMetricsWriter,
+}
+
+
+class TransferMetrics:
+    """
+    Collects per-chunk measurements of a transfer (offset, size, latency, retries and HTTP status) and summarizes
+    them. Safe to be fed from several threads at once
+
+    :param direction: "upload" or "download"
+    :param name: the name of the transferred file, to tell transfers apart
+    :param writer: optional writer to stream chunk events and the final summary to, see ``open_transfer_metrics``
+    """
+
+    def __init__(self, direction="upload", name="", writer=None):
+        self.direction = direction
+        self.name = name
+        self.chunks = []
+        self._writer = writer
+        self._retries = defaultdict(int)
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self.sequential_fallback = False
+
+    def record_retry(self, offset):
+        with self._lock:
+            self._retries[offset] += 1
+
+    def record_sequential_fallback(self):
+        """
+        records that the server has not accepted chunks in parallel, so the rest has been transferred sequentially
+        """
+        self.sequential_fallback = True
+
+    def record_chunk(self, offset, size, seconds, status_code):
+        with self._lock:
+            chunk = {
+                "offset": offset,
+                "bytes": size,
+                "latency": seconds,
+                "retries": self._retries.pop(offset, 0),
+                "status": status_code,
+            }
+            self.chunks.append(chunk)
+            if self._writer is not None:
+                self._writer.write_chunk(
+                    dict(
+                        chunk,
+                        direction=self.direction,
+                        name=self.name,
+                        timestamp=time.time(),
+                    )
+                )
+
+    def summary(self):
+        with self._lock:
+            duration = time.monotonic() - self._started_at
+            latencies = sorted(chunk["latency"] for chunk in self.chunks)
+            transferred = sum(
+                chunk["bytes"] for chunk in self.chunks if 200 <= chunk["status"] < 300
+            )
+            return {
+                "direction": self.direction,
+                "name": self.name,
+                "chunks": len(self.chunks),
+                "bytes": transferred,
+                "seconds": duration,
+                "throughput": transferred / duration if duration > 0 else None,
+                "latency_p50": _percentile(latencies, 50),
+                "latency_p95": _percentile(latencies, 95),
+                "latency_p99": _percentile(latencies, 99),
+                "latency_sum": sum(latencies),
+                "retries": sum(chunk["retries"] for chunk in self.chunks)
+                + sum(self._retries.values()),
+                "sequential_fallback": self.sequential_fallback,
+            }
+
+    def close(self):
+        """
+        writes the final summary (if a writer has been given)
+        """
+        if self._writer is not None:
+            self._writer.write_summary(dict(self.summary(), timestamp=time.time()))
+            self._writer = None
+
+
+def open_transfer_metrics(metrics_file, metrics_format, direction, name):
+    """
+    :return: metrics for a transfer streaming to the given file in the given format, or None if no file is given
+    """
+    if not metrics_file:
+        return None
+    return TransferMetrics(
+        direction=direction,
+        name=path.basename(name),
+        writer=_METRICS_WRITERS[metrics_format](metrics_file),
+    )
+
+
+metrics_parser = argparse.ArgumentParser(add_help=False)
+metrics_group = metrics_parser.add_argument_group(
+    "metrics", "Options for Transfer Metrics"
+)
+metrics_group.add_argument(
+    "--metrics-file",
+    help="File to write per-chunk events and a final summary of the transfer to",
+)
+metrics_group.add_argument(
+    "--metrics-format",
+    choices=METRICS_FORMATS,
+    default="jsonl",
+    help="jsonl appends one JSON object per event, prometheus-textfile writes the summary for the node exporter's "
+    "textfile collector",
+)
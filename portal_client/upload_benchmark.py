@@ -0,0 +1,230 @@
+import json
+import os
+import tempfile
+from argparse import ArgumentParser
+from os import path
+from urllib.parse import urljoin
+
+import requests
+
+from .defaults import get_portal_backend_endpoint
+from .portal_chunked_upload import ChunkedUploader
+from .transfer_metrics import TransferMetrics
+from .upload_stub_server import ChunkedUploadStubServer
+from .utils import get_authorization_header
+
+_SIZE_SUFFIXES = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
+
+def size_argument(value):
+    """
+    argparse type for sizes in bytes, optionally suffixed with K, M or G (binary units), e.g. 512K or 8M
+    """
+    multiplier = _SIZE_SUFFIXES.get(value[-1:].lower())
+    if multiplier is None:
+        return int(value)
+    return int(value[:-1]) * multiplier
+
+
+def _write_synthetic_file(file_path, size, block_size=1 << 20):
+    # random data, so neither compression nor deduplication along the way skews the results
+    with open(file_path, "wb") as _file:
+        _file.writelines(
+            os.urandom(min(block_size, size - start))
+            for start in range(0, size, block_size)
+        )
+
+
+def _milliseconds(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def benchmark_upload_settings(
+    base_url, authorization_header, size, chunk_sizes, parallel_chunks_levels, repeat=1
+):
+    """
+    uploads a file of synthetic data once per combination of chunk size and number of parallel chunks (and repetition)
+
+    :return: a result per upload with its throughput, per-chunk latency percentiles, retry count and whether it fell
+        back to uploading the chunks sequentially
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = path.join(directory, "upload-benchmark.bin")
+        _write_synthetic_file(file_path, size)
+
+        for chunk_size in chunk_sizes:
+            for parallel_chunks in parallel_chunks_levels:
+                for _ in range(repeat):
+                    metrics = TransferMetrics()
+                    uploader = ChunkedUploader(
+                        base_url=base_url,
+                        authorization_header=authorization_header,
+                        metrics=metrics,
+                    )
+                    error = None
+                    try:
+                        uploader.upload_chunked_file(
+                            file_path=file_path,
+                            chunk_size_bytes=chunk_size,
+                            parallel_chunks=parallel_chunks,
+                            deduplicate=False,
+                        )
+                    except requests.exceptions.RequestException as e:
+                        error = str(e)
+
+                    summary = metrics.summary()
+                    results.append(
+                        {
+                            "chunk_size": chunk_size,
+                            "parallel_chunks": parallel_chunks,
+                            "megabytes_per_second": round(
+                                summary["throughput"] / 1e6, 2
+                            )
+                            if error is None and summary["throughput"] is not None
+                            else None,
+                            "chunks": summary["chunks"],
+                            "latency_p50_ms": _milliseconds(summary["latency_p50"]),
+                            "latency_p95_ms": _milliseconds(summary["latency_p95"]),
+                            "latency_p99_ms": _milliseconds(summary["latency_p99"]),
+                            "retries": summary["retries"],
+                            # the server refused chunks in parallel, the run measured sequential uploads instead
+                            "sequential_fallback": summary["sequential_fallback"],
+                            "error": error,
+                        }
+                    )
+    return results
+
+
+def recommend_upload_settings(results, tolerance=0.05):
+    """
+    picks the settings to recommend from the benchmark's results: among the settings reaching (almost) the best
+    throughput, the ones with the fewest parallel chunks and the smallest chunks win, as they hold the least memory
+    and lose the least progress to a failing chunk. Runs which fell back to uploading sequentially did not measure the
+    number of parallel chunks they have been started with and are left out
+
+    :param tolerance: how much slower than the best throughput settings may be to still be considered
+    :return: the recommended result or None if every upload failed or fell back
+    """
+    successful = [
+        result
+        for result in results
+        if result["error"] is None and not result.get("sequential_fallback")
+    ]
+    if not successful:
+        return None
+
+    # average repeated runs of the same settings
+    throughputs = {}
+    for result in successful:
+        key = (result["chunk_size"], result["parallel_chunks"])
+        throughputs.setdefault(key, []).append(result["megabytes_per_second"])
+    throughputs = {
+        key: sum(values) / len(values) for key, values in throughputs.items()
+    }
+
+    best_throughput = max(throughputs.values())
+    parallel_chunks, chunk_size = min(
+        (parallel_chunks, chunk_size)
+        for (chunk_size, parallel_chunks), throughput in throughputs.items()
+        if throughput >= best_throughput * (1 - tolerance)
+    )
+    return {
+        "chunk_size": chunk_size,
+        "parallel_chunks": parallel_chunks,
+        "megabytes_per_second": round(throughputs[(chunk_size, parallel_chunks)], 2),
+    }
+
+
+def upload_benchmark_cli(args):
+    benchmark_arguments = {
+        "size": args.size,
+        "chunk_sizes": args.chunk_sizes,
+        "parallel_chunks_levels": args.parallel_chunks,
+        "repeat": args.repeat,
+    }
+    if args.local:
+        with ChunkedUploadStubServer(
+            latency=args.latency / 1000,
+            drop_rate=args.drop_rate,
+            corrupt_rate=args.corrupt_rate,
+            seed=0,
+            accept_out_of_order=not args.in_order_only,
+        ) as server:
+            results = benchmark_upload_settings(
+                server.base_url, "Bearer benchmark", **benchmark_arguments
+            )
+    else:
+        results = benchmark_upload_settings(
+            urljoin(get_portal_backend_endpoint(), "/api/v2/application-builds/"),
+            get_authorization_header(),
+            **benchmark_arguments,
+        )
+
+    print(
+        json.dumps(
+            {
+                "results": results,
+                "recommendation": recommend_upload_settings(results),
+            }
+        )
+    )
+
+
+def configure_upload_benchmark_parser(parser: ArgumentParser):
+    parser.add_argument(
+        "--size",
+        type=size_argument,
+        default=64 << 20,
+        help="Size of the synthetic file uploaded per run, e.g. 256M (default: 64M)",
+    )
+    parser.add_argument(
+        "--chunk-sizes",
+        type=size_argument,
+        nargs="+",
+        default=[1 << 20, 2 << 20, 8 << 20, 32 << 20],
+        help="Chunk sizes to measure, e.g. 1M 8M (default: 1M 2M 8M 32M)",
+    )
+    parser.add_argument(
+        "--parallel-chunks",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Numbers of chunks to keep in flight at the same time to measure (default: 1 2 4)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="How many times to upload per combination of settings",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="Upload to a local stand-in server instead of Portal, e.g. in CI",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Milliseconds the local stand-in server waits before answering each request",
+    )
+    parser.add_argument(
+        "--drop-rate",
+        type=float,
+        default=0,
+        help="Fraction of requests the local stand-in server hangs up on, to exercise retries",
+    )
+    parser.add_argument(
+        "--corrupt-rate",
+        type=float,
+        default=0,
+        help="Fraction of chunks the local stand-in server receives corrupted, to exercise retries",
+    )
+    parser.add_argument(
+        "--in-order-only",
+        action="store_true",
+        help="Make the local stand-in server refuse chunks arriving ahead of their predecessors, like Portal does. "
+        "Runs with parallel chunks then fall back to uploading sequentially and are not recommended.",
+    )
+    parser.set_defaults(func=upload_benchmark_cli)
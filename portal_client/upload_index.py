@@ -0,0 +1,123 @@
+import json
+import os
+import time
+from os import path
+
+from .defaults import get_portal_cache_dir
+
+
+class UploadIndex:
+    """
+    Local index of previously uploaded files, allowing identical content to reuse the url of an earlier upload.
+
+    Files are identified by their path, size, modification time and inode, which maps them to their content's md5
+    hash without having to read them. Hashes map to the url the upload has been committed to, per endpoint. Entries
+    expire after ``ttl_seconds`` and only the ``max_entries`` most recently used entries are kept.
+    """
+
+    def __init__(self, index_path=None, ttl_seconds=7 * 24 * 3600, max_entries=1000):
+        if index_path is None:
+            index_path = path.join(get_portal_cache_dir(), "upload-index.json")
+        self.index_path = index_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    @staticmethod
+    def _file_key(file_path):
+        stat = os.stat(file_path)
+        return (
+            f"{path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{stat.st_ino}"
+        )
+
+    @staticmethod
+    def _content_key(base_url, md5):
+        return f"{base_url}|{md5}"
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("files", {})
+        index.setdefault("contents", {})
+
+        # drop expired entries
+        expired_before = time.time() - self.ttl_seconds
+        for entries in index.values():
+            for key in [
+                key
+                for key, entry in entries.items()
+                if entry["stored_at"] < expired_before
+            ]:
+                del entries[key]
+        return index
+
+    def _save(self, index):
+        # evict the least recently used entries
+        for key in ("files", "contents"):
+            entries = index[key]
+            if len(entries) > self.max_entries:
+                index[key] = dict(
+                    sorted(
+                        entries.items(),
+                        key=lambda item: item[1]["last_used"],
+                        reverse=True,
+                    )[: self.max_entries]
+                )
+
+        os.makedirs(path.dirname(self.index_path), exist_ok=True)
+        # write to a temporary file first, so concurrent uploads never read a half-written index
+        temporary_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as index_file:
+            json.dump(index, index_file)
+        os.replace(temporary_path, self.index_path)
+
+    def lookup_md5(self, file_path):
+        """
+        :return: the md5 hash of the file's content, if the file has been uploaded before and is unchanged since
+        """
+        entry = self._load()["files"].get(self._file_key(file_path))
+        return entry["md5"] if entry else None
+
+    def has_content_of_size(self, size):
+        """
+        :return: whether any file of the given size has been uploaded before, i.e. whether hashing a file of that
+            size might find an upload to reuse
+        """
+        return any(
+            entry.get("size") == size for entry in self._load()["contents"].values()
+        )
+
+    def lookup_file_url(self, base_url, md5):
+        """
+        :return: the url content with the given md5 hash has been uploaded to at the given endpoint (if any)
+        """
+        index = self._load()
+        entry = index["contents"].get(self._content_key(base_url, md5))
+        if entry is None:
+            return None
+        entry["last_used"] = time.time()
+        self._save(index)
+        return entry["file_url"]
+
+    def store(self, file_path, base_url, md5, file_url):
+        now = time.time()
+        index = self._load()
+        index["files"][self._file_key(file_path)] = {
+            "md5": md5,
+            "stored_at": now,
+            "last_used": now,
+        }
+        index["contents"][self._content_key(base_url, md5)] = {
+            "file_url": file_url,
+            "size": path.getsize(file_path),
+            "stored_at": now,
+            "last_used": now,
+        }
+        self._save(index)
+
+    def forget(self, base_url, md5):
+        index = self._load()
+        index["contents"].pop(self._content_key(base_url, md5), None)
+        self._save(index)
@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+from os import path
+
+from .defaults import get_portal_cache_dir
+
+
+class UploadJournal:
+    """
+    Small on-disk record of an ongoing chunked upload, allowing an interrupted upload to be resumed later on.
+
+    A journal is only considered valid for the exact file it has been written for, i.e. the file at the same path
+    with the same size and modification time, uploaded to the same endpoint.
+    """
+
+    def __init__(self, file_path, base_url, journal_dir=None):
+        self.file_path = path.abspath(file_path)
+        self.base_url = base_url
+        if journal_dir is None:
+            journal_dir = path.join(get_portal_cache_dir(), "uploads")
+        journal_name = hashlib.sha1(f"{base_url}|{self.file_path}".encode()).hexdigest()
+        self.journal_path = path.join(journal_dir, f"{journal_name}.json")
+
+    def _file_identity(self):
+        stat = os.stat(self.file_path)
+        return {
+            "file_path": self.file_path,
+            "file_size": stat.st_size,
+            "file_mtime": stat.st_mtime,
+            "base_url": self.base_url,
+        }
+
+    def load(self):
+        """
+        :return: the journal's entry with ``upload_id`` and acknowledged ``offset`` or None if there is no (valid)
+            journal for the file in its current state
+        """
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as journal_file:
+                entry = json.load(journal_file)
+        except (OSError, ValueError):
+            return None
+
+        identity = self._file_identity()
+        if any(entry.get(key) != value for key, value in identity.items()):
+            return None
+        return entry
+
+    def record(self, upload_id, offset):
+        """
+        persists the offset acknowledged by the server for the given upload
+        """
+        os.makedirs(path.dirname(self.journal_path), exist_ok=True)
+        entry = dict(self._file_identity(), upload_id=upload_id, offset=offset)
+        # write to a temporary file first, so a crash never leaves a half-written journal behind
+        temporary_path = f"{self.journal_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as journal_file:
+            json.dump(entry, journal_file)
+        os.replace(temporary_path, self.journal_path)
+
+    def discard(self):
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
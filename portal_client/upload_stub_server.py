@@ -0,0 +1,282 @@
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+_CHUNKED_UPLOAD_PATH = re.compile(
+    r"/chunked_uploads/(?:(?P<upload_id>[0-9a-f]+)/(?P<commit>commit/)?)?$"
+)
+_FILE_PATH = re.compile(r"/files/(?P<upload_id>[0-9a-f]+)$")
+_CONTENT_RANGE = re.compile(r"bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+)")
+
+
+def _parse_multipart(content_type, body):
+    """
+    :return: the fields of a multipart/form-data body, mapping their names to their (raw) values
+    """
+    header = Message()
+    header["Content-Type"] = content_type
+    boundary = f"--{header.get_param('boundary')}".encode()
+
+    fields = {}
+    # the parts are enclosed by the boundary, skip the preamble and the closing delimiter
+    for part in body.split(boundary)[1:-1]:
+        headers, _, value = part.partition(b"\r\n\r\n")
+        name = re.search(rb'name="([^"]*)"', headers)
+        if name is not None:
+            # strip the line break preceding the next boundary
+            fields[name.group(1).decode()] = value[:-2]
+    return fields
+
+
+class _ChunkedUploadStubHandler(BaseHTTPRequestHandler):
+    # keep connections alive, just like the real server does
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, which would otherwise stall on the client's delayed acknowledgement
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _respond(self, status, data=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _handle(self, handler):
+        server = self.server
+        body = self._read_body()
+        if server.latency:
+            time.sleep(server.latency)
+        if server.chance(server.drop_rate):
+            # mimic a connection reset by hanging up without responding
+            self.close_connection = True
+            return
+        handler(body)
+
+    def do_GET(self):
+        self._handle(self._retrieve)
+
+    def do_HEAD(self):
+        self._handle(self._retrieve)
+
+    def do_POST(self):
+        self._handle(self._create_or_commit)
+
+    def do_PUT(self):
+        self._handle(self._append_chunk)
+
+    def _retrieve(self, body):
+        server = self.server
+        match = _CHUNKED_UPLOAD_PATH.search(self.path)
+        if match and match["upload_id"] and not match["commit"]:
+            upload = server.uploads.get(match["upload_id"])
+            if upload is None:
+                return self._respond(404, {"detail": "Not found."})
+            return self._respond(
+                200, {"upload_id": match["upload_id"], "offset": upload["offset"]}
+            )
+
+        match = _FILE_PATH.search(self.path)
+        if match:
+            upload = server.uploads.get(match["upload_id"])
+            if upload is None or not upload["completed"]:
+                return self._respond(404, {"detail": "Not found."})
+            return self._respond(200, {"size": upload["offset"]})
+
+        self._respond(404, {"detail": "Not found."})
+
+    def _create_or_commit(self, body):
+        match = _CHUNKED_UPLOAD_PATH.search(self.path)
+        if match is None:
+            return self._respond(404, {"detail": "Not found."})
+        if match["commit"]:
+            return self._commit(match["upload_id"], body)
+        if match["upload_id"]:
+            return self._append_chunk(body)
+
+        fields = _parse_multipart(self.headers["Content-Type"], body)
+        chunk = fields.get("chunk")
+        if chunk is None:
+            return self._respond(400, {"chunk": ["No chunk file was submitted."]})
+        if self._chunk_too_large(chunk):
+            return self._respond(413, {"detail": "Request entity too large."})
+        chunk = self._receive_chunk(chunk)
+        if chunk is None:
+            return self._respond_chunk_digest_mismatch()
+
+        upload_id = uuid4().hex
+        upload = {
+            "md5": hashlib.md5(chunk),
+            "offset": len(chunk),
+            "pending": {},
+            "completed": False,
+        }
+        with self.server.lock:
+            self.server.uploads[upload_id] = upload
+        self._respond(200, {"upload_id": upload_id, "offset": upload["offset"]})
+
+    def _append_chunk(self, body):
+        match = _CHUNKED_UPLOAD_PATH.search(self.path)
+        if match is None or not match["upload_id"] or match["commit"]:
+            return self._respond(404, {"detail": "Not found."})
+        upload = self.server.uploads.get(match["upload_id"])
+        if upload is None:
+            return self._respond(404, {"detail": "Not found."})
+
+        fields = _parse_multipart(self.headers["Content-Type"], body)
+        chunk = fields.get("chunk")
+        content_range = _CONTENT_RANGE.match(self.headers.get("Content-Range", ""))
+        if chunk is None or content_range is None:
+            return self._respond(400, {"detail": "Invalid chunk."})
+        if self._chunk_too_large(chunk):
+            return self._respond(413, {"detail": "Request entity too large."})
+        chunk = self._receive_chunk(chunk)
+        if chunk is None:
+            return self._respond_chunk_digest_mismatch()
+
+        with self.server.lock:
+            if upload["completed"]:
+                return self._respond(
+                    400, {"detail": "Upload has already been completed."}
+                )
+            start, end = int(content_range["start"]), int(content_range["end"])
+            if start != upload["offset"] and not (
+                self.server.accept_out_of_order and start > upload["offset"]
+            ):
+                # like the real server, chunks are only accepted in order
+                return self._respond(
+                    400, {"detail": "Offsets do not match", "offset": upload["offset"]}
+                )
+            if end - start + 1 != len(chunk):
+                return self._respond(400, {"detail": "File size doesn't match headers"})
+            # chunks arriving ahead of their predecessors wait for them, the md5 hash is computed in order
+            upload["pending"][start] = chunk
+            while upload["offset"] in upload["pending"]:
+                chunk = upload["pending"].pop(upload["offset"])
+                upload["md5"].update(chunk)
+                upload["offset"] += len(chunk)
+        self._respond(
+            200, {"upload_id": match["upload_id"], "offset": upload["offset"]}
+        )
+
+    def _commit(self, upload_id, body):
+        upload = self.server.uploads.get(upload_id)
+        if upload is None:
+            return self._respond(404, {"detail": "Not found."})
+        md5 = _parse_multipart(self.headers["Content-Type"], body).get("md5", b"")
+        with self.server.lock:
+            if md5.decode() != upload["md5"].hexdigest():
+                return self._respond(400, {"detail": "md5 checksum does not match"})
+            upload["completed"] = True
+        host, port = self.server.server_address[:2]
+        self._respond(200, {"file_url": f"http://{host}:{port}/files/{upload_id}"})
+
+    def _receive_chunk(self, chunk):
+        """
+        :return: the chunk as it arrived, possibly corrupted in transit, or None if it does not match its digest
+        """
+        if self.server.chance(self.server.corrupt_rate):
+            chunk = bytes([chunk[0] ^ 0xFF]) + chunk[1:]
+        digest = self.headers.get("Content-MD5")
+        if (
+            digest is not None
+            and digest != base64.b64encode(hashlib.md5(chunk).digest()).decode()
+        ):
+            return None
+        return chunk
+
+    def _respond_chunk_digest_mismatch(self):
+        self._respond(
+            400,
+            {
+                "detail": "Content-MD5 does not match the chunk",
+                "code": "chunk_digest_mismatch",
+            },
+        )
+
+    def _chunk_too_large(self, chunk):
+        max_chunk_size = self.server.max_chunk_size
+        return max_chunk_size is not None and len(chunk) > max_chunk_size
+
+
+class ChunkedUploadStubServer(ThreadingHTTPServer):
+    """
+    Local stand-in for Portal's ``chunked_uploads/`` endpoints, accepting chunked uploads the same way the real server
+    does (chunks in order only, verifying the md5 hash on commit) without storing the uploaded data. Chunks sent with
+    a ``Content-MD5`` header are verified on arrival and refused with a ``chunk_digest_mismatch`` error if corrupted.
+
+    :param latency: seconds to wait before answering each request, to simulate a remote server
+    :param max_chunk_size: refuse chunks larger than this many bytes with 413, like a proxy limiting request sizes
+    :param drop_rate: fraction of requests to hang up on without a response, to simulate connection resets
+    :param corrupt_rate: fraction of chunks to flip a byte of on arrival, to simulate corruption in transit
+    :param accept_out_of_order: accept chunks arriving ahead of their predecessors (holding them until the gap before
+        them has been filled), unlike the real server, to measure parallel chunk uploads
+    :param seed: seed for choosing which requests to hang up on or corrupt, for reproducible runs
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        latency=0,
+        max_chunk_size=None,
+        drop_rate=0,
+        corrupt_rate=0,
+        seed=None,
+        accept_out_of_order=False,
+    ):
+        super().__init__(address, _ChunkedUploadStubHandler)
+        self.latency = latency
+        self.max_chunk_size = max_chunk_size
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.accept_out_of_order = accept_out_of_order
+        self.uploads = {}
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """
+        the url to pass as ``base_url`` to a ``ChunkedUploader``
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v2/application-builds/"
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self._random.random() < rate
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,17 +1,22 @@
 import json
+import sys
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 
+import backoff
 import requests
 
 from .defaults import get_portal_backend_endpoint
-from .pagination import pagination_parser
+from .http_session import get_session, is_retryable
+from .pagination import iterate_results, pagination_parser, print_list
+from .users import list_users
 from .utils import get_authorization_header
 
 
 def list_usergroups(**filters):
     users_url = urljoin(get_portal_backend_endpoint(), "/api/groups/")
-    response = requests.get(
+    response = get_session().get(
         users_url,
         headers={"Authorization": get_authorization_header()},
         params=filters,
@@ -25,21 +30,20 @@ def list_usergroups(**filters):
 
 
 def list_usergroups_cli(args):
-    user_list_response = list_usergroups(
+    print_list(
+        list_usergroups,
+        args,
         organization=args.organization,
         groups=args.user_groups,
-        page=args.page,
-        page_size=args.page_size,
         search=args.search,
     )
-    print(json.dumps(user_list_response))
 
 
 def add_users_to_group(group, users):
     maange_users_within_group_url = urljoin(
         get_portal_backend_endpoint(), f"/api/groups/{group}/users/"
     )
-    response = requests.post(
+    response = get_session().post(
         maange_users_within_group_url,
         headers={"Authorization": get_authorization_header()},
         json={"users": users},
@@ -65,7 +69,7 @@ def remove_user_from_group(group, user):
     maange_users_within_group_url = urljoin(
         get_portal_backend_endpoint(), f"/api/groups/{group}/users/{user}"
     )
-    response = requests.delete(
+    response = get_session().delete(
         maange_users_within_group_url,
         headers={"Authorization": get_authorization_header()},
     )
@@ -88,6 +92,141 @@ def remove_users_from_group_cli(args):
     )
 
 
+@backoff.on_predicate(backoff.expo, is_retryable, max_time=300)
+@backoff.on_exception(backoff.expo, requests.exceptions.ConnectionError, max_time=60)
+def _delete_group_member(group, user):
+    return get_session().delete(
+        urljoin(get_portal_backend_endpoint(), f"/api/groups/{group}/users/{user}"),
+        headers={"Authorization": get_authorization_header()},
+    )
+
+
+def _remove_group_member(group, user):
+    """
+    Helper function removing a user from a group, retrying while the server is throttling or unavailable
+
+    :return: the error the removal failed with, None if the user is not a member anymore
+    """
+    try:
+        response = _delete_group_member(group, user)
+    except requests.exceptions.RequestException as error:
+        return str(error)
+    # someone else has removed the user in the meantime
+    if response.ok or response.status_code == requests.codes.not_found:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+def _read_members(members_file):
+    """
+    Helper function reading the desired members of a group, one user ID or email address per line. Empty lines and
+    lines starting with # are skipped
+
+    :return: list of the user IDs (as int) and email addresses
+    """
+    members = []
+    for line in members_file:
+        member = line.strip()
+        if not member or member.startswith("#"):
+            continue
+        members.append(int(member) if member.isdigit() else member)
+    return members
+
+
+def _find_user_id(email):
+    # the search matches partially (e.g. also names), only an identical email address identifies the user
+    for user in list_users(search=email, page_size=10)["results"]:
+        if user["email"].lower() == email.lower():
+            return user["id"]
+    return None
+
+
+def sync_group_members(
+    group, members, page_size=100, workers=8, dry_run=False, allow_empty=False
+):
+    """
+    makes the given users the only members of a user group. The group's current members are fetched (page by page)
+    and compared to the desired ones: missing members are added with a single request, superfluous ones are
+    removed concurrently
+
+    :param members: IDs or email addresses of the users the group should consist of
+    :param workers: how many requests to send at the same time
+    :param dry_run: only compute which users would be added and removed
+    :param allow_empty: allow removing every member, rather than taking an empty list of members for a mistake (e.g. a
+        truncated export)
+    :return: IDs of the users "added" and "removed", how many members have been "unchanged" and the removals which
+        have "failed", with their error
+    """
+    if not members and not allow_empty:
+        raise ValueError(
+            f"No members given for group {group}, pass --allow-empty to remove every member."
+        )
+    current_members = {}
+    for user in iterate_results(list_users, page_size, workers, groups=[group]):
+        current_members[user["id"]] = user["email"].lower()
+    member_ids = {email: user_id for user_id, email in current_members.items()}
+
+    emails = [member for member in members if isinstance(member, str)]
+    unknown_emails = [email for email in emails if email.lower() not in member_ids]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for email, user_id in zip(
+            unknown_emails, executor.map(_find_user_id, unknown_emails)
+        ):
+            if user_id is None:
+                raise ValueError(f"There is no user with the email address {email}.")
+            member_ids[email.lower()] = user_id
+
+    desired_members = {
+        member_ids[member.lower()] if isinstance(member, str) else member
+        for member in members
+    }
+    additions = sorted(desired_members - current_members.keys())
+    removals = sorted(current_members.keys() - desired_members)
+    result = {
+        "added": additions,
+        "removed": removals,
+        "unchanged": len(current_members) - len(removals),
+        "failed": [],
+    }
+    if dry_run:
+        return result
+
+    if additions:
+        add_users_to_group(group=group, users=additions)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        errors = executor.map(lambda user: _remove_group_member(group, user), removals)
+        result["removed"] = []
+        for user, error in zip(removals, errors):
+            if error is None:
+                result["removed"].append(user)
+            else:
+                result["failed"].append({"id": user, "error": error})
+    return result
+
+
+def sync_group_members_cli(args):
+    with (
+        sys.stdin
+        if args.members_file == "-"
+        else open(args.members_file, "r", encoding="utf-8")
+    ) as members_file:
+        members = _read_members(members_file)
+    result = sync_group_members(
+        group=args.group,
+        members=members,
+        page_size=args.page_size,
+        workers=args.workers,
+        dry_run=args.dry_run,
+        allow_empty=args.allow_empty,
+    )
+    print(json.dumps(result))
+    if result["failed"]:
+        sys.exit(f"{len(result['failed'])} users could not be removed from the group")
+
+
 def configure_user_groups_parser(parser: ArgumentParser):
     usergroup_parser = parser.add_subparsers(
         description="List and manage user groups on Portal"
@@ -149,4 +288,40 @@ def configure_user_groups_parser(parser: ArgumentParser):
     )
     usergroup_remove_user_parser.set_defaults(func=remove_users_from_group_cli)
 
+    usergroup_sync_parser = usergroup_parser.add_parser(
+        "sync",
+        help="Adds and removes users, so a user group consists of exactly the users listed in a file.",
+    )
+    usergroup_sync_parser.add_argument(
+        "group", metavar="GROUP_ID", help="The user group (id) to sync."
+    )
+    usergroup_sync_parser.add_argument(
+        "--members-file",
+        required=True,
+        help="File listing the group's members, one user ID or email address per line. Use - to read from stdin.",
+    )
+    usergroup_sync_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print which users would be added and removed.",
+    )
+    usergroup_sync_parser.add_argument(
+        "--allow-empty",
+        action="store_true",
+        help="Remove every member if the members file lists none. Otherwise an empty file is refused.",
+    )
+    usergroup_sync_parser.add_argument(
+        "--page-size",
+        help="How many members to fetch per request. Default is 100.",
+        type=int,
+        default=100,
+    )
+    usergroup_sync_parser.add_argument(
+        "--workers",
+        help="How many requests to send at the same time. Default is 8.",
+        type=int,
+        default=8,
+    )
+    usergroup_sync_parser.set_defaults(func=sync_group_members_cli)
+
     return usergroup_parser
@@ -1,18 +1,25 @@
+import csv
 import json
+import sys
 from argparse import ArgumentParser
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from os import path
 from urllib.parse import urljoin
 
+import backoff
 import requests
 
 from .defaults import get_portal_backend_endpoint
+from .http_session import get_session, is_retryable
 from .organization import organization_parser
-from .pagination import pagination_parser
+from .pagination import pagination_parser, print_list
 from .utils import get_authorization_header
 
 
 def list_users(**filters):
     users_url = urljoin(get_portal_backend_endpoint(), "/api/users/")
-    response = requests.get(
+    response = get_session().get(
         users_url,
         headers={"Authorization": get_authorization_header()},
         params=filters,
@@ -26,20 +33,18 @@ def list_users(**filters):
 
 
 def list_users_cli(args):
-    users_response = list_users(
+    print_list(
+        list_users,
+        args,
         organization=args.organization,
         groups=args.user_groups,
-        page=args.page,
-        page_size=args.page_size,
         search=args.search,
     )
 
-    print(json.dumps(users_response))
-
 
 def create_user(**properties):
     users_url = urljoin(get_portal_backend_endpoint(), "/api/users/")
-    response = requests.post(
+    response = get_session().post(
         users_url,
         headers={"Authorization": get_authorization_header()},
         json=properties,
@@ -62,6 +67,118 @@ def create_user_cli(args):
     print(json.dumps(user_creation_response))
 
 
+@backoff.on_predicate(backoff.expo, is_retryable, max_time=300)
+@backoff.on_exception(backoff.expo, requests.exceptions.ConnectionError, max_time=60)
+def _post_user(properties):
+    return get_session().post(
+        urljoin(get_portal_backend_endpoint(), "/api/users/"),
+        headers={"Authorization": get_authorization_header()},
+        json=properties,
+    )
+
+
+def _import_user(properties):
+    """
+    Helper function creating a user, retrying while the server is throttling or unavailable
+
+    :return: the row's result, i.e. whether the user has been "created", "exists" already or the "error" it failed with
+    """
+    try:
+        response = _post_user(properties)
+    except requests.exceptions.RequestException as error:
+        return {"status": "error", "error": str(error), "input": properties}
+    if response.ok:
+        return {"status": "created", "user": response.json(), "input": properties}
+    try:
+        error = response.json()
+    except ValueError:
+        error = response.text
+    # Portal rejects duplicate email addresses as a validation error
+    already_exists = "already exists" in str(error)
+    if response.status_code == requests.codes.bad_request and already_exists:
+        return {"status": "exists", "input": properties}
+    return {"status": "error", "error": error, "input": properties}
+
+
+def _read_user_rows(users_file, file_format):
+    """
+    Helper function reading the users to import, one at a time. CSV files need a header row naming the user's
+    properties, organizations are separated by semicolons. Lines of a result file written by an earlier import are
+    read back as their input if they failed, and skipped otherwise
+
+    :return: generator of the users' properties
+    """
+    if file_format == "csv":
+        for row in csv.DictReader(users_file):
+            properties = {key: value for key, value in row.items() if key and value}
+            if "organizations" in properties:
+                properties["organizations"] = [
+                    organization.strip()
+                    for organization in properties["organizations"].split(";")
+                    if organization.strip()
+                ]
+            yield properties
+        return
+    for line in users_file:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if "status" in row and "input" in row:
+            if row["status"] == "error":
+                yield row["input"]
+            continue
+        yield row
+
+
+def import_users(rows, workers=8):
+    """
+    creates users concurrently, keeping up to ``workers`` requests in flight
+
+    :param rows: iterable of the users' properties, as for ``create_user``
+    :return: generator of each row's result (see ``_import_user``) in the order of the rows
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for row in rows:
+            # bounded, so large files are streamed rather than read all at once
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_import_user, row))
+        while pending:
+            yield pending.popleft().result()
+
+
+def import_users_cli(args):
+    file_format = args.format or (
+        "csv" if args.users_file.lower().endswith(".csv") else "ndjson"
+    )
+    results_file = args.results or (
+        f"{path.splitext(args.users_file)[0]}.results.jsonl"
+        if args.users_file != "-"
+        else "import-results.jsonl"
+    )
+    statuses = Counter()
+    with (
+        (
+            sys.stdin
+            if args.users_file == "-"
+            else open(args.users_file, "r", encoding="utf-8", newline="")
+        ) as users_file,
+        open(results_file, "w", encoding="utf-8") as results,
+    ):
+        for row_number, result in enumerate(
+            import_users(_read_user_rows(users_file, file_format), args.workers),
+            start=1,
+        ):
+            statuses[result["status"]] += 1
+            results.write(json.dumps(dict(result, row=row_number)) + "\n")
+    print(json.dumps(dict(statuses, results_file=results_file)))
+    if statuses["error"]:
+        sys.exit(
+            f"{statuses['error']} users could not be created, import {results_file} to retry them"
+        )
+
+
 def configure_users_parser(parser: ArgumentParser):
     user_parser = parser.add_subparsers(
         description="List and manage user accounts on Portal"
@@ -110,4 +227,31 @@ def configure_users_parser(parser: ArgumentParser):
     )
     user_create_parser.set_defaults(func=create_user_cli)
 
+    user_import_parser = user_parser.add_parser(
+        "import",
+        help="Creates user accounts on Portal from a CSV or JSON lines file",
+    )
+    user_import_parser.add_argument(
+        "users_file",
+        help="CSV file with a header row (e.g. email,first_name,last_name,organizations, with organization IDs "
+        "separated by semicolons) or JSON lines file with a user per line. Use - to read from stdin. A results file "
+        "of an earlier import retries the users which could not be created.",
+    )
+    user_import_parser.add_argument(
+        "--format",
+        choices=["csv", "ndjson"],
+        help="Format of the users file. Default is csv for .csv files and ndjson otherwise.",
+    )
+    user_import_parser.add_argument(
+        "--results",
+        help="JSON lines file to write the result of every user to. Default is <users_file>.results.jsonl.",
+    )
+    user_import_parser.add_argument(
+        "--workers",
+        help="How many users to create at the same time. Default is 8.",
+        type=int,
+        default=8,
+    )
+    user_import_parser.set_defaults(func=import_users_cli)
+
     return user_parser
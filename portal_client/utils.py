@@ -1,3 +1,4 @@
+import sys
 from base64 import b64encode
 from os import getenv
 
@@ -35,3 +36,15 @@ def get_bearer_authorization_header():
     raise Exception(
         "Missing authentication! Please specify either PORTAL_BACKEND_ACCESS_TOKEN or PORTAL_BACKEND_USERNAME and PORTAL_BACKEND_PASSWORD"
     )
+
+
+def read_ids(ids_file):
+    """
+    :return: the ids listed in the given file (or stdin for "-"), one per line, skipping empty lines and comments
+    """
+    if ids_file == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(ids_file, "r", encoding="utf-8") as _file:
+            lines = _file.readlines()
+    return [line.strip() for line in lines if line.strip() and not line.startswith("#")]
@@ -0,0 +1,83 @@
+import io
+import time
+
+import pytest
+import requests_mock
+
+from portal_client import parser
+from portal_client.applications_v2 import download_application_builds
+from portal_client.ranged_download import BandwidthLimiter
+
+BUILDS_URL = "https://api.innoactive.io/api/v2/application-builds/"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    "Keeps the build cache of each test apart"
+    monkeypatch.setenv("PORTAL_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+
+
+def mock_builds(requests_mock: requests_mock.Mocker, build_ids):
+    for build_id in build_ids:
+        requests_mock.get(
+            f"{BUILDS_URL}{build_id}/",
+            json={
+                "application_archive": f"https://storage.test.org/{build_id}/build.zip?sig=1"
+            },
+        )
+        requests_mock.get(
+            f"https://storage.test.org/{build_id}/build.zip",
+            content=f"build {build_id}".encode(),
+        )
+
+
+def test_batch_download_saves_every_build(
+    requests_mock: requests_mock.Mocker, tmp_path
+):
+    # Given three builds, one of which does not exist
+    mock_builds(requests_mock, ["1", "2"])
+    requests_mock.get(f"{BUILDS_URL}3/", status_code=404)
+
+    # When downloading all of them
+    results = download_application_builds(
+        ["1", "2", "3", "1"], output_dir=str(tmp_path / "lab"), parallel_builds=2
+    )
+
+    # Expect the existing builds to be downloaded, once each, and the missing one to be reported
+    assert [result["id"] for result in results] == ["1", "2", "3"]
+    assert results[0]["path"] == str(tmp_path / "lab" / "1" / "build.zip")
+    assert (tmp_path / "lab" / "1" / "build.zip").read_bytes() == b"build 1"
+    assert (tmp_path / "lab" / "2" / "build.zip").read_bytes() == b"build 2"
+    assert "404" in results[2]["error"]
+
+
+def test_batch_download_reads_ids_from_stdin(
+    requests_mock: requests_mock.Mocker, monkeypatch, capsys
+):
+    # Given build ids piped in, e.g. from a provisioning script
+    mock_builds(requests_mock, ["1", "2", "3"])
+    monkeypatch.setattr("sys.stdin", io.StringIO("# lab builds\n2\n\n3\n"))
+
+    # When downloading them along with a build given on the command line
+    args = parser.parse_args(
+        ["applications", "v2", "builds", "download", "1", "--ids-from", "-"]
+    )
+    args.func(args)
+
+    # Expect a downloaded file per build, in the order given
+    paths = capsys.readouterr().out.splitlines()
+    assert [path.split("/")[-2] for path in paths] == ["1", "2", "3"]
+
+
+def test_bandwidth_limiter_throttles_combined_throughput():
+    # Given a limit of 1 MB/s
+    limiter = BandwidthLimiter(1_000_000)
+
+    # When transferring 300 KB
+    started_at = time.monotonic()
+    for _ in range(3):
+        limiter.consume(100_000)
+
+    # Expect it to take 0.3 seconds
+    assert 0.25 <= time.monotonic() - started_at < 1
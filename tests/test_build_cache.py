@@ -0,0 +1,86 @@
+import pytest
+import requests_mock
+
+from portal_client.applications_v2 import download_application_build
+from portal_client.build_cache import BuildCache
+
+BUILD_URL = "https://api.innoactive.io/api/v2/application-builds/42/"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    "Keeps the build cache of each test apart"
+    monkeypatch.setenv("PORTAL_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+    return tmp_path / "cache"
+
+
+def test_repeated_download_is_served_from_cache(requests_mock: requests_mock.Mocker):
+    # Given a build
+    requests_mock.get(
+        BUILD_URL,
+        json={"application_archive": "https://storage.test.org/build.zip?sig=1"},
+    )
+    requests_mock.get("https://storage.test.org/build.zip", content=b"build")
+
+    # When downloading it twice
+    first_path = download_application_build("42")
+    second_path = download_application_build("42")
+
+    # Expect the archive to only be downloaded once
+    assert first_path == second_path
+    assert first_path.endswith("build.zip")
+    archive_requests = [
+        request
+        for request in requests_mock.request_history
+        if request.hostname == "storage.test.org"
+    ]
+    assert len(archive_requests) == 1
+
+
+def test_changed_build_is_downloaded_again(requests_mock: requests_mock.Mocker):
+    # Given a build whose archive got replaced after it has been downloaded
+    requests_mock.get(
+        BUILD_URL,
+        [
+            {"json": {"application_archive": "https://storage.test.org/v1.zip"}},
+            {"json": {"application_archive": "https://storage.test.org/v2.zip"}},
+        ],
+    )
+    requests_mock.get("https://storage.test.org/v1.zip", content=b"old")
+    requests_mock.get("https://storage.test.org/v2.zip", content=b"new")
+    with open(download_application_build("42"), "rb") as archive:
+        assert archive.read() == b"old"
+
+    # When downloading it again
+    with open(download_application_build("42"), "rb") as archive:
+        # Expect the new archive
+        assert archive.read() == b"new"
+
+
+def test_least_recently_used_builds_are_evicted(cache_dir):
+    # Given a cache holding up to 10 bytes with two builds of 4 bytes each
+    cache = BuildCache(max_size=10)
+    for build_id in ("1", "2"):
+        build_path = cache.target_path(build_id, "build.zip")
+        with open(build_path, "wb") as archive:
+            archive.write(b"1234")
+        cache.store(
+            build_id,
+            {"application_archive": f"https://test.org/{build_id}"},
+            build_path,
+        )
+    # the first build has been used more recently
+    assert cache.lookup("1", {"application_archive": "https://test.org/1"})
+
+    # When adding a third build
+    build_path = cache.target_path("3", "build.zip")
+    with open(build_path, "wb") as archive:
+        archive.write(b"1234")
+    cache.store("3", {"application_archive": "https://test.org/3"}, build_path)
+
+    # Expect the least recently used build to be evicted
+    assert cache.lookup("1", {"application_archive": "https://test.org/1"})
+    assert cache.lookup("2", {"application_archive": "https://test.org/2"}) is None
+    assert cache.lookup("3", {"application_archive": "https://test.org/3"})
+    assert not (cache_dir / "builds" / "2").exists()
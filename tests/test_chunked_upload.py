@@ -0,0 +1,509 @@
+import base64
+import hashlib
+import mmap
+import re
+import threading
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+import requests
+import requests_mock
+
+from portal_client import parser
+from portal_client.client_application_uploader import ClientApplicationApiClient
+from portal_client.portal_chunked_upload import (
+    AUTO_CHUNK_SIZE,
+    ChunkedUploader,
+    _AdaptiveChunkSizer,
+)
+from portal_client.upload_journal import UploadJournal
+
+BASE_URL = "https://test.org/api/v2/application-builds/"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    "Keeps upload journals and the upload index of each test apart"
+    monkeypatch.setenv("PORTAL_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive_path = tmp_path / "build.zip"
+    archive_path.write_bytes(bytes(range(256)) * 1000)
+    return archive_path
+
+
+def chunk_payload(request):
+    "Extracts the bytes of the multipart chunk field from a recorded request"
+    boundary = request.headers["Content-Type"].split("boundary=")[1].encode()
+    body = request.body if isinstance(request.body, bytes) else b"".join(request.body)
+    start = body.index(b"\r\n\r\n", body.index(b'name="chunk"')) + 4
+    end = body.index(b"\r\n--" + boundary, start)
+    return body[start:end]
+
+
+@pytest.fixture
+def chunked_upload_api(requests_mock: requests_mock.Mocker):
+    "Mocks the chunked upload endpoints, acknowledging every chunk with the offset following it"
+
+    def acknowledge_chunk(request, context):
+        match = re.search(r"bytes (\d+)-(\d+)/", request.headers["Content-Range"])
+        return {"upload_id": "upload-1", "offset": int(match.group(2)) + 1}
+
+    def acknowledge_first_chunk(request, context):
+        return {"upload_id": "upload-1", "offset": len(chunk_payload(request))}
+
+    requests_mock.post(BASE_URL + "chunked_uploads/", json=acknowledge_first_chunk)
+    requests_mock.put(BASE_URL + "chunked_uploads/upload-1/", json=acknowledge_chunk)
+    requests_mock.post(
+        BASE_URL + "chunked_uploads/upload-1/commit/",
+        json={"file_url": "https://storage.test.org/build.zip"},
+    )
+    return requests_mock
+
+
+def _committed_md5(mocker):
+    commit_request = mocker.request_history[-1]
+    assert commit_request.url.endswith("/commit/")
+    return re.search(
+        rb'name="md5"[^\r]*\r\n\r\n([0-9a-f]+)', commit_request.body
+    ).group(1)
+
+
+def test_upload_commits_md5_computed_while_streaming(chunked_upload_api, archive):
+    # Given an uploader keeping track of how often the archive gets opened and mapped
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    opened_paths = []
+    mappings = []
+    original_mmap = mmap.mmap
+
+    def tracking_open(file, *args, **kwargs):
+        opened_paths.append(str(file))
+        return open(file, *args, **kwargs)
+
+    def tracking_mmap(*args, **kwargs):
+        mappings.append(original_mmap(*args, **kwargs))
+        return mappings[-1]
+
+    # When uploading the archive
+    with (
+        patch("portal_client.portal_chunked_upload.open", tracking_open, create=True),
+        patch("portal_client.portal_chunked_upload.mmap.mmap", tracking_mmap),
+    ):
+        file_url = uploader.upload_chunked_file(
+            str(archive), chunk_size_bytes=64 * 1024
+        )
+
+    # Expect the archive to be read in a single pass, for both uploading and hashing
+    assert opened_paths == [str(archive)]
+    assert len(mappings) == 1
+
+    # Expect all chunks to be sent and the upload to be committed with the md5 of the whole file
+    assert chunked_upload_api.call_count == 2 + 256000 // (64 * 1024)
+    assert file_url == "https://storage.test.org/build.zip"
+    assert (
+        _committed_md5(chunked_upload_api).decode()
+        == hashlib.md5(archive.read_bytes()).hexdigest()
+    )
+
+
+def test_upload_commits_explicit_md5(chunked_upload_api, archive):
+    # Given an explicitly provided md5 hash
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+
+    # When uploading the archive
+    uploader.upload_chunked_file(
+        str(archive), md5="0123456789abcdef", chunk_size_bytes=64 * 1024
+    )
+
+    # Expect the explicit hash to be committed
+    assert _committed_md5(chunked_upload_api) == b"0123456789abcdef"
+
+
+def test_resume_interrupted_upload_from_acknowledged_offset(
+    chunked_upload_api, archive, tmp_path, monkeypatch
+):
+    # Given an upload which got interrupted after the first two chunks have been acknowledged
+    monkeypatch.setenv("PORTAL_CACHE_DIR", str(tmp_path / "cache"))
+    chunk_size = 64 * 1024
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+
+    def acknowledge_chunk_until_interrupted(request, context):
+        match = re.search(r"bytes (\d+)-(\d+)/", request.headers["Content-Range"])
+        if int(match.group(1)) >= 2 * chunk_size:
+            context.status_code = 502
+            return {"detail": "Bad Gateway"}
+        return {"upload_id": "upload-1", "offset": int(match.group(2)) + 1}
+
+    chunked_upload_api.put(
+        BASE_URL + "chunked_uploads/upload-1/", json=acknowledge_chunk_until_interrupted
+    )
+    with pytest.raises(requests.HTTPError):
+        uploader.upload_chunked_file(
+            str(archive), chunk_size_bytes=chunk_size, resume=True
+        )
+
+    # When resuming the upload against a server which still knows about it
+    chunked_upload_api.reset_mock()
+    chunked_upload_api.get(
+        BASE_URL + "chunked_uploads/upload-1/",
+        json={"upload_id": "upload-1", "offset": 2 * chunk_size},
+    )
+    chunked_upload_api.put(
+        BASE_URL + "chunked_uploads/upload-1/",
+        json=lambda request, context: {
+            "offset": int(re.search(r"-(\d+)/", request.headers["Content-Range"])[1])
+            + 1
+        },
+    )
+    file_url = uploader.upload_chunked_file(
+        str(archive), chunk_size_bytes=chunk_size, resume=True
+    )
+
+    # Expect no new upload to be created and only the remaining chunks to be sent
+    assert file_url == "https://storage.test.org/build.zip"
+    methods = [request.method for request in chunked_upload_api.request_history]
+    assert methods == ["GET", "PUT", "PUT", "POST"]
+    assert (
+        chunked_upload_api.request_history[1]
+        .headers["Content-Range"]
+        .startswith(f"bytes {2 * chunk_size}-")
+    )
+    # Expect the commit to still cover the whole file
+    assert (
+        _committed_md5(chunked_upload_api).decode()
+        == hashlib.md5(archive.read_bytes()).hexdigest()
+    )
+    # Expect the journal to be cleaned up after a successful commit
+    assert not list((tmp_path / "cache" / "uploads").iterdir())
+
+
+@pytest.mark.parametrize("accepts_out_of_order_chunks", [True, False])
+def test_parallel_chunk_upload(
+    chunked_upload_api, archive, tmp_path, accepts_out_of_order_chunks
+):
+    # Given a server which may only accept chunks continuing exactly at its current offset
+    chunk_size = 16 * 1024
+    received = {}
+    lock = threading.Lock()
+
+    def receive_chunk(request, context):
+        start = int(re.search(r"bytes (\d+)-", request.headers["Content-Range"])[1])
+        with lock:
+            server_offset = max(received.values(), default=0)
+            if not accepts_out_of_order_chunks and start != server_offset:
+                context.status_code = 400
+                return {"detail": "Offsets do not match"}
+            received[start] = start + len(chunk_payload(request))
+            return {"offset": max(received.values())}
+
+    def receive_first_chunk(request, context):
+        received[0] = len(chunk_payload(request))
+        return {"upload_id": "upload-1", "offset": received[0]}
+
+    def retrieve_upload(request, context):
+        with lock:
+            return {"offset": max(received.values())}
+
+    chunked_upload_api.post(BASE_URL + "chunked_uploads/", json=receive_first_chunk)
+    chunked_upload_api.put(BASE_URL + "chunked_uploads/upload-1/", json=receive_chunk)
+    chunked_upload_api.get(BASE_URL + "chunked_uploads/upload-1/", json=retrieve_upload)
+
+    # When uploading with several chunks in flight
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    uploader.upload_chunked_file(
+        str(archive), chunk_size_bytes=chunk_size, parallel_chunks=4
+    )
+
+    # Expect every byte of the file to have been received by the server, and the whole file to be committed
+    offset = 0
+    while offset in received:
+        offset = received[offset]
+    assert offset == archive.stat().st_size
+    assert (
+        _committed_md5(chunked_upload_api).decode()
+        == hashlib.md5(archive.read_bytes()).hexdigest()
+    )
+
+
+def _peak_memory_of_upload(requests_mock, file_path, chunk_size):
+    "Uploads the file against a mocked server which consumes the request bodies like a socket would"
+
+    def consume_chunk(request, context):
+        body_size = sum(memoryview(piece).nbytes for piece in request.body)
+        assert body_size == int(request.headers["Content-Length"])
+        match = re.search(
+            r"bytes (\d+)-(\d+)/", request.headers.get("Content-Range", "")
+        )
+        offset = int(match.group(2)) + 1 if match else chunk_size
+        return {"upload_id": "upload-1", "offset": offset}
+
+    requests_mock.post(BASE_URL + "chunked_uploads/", json=consume_chunk)
+    requests_mock.put(BASE_URL + "chunked_uploads/upload-1/", json=consume_chunk)
+
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    tracemalloc.start()
+    try:
+        uploader.upload_chunked_file(str(file_path), chunk_size_bytes=chunk_size)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_upload_peak_memory_does_not_grow_with_file_size(chunked_upload_api, tmp_path):
+    # Given a small and a large file, uploaded in large chunks
+    chunk_size = 4 << 20
+    small_file = tmp_path / "small.zip"
+    small_file.write_bytes(b"\1" * (2 * chunk_size))
+    large_file = tmp_path / "large.zip"
+    large_file.write_bytes(b"\1" * (8 * chunk_size))
+
+    # When uploading both files
+    small_file_peak = _peak_memory_of_upload(chunked_upload_api, small_file, chunk_size)
+    large_file_peak = _peak_memory_of_upload(chunked_upload_api, large_file, chunk_size)
+
+    # Expect the chunks to never be copied into memory, regardless of the file's size
+    assert small_file_peak < chunk_size // 4
+    assert large_file_peak < chunk_size // 4
+
+
+def test_adaptive_chunk_size_grows_until_goodput_stops_improving():
+    # Given a connection with 50ms round trip time and 10 MiB/s bandwidth
+    sizer = _AdaptiveChunkSizer(initial_chunk_size=256 << 10, max_chunk_size=64 << 20)
+
+    def upload_duration(chunk_size):
+        return 0.05 + chunk_size / (10 << 20)
+
+    # When uploading a bunch of chunks
+    for _ in range(20):
+        sizer.record(sizer.chunk_size, upload_duration(sizer.chunk_size))
+
+    # Expect the chunk size to settle where the round trip time stops mattering
+    assert sizer.settled
+    assert 1 << 20 <= sizer.chunk_size <= 8 << 20
+
+
+def _size_limited_chunk_receiver(max_chunk_size, accepted_ranges):
+    "Mocks chunk endpoints refusing chunks larger than the given size"
+
+    def receive_chunk(request, context):
+        chunk_size = len(chunk_payload(request))
+        if chunk_size > max_chunk_size:
+            context.status_code = 413
+            return {"detail": "Request Entity Too Large"}
+        if "Content-Range" not in request.headers:
+            accepted_ranges.append((0, chunk_size))
+            return {"upload_id": "upload-1", "offset": chunk_size}
+        match = re.search(r"bytes (\d+)-(\d+)/", request.headers["Content-Range"])
+        accepted_ranges.append((int(match.group(1)), int(match.group(2)) + 1))
+        return {"offset": int(match.group(2)) + 1}
+
+    return receive_chunk
+
+
+def test_adaptive_chunk_size_respects_server_limit(chunked_upload_api, archive):
+    # Given a server refusing chunks (including the first one) larger than 300 KiB
+    accepted_ranges = []
+    receive_chunk = _size_limited_chunk_receiver(300 << 10, accepted_ranges)
+    chunked_upload_api.post(BASE_URL + "chunked_uploads/", json=receive_chunk)
+    chunked_upload_api.put(BASE_URL + "chunked_uploads/upload-1/", json=receive_chunk)
+    archive.write_bytes(b"\1" * (4 << 20))
+
+    # When uploading with an adaptive chunk size
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    uploader.upload_chunked_file(str(archive), chunk_size_bytes=AUTO_CHUNK_SIZE)
+
+    # Expect the whole file to be uploaded, contiguously, in chunks the server accepts
+    offset = 0
+    for start, end in accepted_ranges:
+        assert start == offset
+        offset = end
+    assert offset == 4 << 20
+    assert (
+        _committed_md5(chunked_upload_api).decode()
+        == hashlib.md5(archive.read_bytes()).hexdigest()
+    )
+
+
+def test_adaptive_chunk_size_gives_up_below_minimum_chunk_size(
+    chunked_upload_api, archive
+):
+    # Given a server refusing any chunk larger than 100 KiB, below the smallest chunk size used
+    receive_chunk = _size_limited_chunk_receiver(100 << 10, [])
+    chunked_upload_api.post(BASE_URL + "chunked_uploads/", json=receive_chunk)
+    archive.write_bytes(b"\1" * (4 << 20))
+
+    # When uploading with an adaptive chunk size
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+
+    # Expect the upload to fail instead of retrying forever
+    with pytest.raises(requests.HTTPError):
+        uploader.upload_chunked_file(str(archive), chunk_size_bytes=AUTO_CHUNK_SIZE)
+    assert chunked_upload_api.call_count == 3
+
+
+def test_upload_unmaps_file_after_upload(chunked_upload_api, archive):
+    # Given an uploader keeping track of the memory mappings it creates
+    mappings = []
+    original_mmap = mmap.mmap
+
+    def tracking_mmap(*args, **kwargs):
+        mappings.append(original_mmap(*args, **kwargs))
+        return mappings[-1]
+
+    # When uploading the archive
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    with patch("portal_client.portal_chunked_upload.mmap.mmap", tracking_mmap):
+        uploader.upload_chunked_file(str(archive), chunk_size_bytes=64 * 1024)
+
+    # Expect the file's mapping to be closed as soon as the upload is done
+    assert len(mappings) == 1
+    assert mappings[0].closed
+
+
+@pytest.mark.parametrize(
+    "status_code, journal_kept", [(404, False), (410, False), (503, True)]
+)
+def test_resume_lookup_failure(
+    chunked_upload_api, archive, tmp_path, monkeypatch, status_code, journal_kept
+):
+    # Given the journal of an interrupted upload
+    monkeypatch.setenv("PORTAL_CACHE_DIR", str(tmp_path / "cache"))
+    UploadJournal(str(archive), BASE_URL).record("upload-1", 64 * 1024)
+
+    # When the server fails to report on the upload while resuming it
+    chunked_upload_api.get(
+        BASE_URL + "chunked_uploads/upload-1/", status_code=status_code, json={}
+    )
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    if journal_kept:
+        with pytest.raises(requests.HTTPError):
+            uploader.upload_chunked_file(str(archive), resume=True)
+    else:
+        uploader.upload_chunked_file(str(archive), resume=True)
+
+    # Expect the journal to only be dropped if the server does not know the upload (anymore)
+    journal_entries = list((tmp_path / "cache" / "uploads").glob("*.json"))
+    assert bool(journal_entries) == journal_kept
+
+
+def test_upload_reuses_earlier_upload_of_identical_content(
+    chunked_upload_api, archive, tmp_path, capsys
+):
+    # Given an archive which has been uploaded before, and a byte-identical copy of it
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    uploader.upload_chunked_file(str(archive), chunk_size_bytes=64 * 1024)
+    copy = tmp_path / "copy.zip"
+    copy.write_bytes(archive.read_bytes())
+    chunked_upload_api.head("https://storage.test.org/build.zip")
+    chunked_upload_api.reset_mock()
+
+    # When uploading the archive and its copy again
+    file_urls = [
+        uploader.upload_chunked_file(str(archive), chunk_size_bytes=64 * 1024),
+        uploader.upload_chunked_file(str(copy), chunk_size_bytes=64 * 1024),
+    ]
+
+    # Expect the earlier upload to be reused after checking it still exists
+    assert file_urls == ["https://storage.test.org/build.zip"] * 2
+    methods = [request.method for request in chunked_upload_api.request_history]
+    assert methods == ["HEAD", "HEAD"]
+    # and the notice not to end up in front of a command's output
+    output = capsys.readouterr()
+    assert output.out == ""
+    assert "Skipping upload" in output.err
+
+
+def test_upload_without_deduplication(chunked_upload_api, archive):
+    # Given an archive which has been uploaded before
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    uploader.upload_chunked_file(str(archive), chunk_size_bytes=64 * 1024)
+    chunked_upload_api.reset_mock()
+
+    # When uploading it again with deduplication turned off
+    uploader.upload_chunked_file(
+        str(archive), chunk_size_bytes=64 * 1024, deduplicate=False
+    )
+
+    # Expect the archive to be uploaded in full again
+    assert chunked_upload_api.call_count == 2 + 256000 // (64 * 1024)
+
+
+def test_client_application_upload_without_deduplication(archive, monkeypatch):
+    # Given a client application binary
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+    client = ClientApplicationApiClient("https://test.org")
+
+    # When uploading it with deduplication turned off
+    with patch.object(ChunkedUploader, "upload_chunked_file") as upload_chunked_file:
+        client.upload_version_binary(str(archive), deduplicate=False)
+
+    # Expect it to be uploaded regardless of earlier uploads
+    assert upload_chunked_file.call_args.kwargs["deduplicate"] is False
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        ["upload-app", "build.zip", "--version", "1.0.0", "--name", "Demo"]
+        + ["--organization-ids", "3"],
+        ["upload-client", "--binary", "client.exe", "--slug", "desktop-client"]
+        + ["--version", "1.0.0"],
+    ],
+)
+def test_upload_commands_can_turn_off_deduplication(command):
+    # Given an upload command
+    # When parsing its arguments
+    # Expect deduplication to be turned off only if asked to
+    assert parser.parse_args([*command, "--no-deduplicate"]).deduplicate is False
+    assert parser.parse_args(command).deduplicate is True
+
+
+def test_upload_does_not_reuse_vanished_upload(chunked_upload_api, archive):
+    # Given an archive which has been uploaded before, but is gone from the server
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    uploader.upload_chunked_file(str(archive), chunk_size_bytes=64 * 1024)
+    chunked_upload_api.head("https://storage.test.org/build.zip", status_code=404)
+    chunked_upload_api.reset_mock()
+
+    # When uploading it again
+    uploader.upload_chunked_file(str(archive), chunk_size_bytes=64 * 1024)
+
+    # Expect the archive to be uploaded in full again
+    assert chunked_upload_api.call_count == 1 + 2 + 256000 // (64 * 1024)
+
+
+def test_chunk_digest_mismatch_gives_up_after_retrying_the_chunk(
+    chunked_upload_api, archive
+):
+    # Given a server refusing the second chunk as corrupted every single time
+    chunk_size = 64 * 1024
+    uploader = ChunkedUploader(BASE_URL, "Bearer test-token")
+    received_chunks = []
+
+    def refuse_chunk(request, context):
+        received_chunks.append(
+            (
+                request.headers["Content-Range"],
+                request.headers["Content-MD5"],
+                base64.b64encode(hashlib.md5(chunk_payload(request)).digest()).decode(),
+            )
+        )
+        context.status_code = 400
+        return {"detail": "Content-MD5 mismatch", "code": "chunk_digest_mismatch"}
+
+    chunked_upload_api.put(BASE_URL + "chunked_uploads/upload-1/", json=refuse_chunk)
+
+    # When uploading the archive
+    with pytest.raises(requests.HTTPError):
+        uploader.upload_chunked_file(str(archive), chunk_size_bytes=chunk_size)
+
+    # Expect only the refused chunk to be retried, a few times, each time carrying its digest
+    assert chunked_upload_api.request_history[0].headers["Content-MD5"]
+    assert len(received_chunks) == 4
+    for content_range, sent_digest, actual_digest in received_chunks:
+        assert content_range == f"bytes {chunk_size}-{2 * chunk_size - 1}/256000"
+        assert sent_digest == actual_digest
@@ -0,0 +1,178 @@
+import json
+
+import pytest
+import requests
+import requests_mock
+
+from portal_client import parser
+
+API_URL = "https://api.innoactive.io/api/"
+MEMBERS_URL = f"{API_URL}groups/7/users/"
+
+MEMBERS = [
+    {"id": user_id, "email": f"trainee{user_id}@acme.org"} for user_id in range(1, 26)
+]
+
+
+@pytest.fixture(autouse=True)
+def authentication(monkeypatch):
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+
+
+def serve_users(requests_mock: requests_mock.Mocker, members, others=()):
+    "Answers paginated requests for the group's members as well as searches for any user"
+
+    def respond(request, context):
+        if "search" in request.qs:
+            results = [
+                user
+                for user in [*members, *others]
+                if request.qs["search"][0] in user["email"]
+            ]
+            return {
+                "count": len(results),
+                "next": None,
+                "previous": None,
+                "results": results,
+            }
+        assert request.qs["groups"] == ["7"]
+        page = int(request.qs["page"][0])
+        page_size = int(request.qs["page_size"][0])
+        start = (page - 1) * page_size
+        return {
+            "count": len(members),
+            "next": "next" if start + page_size < len(members) else None,
+            "previous": None,
+            "results": members[start : start + page_size],
+        }
+
+    requests_mock.get(f"{API_URL}users/", json=respond)
+
+
+def sync_group(*arguments):
+    args = parser.parse_args(["groups", "sync", "7", *arguments])
+    args.func(args)
+
+
+def test_sync_adds_and_removes_the_differences(
+    requests_mock: requests_mock.Mocker, tmp_path, capsys
+):
+    # Given a group of 25 members, two of which are throttled at first when removed
+    serve_users(
+        requests_mock, MEMBERS, others=[{"id": 40, "email": "new.hire@acme.org"}]
+    )
+    add_users = requests_mock.post(MEMBERS_URL, json={})
+    throttled = set()
+
+    def remove_user(request, context):
+        user = request.path.rstrip("/").rsplit("/", 1)[1]
+        if user in ("3", "4") and user not in throttled:
+            throttled.add(user)
+            context.status_code = 429
+        return {}
+
+    for user_id in range(1, 6):
+        requests_mock.delete(f"{MEMBERS_URL}{user_id}", json=remove_user)
+
+    # When syncing it with a file keeping all but the first five members and adding two others
+    members_file = tmp_path / "members.txt"
+    members_file.write_text(
+        "# trainers\n"
+        + "".join(f"{user_id}\n" for user_id in range(6, 26))
+        + "\nnew.hire@acme.org\n41\n"
+    )
+    sync_group("--members-file", str(members_file), "--page-size", "10")
+
+    # Expect the additions to be sent at once and a removal per former member
+    assert json.loads(capsys.readouterr().out) == {
+        "added": [40, 41],
+        "removed": [1, 2, 3, 4, 5],
+        "unchanged": 20,
+        "failed": [],
+    }
+    assert add_users.call_count == 1
+    assert add_users.last_request.json() == {"users": [40, 41]}
+    deletions = [
+        request.path
+        for request in requests_mock.request_history
+        if request.method == "DELETE"
+    ]
+    assert sorted(deletions) == sorted(
+        [f"/api/groups/7/users/{user_id}" for user_id in range(1, 6)]
+        + ["/api/groups/7/users/3", "/api/groups/7/users/4"]
+    )
+
+
+def test_unknown_email_address_changes_nothing(
+    requests_mock: requests_mock.Mocker, tmp_path
+):
+    # Given a group and a members file with an email address no user has
+    serve_users(requests_mock, MEMBERS)
+    members_file = tmp_path / "members.txt"
+    members_file.write_text("trainee1@acme.org\nnobody@acme.org\n")
+
+    # When syncing the group
+    # Expect it to fail before anyone is added or removed
+    with pytest.raises(ValueError, match="nobody@acme.org"):
+        sync_group("--members-file", str(members_file))
+    assert {request.method for request in requests_mock.request_history} == {"GET"}
+
+
+def test_dry_run_only_reports_the_differences(
+    requests_mock: requests_mock.Mocker, tmp_path, capsys
+):
+    # Given a group and a members file keeping only one of its members
+    serve_users(requests_mock, MEMBERS)
+    members_file = tmp_path / "members.txt"
+    members_file.write_text("TRAINEE1@acme.org\n")
+
+    # When syncing the group as a dry run
+    sync_group("--members-file", str(members_file), "--dry-run")
+
+    # Expect the removals to be reported but not sent
+    assert json.loads(capsys.readouterr().out) == {
+        "added": [],
+        "removed": list(range(2, 26)),
+        "unchanged": 1,
+        "failed": [],
+    }
+    assert {request.method for request in requests_mock.request_history} == {"GET"}
+
+
+@pytest.mark.parametrize("content", ["", "# trainers\n\n"])
+def test_empty_members_file_is_refused(
+    requests_mock: requests_mock.Mocker, tmp_path, content
+):
+    # Given a group and a members file listing nobody, e.g. a truncated export
+    serve_users(requests_mock, MEMBERS)
+    members_file = tmp_path / "members.txt"
+    members_file.write_text(content)
+
+    # When syncing the group
+    # Expect it to be refused without any request
+    with pytest.raises(ValueError, match="--allow-empty"):
+        sync_group("--members-file", str(members_file))
+    assert requests_mock.call_count == 0
+
+
+def test_empty_members_file_removes_everyone_if_allowed(
+    requests_mock: requests_mock.Mocker, tmp_path, capsys
+):
+    # Given a group of a few members, the removal of one of which times out
+    serve_users(requests_mock, MEMBERS[:3])
+    requests_mock.delete(f"{MEMBERS_URL}1", json={})
+    requests_mock.delete(
+        f"{MEMBERS_URL}2", exc=requests.exceptions.ReadTimeout("Read timed out.")
+    )
+    requests_mock.delete(f"{MEMBERS_URL}3", json={})
+    members_file = tmp_path / "members.txt"
+    members_file.write_text("")
+
+    # When syncing it with an empty members file on purpose
+    with pytest.raises(SystemExit, match="1 users could not be removed"):
+        sync_group("--members-file", str(members_file), "--allow-empty")
+
+    # Expect the other members to be removed nonetheless
+    result = json.loads(capsys.readouterr().out)
+    assert result["removed"] == [1, 3]
+    assert result["failed"] == [{"id": 2, "error": "Read timed out."}]
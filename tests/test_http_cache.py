@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+import requests_mock
+
+from portal_client.http_cache import HttpCache
+from portal_client.http_session import PortalSession
+
+URL = "https://api.innoactive.io/api/v2/applications/42/"
+
+
+@pytest.fixture
+def session(tmp_path):
+    return PortalSession(cache=HttpCache(str(tmp_path / "http")))
+
+
+def respond_with_etag(etag, body):
+    "Returns a requests_mock callback answering with 304 Not Modified if the client has the given ETag already"
+
+    def respond(request, context):
+        context.headers["ETag"] = etag
+        if request.headers.get("If-None-Match") == etag:
+            context.status_code = 304
+            return None
+        return body
+
+    return respond
+
+
+def join_background_threads():
+    for thread in threading.enumerate():
+        if thread.name == "http-cache-revalidation":
+            thread.join(timeout=5)
+
+
+def test_unchanged_response_is_revalidated(
+    requests_mock: requests_mock.Mocker, session
+):
+    # Given a response with an ETag
+    requests_mock.get(URL, json=respond_with_etag('"v1"', {"name": "Demo"}))
+    assert session.get(URL).json() == {"name": "Demo"}
+
+    # When requesting it again
+    response = session.get(URL)
+
+    # Expect the stored response to be revalidated rather than downloaded again
+    assert requests_mock.last_request.headers["If-None-Match"] == '"v1"'
+    assert response.status_code == 200
+    assert response.json() == {"name": "Demo"}
+    assert response.from_cache
+
+
+def test_fresh_response_is_served_without_request(
+    requests_mock: requests_mock.Mocker, session
+):
+    # Given a response which is fresh for a minute
+    requests_mock.get(
+        URL, json={"name": "Demo"}, headers={"Cache-Control": "max-age=60"}
+    )
+    session.get(URL, params={"page": 1})
+
+    # When requesting it again, as well as with other query parameters
+    cached_response = session.get(URL, params={"page": 1})
+    session.get(URL, params={"page": 2})
+
+    # Expect only the other query parameters to be requested
+    assert cached_response.json() == {"name": "Demo"}
+    assert [request.qs for request in requests_mock.request_history] == [
+        {"page": ["1"]},
+        {"page": ["2"]},
+    ]
+
+
+def test_responses_are_kept_apart_per_credentials(
+    requests_mock: requests_mock.Mocker, session
+):
+    # Given a response fresh for a minute, requested by one user
+    requests_mock.get(
+        URL, json={"name": "Demo"}, headers={"Cache-Control": "max-age=60"}
+    )
+    session.get(URL, headers={"Authorization": "Bearer alice"})
+
+    # When another user requests it
+    session.get(URL, headers={"Authorization": "Bearer bob"})
+
+    # Expect it to be requested from the server again
+    assert requests_mock.call_count == 2
+
+
+def test_no_store_responses_are_not_stored(
+    requests_mock: requests_mock.Mocker, session, tmp_path
+):
+    # Given a response which must not be stored
+    requests_mock.get(
+        URL, json={"name": "Demo"}, headers={"Cache-Control": "no-store", "ETag": '"1"'}
+    )
+
+    # When requesting it twice
+    session.get(URL)
+    session.get(URL)
+
+    # Expect both requests to be sent unconditionally
+    assert "If-None-Match" not in requests_mock.last_request.headers
+    assert not (tmp_path / "http").exists()
+
+
+def test_stale_response_is_served_while_being_revalidated(
+    requests_mock: requests_mock.Mocker, tmp_path
+):
+    # Given a stale response which may be served for a minute while it is revalidated
+    session = PortalSession(cache=HttpCache(str(tmp_path / "http"), stale_ttl=60))
+    requests_mock.get(URL, json={"name": "Demo"}, headers={"ETag": '"v1"'})
+    session.get(URL)
+    revalidated = threading.Event()
+
+    def respond_slowly(request, context):
+        revalidated.wait(timeout=5)
+        context.headers["ETag"] = '"v2"'
+        return {"name": "Renamed"}
+
+    requests_mock.get(URL, json=respond_slowly)
+
+    # When requesting it again
+    response = session.get(URL)
+
+    # Expect the stale response right away and the updated one once the revalidation has finished
+    assert response.json() == {"name": "Demo"}
+    revalidated.set()
+    join_background_threads()
+    assert session.get(URL).json() == {"name": "Renamed"}
+    join_background_threads()
+
+
+def test_downloads_bypass_the_cache(requests_mock: requests_mock.Mocker, session):
+    # Given a file with an ETag
+    requests_mock.get(URL, content=b"build", headers={"ETag": '"v1"'})
+
+    # When streaming it twice
+    session.get(URL, stream=True)
+    session.get(URL, stream=True)
+
+    # Expect it not to be cached
+    assert "If-None-Match" not in requests_mock.last_request.headers
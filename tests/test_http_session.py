@@ -0,0 +1,33 @@
+import requests_mock
+
+from portal_client.http_session import PortalSession, get_session
+from portal_client.users import list_users
+
+
+def test_api_calls_share_one_session(requests_mock: requests_mock.Mocker, monkeypatch):
+    # Given credentials for Portal
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+    requests_mock.get("https://api.innoactive.io/api/users/", json={"results": []})
+
+    # When calling the API several times
+    list_users(page=1)
+    list_users(page=2)
+
+    # Expect all calls to go through the shared, pooled session
+    assert isinstance(get_session(), PortalSession)
+    assert get_session() is get_session()
+    assert requests_mock.call_count == 2
+
+
+def test_session_applies_default_timeout(requests_mock: requests_mock.Mocker):
+    # Given a session with a default timeout
+    session = PortalSession(pool_size=4, timeout=42)
+    requests_mock.get("https://test.org/", text="Success")
+
+    # When sending requests with and without an explicit timeout
+    session.get("https://test.org/")
+    session.get("https://test.org/", timeout=5)
+
+    # Expect the default timeout to only apply where none has been given
+    assert requests_mock.request_history[0].timeout == 42
+    assert requests_mock.request_history[1].timeout == 5
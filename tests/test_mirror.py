@@ -0,0 +1,131 @@
+import pytest
+import requests_mock
+
+from portal_client.mirror import query_mirror, sync_mirror
+
+API_URL = "https://api.innoactive.io/api/"
+
+
+@pytest.fixture(autouse=True)
+def authentication(monkeypatch):
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+
+
+def serve_list(requests_mock: requests_mock.Mocker, url, objects):
+    "Answers paginated requests for the given objects"
+
+    def respond(request, context):
+        page = int(request.qs["page"][0])
+        page_size = int(request.qs["page_size"][0])
+        start = (page - 1) * page_size
+        return {
+            "count": len(objects),
+            "next": f"{url}?page={page + 1}"
+            if start + page_size < len(objects)
+            else None,
+            "previous": None,
+            "results": objects[start : start + page_size],
+        }
+
+    requests_mock.get(url, json=respond)
+
+
+def serve_portal(requests_mock: requests_mock.Mocker, users):
+    serve_list(requests_mock, f"{API_URL}users/", users)
+    serve_list(
+        requests_mock,
+        f"{API_URL}groups/",
+        [{"id": 7, "name": "Trainers", "organization": 3}],
+    )
+    serve_list(
+        requests_mock,
+        f"{API_URL}organizations/",
+        [{"id": 3, "name": "Acme"}, {"id": 4, "name": "Globex"}],
+    )
+    serve_list(
+        requests_mock,
+        f"{API_URL}v2/applications/",
+        [{"id": "8feaa9c8", "name": "Demo", "organization": {"id": 3}}],
+    )
+
+
+USERS = [
+    {"id": 1, "email": "ann@acme.org", "organizations": [3], "groups": [7]},
+    {"id": 2, "email": "bob@acme.org", "organizations": [3], "groups": []},
+    {"id": 3, "email": "cem@globex.org", "organizations": [4], "groups": []},
+] + [
+    {"id": user_id, "email": f"trainee{user_id}@acme.org", "organizations": [3]}
+    for user_id in range(4, 30)
+]
+
+
+def test_mirror_answers_joins_locally(requests_mock: requests_mock.Mocker, tmp_path):
+    # Given a mirror of Portal
+    serve_portal(requests_mock, USERS)
+    database = str(tmp_path / "mirror.sqlite3")
+    sync_mirror(database, page_size=10)
+    requests_mock.reset_mock()
+
+    # When asking which users are in organization 3 but not in group 7
+    rows = list(
+        query_mirror(
+            """
+            SELECT users.email FROM users
+            JOIN organization_members ON organization_members.user_id = users.id
+            WHERE organization_members.organization_id = ?
+            AND users.id NOT IN (SELECT user_id FROM group_members WHERE group_id = ?)
+            ORDER BY users.id
+            """,
+            (3, 7),
+            database=database,
+        )
+    )
+
+    # Expect the answer without asking Portal
+    assert [row["email"] for row in rows] == ["bob@acme.org"] + [
+        f"trainee{user_id}@acme.org" for user_id in range(4, 30)
+    ]
+    assert requests_mock.call_count == 0
+    assert list(
+        query_mirror(
+            "SELECT organization, json_extract(data, '$.name') AS name FROM applications",
+            database=database,
+        )
+    ) == [{"organization": 3, "name": "Demo"}]
+
+
+def test_sync_only_writes_differences(requests_mock: requests_mock.Mocker, tmp_path):
+    # Given a mirror of Portal
+    serve_portal(requests_mock, USERS)
+    database = str(tmp_path / "mirror.sqlite3")
+    assert sync_mirror(database, page_size=10)["users"] == {
+        "added": 29,
+        "changed": 0,
+        "removed": 0,
+        "total": 29,
+    }
+
+    # When syncing again after two users have switched groups and another one has been deleted
+    changed_users = [dict(USERS[0], groups=[]), dict(USERS[1], groups=[7])] + USERS[3:]
+    serve_portal(requests_mock, changed_users)
+    stats = sync_mirror(database, tables=["users"], page_size=10)
+
+    # Expect only the differences to be written
+    assert stats == {"users": {"added": 0, "changed": 2, "removed": 1, "total": 28}}
+    assert list(
+        query_mirror("SELECT user_id FROM group_members", database=database)
+    ) == [{"user_id": 2}]
+    assert list(
+        query_mirror(
+            "SELECT count(*) AS users FROM organization_members WHERE organization_id = 4",
+            database=database,
+        )
+    ) == [{"users": 0}]
+
+
+def test_query_without_mirror_fails(tmp_path):
+    # Given no mirror
+    # When querying it
+    # Expect a hint to sync first
+    with pytest.raises(ValueError, match="mirror sync"):
+        list(query_mirror("SELECT 1", database=str(tmp_path / "mirror.sqlite3")))
@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+
+import pytest
+import requests_mock
+
+from portal_client import parser
+from portal_client.pagination import iterate_pages, iterate_results
+
+USERS_URL = "https://api.innoactive.io/api/users/"
+
+
+@pytest.fixture(autouse=True)
+def authentication(monkeypatch):
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+
+
+def users_page(count, page, page_size):
+    "Returns the given page of a paginated list of the given number of users"
+    start = (page - 1) * page_size
+    return {
+        "count": count,
+        "next": f"{USERS_URL}?page={page + 1}" if start + page_size < count else None,
+        "previous": None,
+        "results": [
+            {"id": user_id} for user_id in range(start, min(start + page_size, count))
+        ],
+    }
+
+
+def test_list_all_writes_every_result_as_json_line(
+    requests_mock: requests_mock.Mocker, capsys
+):
+    # Given 25 users
+    requests_mock.get(
+        USERS_URL,
+        json=lambda request, context: users_page(
+            25, int(request.qs["page"][0]), int(request.qs["page_size"][0])
+        ),
+    )
+
+    # When listing all of them, 10 per page
+    args = parser.parse_args(["users", "list", "--all", "--page-size", "10"])
+    args.func(args)
+
+    # Expect one line per user, in order, from three requests
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line)["id"] for line in lines] == list(range(25))
+    assert requests_mock.call_count == 3
+
+
+def test_next_page_is_fetched_while_the_current_one_is_processed():
+    # Given a list endpoint recording which pages have been requested
+    requested_pages = []
+    second_page_requested = threading.Event()
+
+    def list_users(page, page_size):
+        requested_pages.append(page)
+        if page == 2:
+            second_page_requested.set()
+        return users_page(30, page, page_size)
+
+    # When processing the first page
+    pages = iterate_pages(list_users, page_size=10)
+    next(pages)
+
+    # Expect the second page to be requested already
+    assert second_page_requested.wait(timeout=5)
+    assert [page["results"][0]["id"] for page in pages] == [10, 20]
+    assert requested_pages == [1, 2, 3]
+
+
+def test_pages_are_fetched_concurrently_once_the_count_is_known():
+    # Given a slow list endpoint with 95 results
+    lock = threading.Lock()
+    in_flight = []
+    concurrency = []
+
+    def list_users(page, page_size):
+        with lock:
+            in_flight.append(page)
+            concurrency.append(len(in_flight))
+        # later pages answer faster, so they would overtake earlier ones
+        time.sleep(0.05 / page)
+        with lock:
+            in_flight.remove(page)
+        return users_page(95, page, page_size)
+
+    # When fetching all pages with 4 workers
+    results = list(iterate_results(list_users, page_size=10, workers=4))
+
+    # Expect the pages to be fetched at the same time and the results to come out in order nonetheless
+    assert [user["id"] for user in results] == list(range(95))
+    assert max(concurrency) > 1
+
+
+def test_pages_beyond_an_outdated_count_are_fetched_as_well():
+    # Given a list which has grown since its first page has been fetched
+    def list_users(page, page_size):
+        response = users_page(30, page, page_size)
+        return dict(response, count=20) if page == 1 else response
+
+    # When fetching all pages
+    results = list(iterate_results(list_users, page_size=10, workers=4))
+
+    # Expect the results added in the meantime to be included
+    assert [user["id"] for user in results] == list(range(30))
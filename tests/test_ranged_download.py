@@ -0,0 +1,279 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+
+import pytest
+import requests
+import requests_mock
+
+from portal_client.http_session import PortalSession
+from portal_client.ranged_download import DownloadSidecar, RangedDownloader
+
+URL = "https://storage.test.org/build.zip"
+
+
+def serve_ranges(content, etag='"v1"', fail_once_at=None):
+    "Returns a requests_mock callback answering range requests for the given content"
+    failed = set()
+    lock = threading.Lock()
+
+    def respond(request, context):
+        context.headers["ETag"] = etag
+        requested_range = re.match(r"bytes=(\d+)-(\d+)", request.headers["Range"])
+        if_range = request.headers.get("If-Range")
+        if if_range is not None and if_range != etag:
+            # the file has changed, a range of it would not fit the rest of the download
+            context.status_code = 200
+            return content
+        start, end = int(requested_range[1]), int(requested_range[2])
+        with lock:
+            if start == fail_once_at and start not in failed:
+                failed.add(start)
+                raise requests.exceptions.ConnectionError("Connection reset by peer")
+        end = min(end, len(content) - 1)
+        context.status_code = 206
+        context.headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+        return content[start : end + 1]
+
+    return respond
+
+
+@pytest.fixture
+def content():
+    return os.urandom(5 * 1024 * 1024 + 123)
+
+
+def test_download_fetches_ranges_in_parallel(
+    requests_mock: requests_mock.Mocker, content, tmp_path
+):
+    # Given a server supporting range requests
+    requests_mock.get(URL, content=serve_ranges(content))
+    downloader = RangedDownloader(
+        session=PortalSession(), connections=3, range_size=1024 * 1024
+    )
+
+    # When downloading the file
+    target_path = downloader.download(URL, str(tmp_path / "build.zip"))
+
+    # Expect every range to be requested once and written to its position
+    assert (tmp_path / "build.zip").read_bytes() == content
+    assert target_path == str(tmp_path / "build.zip")
+    requested_ranges = sorted(
+        int(re.match(r"bytes=(\d+)-", request.headers["Range"])[1])
+        for request in requests_mock.request_history
+    )
+    assert requested_ranges == [start * 1024 * 1024 for start in range(6)]
+    # Expect all ranges but the first to be tied to the version of the file the download started with
+    assert [
+        request.headers.get("If-Range") for request in requests_mock.request_history
+    ].count('"v1"') == 5
+
+
+def test_download_retries_broken_range(
+    requests_mock: requests_mock.Mocker, content, tmp_path
+):
+    # Given a server which resets the connection for one of the ranges once
+    requests_mock.get(URL, content=serve_ranges(content, fail_once_at=2 * 1024 * 1024))
+    downloader = RangedDownloader(
+        session=PortalSession(), connections=2, range_size=1024 * 1024
+    )
+
+    # When downloading the file
+    downloader.download(URL, str(tmp_path / "build.zip"))
+
+    # Expect only the broken range to be requested again
+    assert (tmp_path / "build.zip").read_bytes() == content
+    assert requests_mock.call_count == 7
+
+
+def test_download_fails_if_file_changes_midway(
+    requests_mock: requests_mock.Mocker, content, tmp_path
+):
+    # Given a file that changes once the download has started
+    requests_mock.get(
+        URL,
+        [
+            {"content": serve_ranges(content)},
+            {"content": serve_ranges(content[::-1], etag='"v2"')},
+        ],
+    )
+    downloader = RangedDownloader(
+        session=PortalSession(), connections=1, range_size=1024 * 1024
+    )
+
+    # When downloading it
+    # Expect the download to fail rather than to mix both versions
+    with pytest.raises(requests.HTTPError):
+        downloader.download(URL, str(tmp_path / "build.zip"))
+
+
+def test_download_falls_back_to_single_stream(
+    requests_mock: requests_mock.Mocker, content, tmp_path
+):
+    # Given a server ignoring range requests
+    requests_mock.get(URL, content=content)
+    downloader = RangedDownloader(
+        session=PortalSession(), connections=3, range_size=1024 * 1024
+    )
+
+    # When downloading the file
+    downloader.download(URL, str(tmp_path / "build.zip"))
+
+    # Expect the file to be downloaded in one piece, with the first response
+    assert (tmp_path / "build.zip").read_bytes() == content
+    assert requests_mock.call_count == 1
+
+
+def test_interrupted_download_resumes_missing_ranges(
+    requests_mock: requests_mock.Mocker, content, tmp_path, capsys
+):
+    # Given a download which got interrupted by the server failing for the fourth range
+    serve = serve_ranges(content)
+
+    def fail_fourth_range(request, context):
+        if request.headers["Range"].startswith(f"bytes={3 * 1024 * 1024}-"):
+            context.status_code = 500
+            return b"Internal Server Error"
+        return serve(request, context)
+
+    requests_mock.get(URL, content=fail_fourth_range)
+    downloader = RangedDownloader(
+        session=PortalSession(), connections=1, range_size=1024 * 1024
+    )
+    target_path = tmp_path / "build.zip"
+    with pytest.raises(requests.HTTPError):
+        downloader.download(URL, str(target_path))
+    assert not target_path.exists()
+    assert (tmp_path / "build.zip.part").exists()
+
+    # When downloading again, once the file is fully available
+    requests_mock.reset_mock()
+    requests_mock.get(URL, content=serve)
+    capsys.readouterr()
+    downloader.download(URL, str(target_path))
+
+    # Expect the resumption to be reported on stderr, keeping stdout to the command's output
+    output = capsys.readouterr()
+    assert "Resuming download" in output.err
+    assert "Resuming download" not in output.out
+    # Expect only the missing ranges to be requested after probing the file
+    assert target_path.read_bytes() == content
+    requested_ranges = [
+        int(re.match(r"bytes=(\d+)-", request.headers["Range"])[1])
+        for request in requests_mock.request_history
+    ]
+    assert requested_ranges[0] == 0
+    assert 3 * 1024 * 1024 in requested_ranges[1:]
+    assert set(requested_ranges[1:]) <= {start * 1024 * 1024 for start in (3, 4, 5)}
+    # Expect the partial download to be cleaned up
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["build.zip"]
+
+
+def test_download_starts_over_if_file_changed_since_interruption(
+    requests_mock: requests_mock.Mocker, content, tmp_path
+):
+    # Given a partial download of an earlier version of the file
+    target_path = tmp_path / "build.zip"
+    (tmp_path / "build.zip.part").write_bytes(bytes(len(content)))
+    DownloadSidecar(str(tmp_path / "build.zip.part")).record(
+        URL, len(content), '"v0"', 1024 * 1024, [0, 1024 * 1024]
+    )
+
+    # When downloading the current version
+    requests_mock.get(URL, content=serve_ranges(content))
+    RangedDownloader(
+        session=PortalSession(), connections=2, range_size=1024 * 1024
+    ).download(URL, str(target_path))
+
+    # Expect the whole file to be downloaded again
+    assert target_path.read_bytes() == content
+    assert requests_mock.call_count == 6
+
+
+def test_download_verifies_digest_while_downloading(
+    requests_mock: requests_mock.Mocker, content, tmp_path
+):
+    # Given a file whose md5 and sha256 are known
+    requests_mock.get(URL, content=serve_ranges(content))
+    downloader = RangedDownloader(
+        session=PortalSession(), connections=3, range_size=1024 * 1024
+    )
+
+    # When downloading it
+    downloader.download(
+        URL,
+        str(tmp_path / "build.zip"),
+        expected_size=len(content),
+        expected_digests={
+            "md5": hashlib.md5(content).hexdigest(),
+            "sha256": hashlib.sha256(content).hexdigest().upper(),
+        },
+    )
+
+    # Expect the file to pass verification
+    assert (tmp_path / "build.zip").read_bytes() == content
+
+
+@pytest.mark.parametrize("delete_corrupt", [False, True])
+def test_download_rejects_corrupt_file(
+    requests_mock: requests_mock.Mocker, content, tmp_path, delete_corrupt
+):
+    # Given a server sending a file which does not match its digest
+    requests_mock.get(URL, content=serve_ranges(content))
+    downloader = RangedDownloader(
+        session=PortalSession(), connections=3, range_size=1024 * 1024
+    )
+
+    # When downloading it
+    # Expect the download to fail
+    with pytest.raises(ValueError, match="md5"):
+        downloader.download(
+            URL,
+            str(tmp_path / "build.zip"),
+            expected_digests={"md5": hashlib.md5(content[::-1]).hexdigest()},
+            delete_corrupt=delete_corrupt,
+        )
+    # Expect the corrupt file not to end up at the target path, nor to be resumed later on
+    assert not (tmp_path / "build.zip").exists()
+    assert not (tmp_path / "build.zip.part.json").exists()
+    assert (tmp_path / "build.zip.part").exists() is not delete_corrupt
+
+
+def test_download_fails_fast_on_unexpected_size(
+    requests_mock: requests_mock.Mocker, content, tmp_path
+):
+    # Given a file larger than expected
+    requests_mock.get(URL, content=serve_ranges(content))
+    downloader = RangedDownloader(
+        session=PortalSession(), connections=3, range_size=1024 * 1024
+    )
+
+    # When downloading it
+    # Expect the download to fail before anything but the first range is requested
+    with pytest.raises(ValueError, match="bytes large"):
+        downloader.download(
+            URL, str(tmp_path / "build.zip"), expected_size=len(content) - 1
+        )
+    assert requests_mock.call_count == 1
+
+
+def test_single_stream_is_verified_against_content_md5(
+    requests_mock: requests_mock.Mocker, content, tmp_path
+):
+    # Given a server ignoring range requests and stating a wrong Content-MD5
+    requests_mock.get(
+        URL,
+        content=content,
+        headers={
+            "Content-MD5": base64.b64encode(hashlib.md5(b"other").digest()).decode()
+        },
+    )
+    downloader = RangedDownloader(session=PortalSession())
+
+    # When downloading the file
+    # Expect the download to fail
+    with pytest.raises(ValueError, match="md5"):
+        downloader.download(URL, str(tmp_path / "build.zip"))
+    assert not (tmp_path / "build.zip").exists()
@@ -0,0 +1,180 @@
+import io
+import os
+import re
+import zipfile
+
+import pytest
+import requests
+import requests_mock
+
+from portal_client.http_session import PortalSession
+from portal_client.remote_zip import diff_members, extract_members, open_remote_zip
+
+URL = "https://storage.test.org/build.zip"
+
+
+def build_archive(members):
+    "Returns a ZIP archive with the given members, by name"
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return archive.getvalue()
+
+
+def serve_ranges(content, etag='"v1"'):
+    "Returns a requests_mock callback answering range requests, including suffix ranges, for the given content"
+
+    def respond(request, context):
+        context.headers["ETag"] = etag
+        if request.headers.get("If-Range", etag) != etag:
+            context.status_code = 200
+            return content
+        requested_range = re.match(r"bytes=(\d*)-(\d*)", request.headers["Range"])
+        if not requested_range[1]:
+            start = max(0, len(content) - int(requested_range[2]))
+            end = len(content) - 1
+        else:
+            start = int(requested_range[1])
+            end = min(int(requested_range[2]), len(content) - 1)
+        context.status_code = 206
+        context.headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+        return content[start : end + 1]
+
+    return respond
+
+
+@pytest.fixture
+def members():
+    return {
+        "Build/Data/level0": os.urandom(512 * 1024),
+        "Build/manifest.json": b'{"version": "1.0.2"}',
+        "Build/Data/sharedassets0.assets": os.urandom(512 * 1024),
+        "Build/config.ini": b"[launch]\nfullscreen=1\n",
+    }
+
+
+def requested_bytes(requests_mock: requests_mock.Mocker):
+    total = 0
+    for request in requests_mock.request_history:
+        start, end = re.match(r"bytes=(\d*)-(\d*)", request.headers["Range"]).groups()
+        total += int(end) - int(start) + 1 if start else int(end)
+    return total
+
+
+def test_listing_only_fetches_the_tail(requests_mock: requests_mock.Mocker, members):
+    # Given an archive of more than a MiB
+    content = build_archive(members)
+    requests_mock.get(URL, content=serve_ranges(content))
+
+    # When listing its members
+    with open_remote_zip(URL, session=PortalSession()) as archive:
+        names = archive.namelist()
+
+    # Expect the central directory to be read from a single request for the archive's tail
+    assert names == list(members)
+    assert requests_mock.call_count == 1
+    assert requested_bytes(requests_mock) < 100 * 1024
+
+
+def test_extract_fetches_only_the_requested_members(
+    requests_mock: requests_mock.Mocker, members, tmp_path
+):
+    # Given a remote archive
+    content = build_archive(members)
+    requests_mock.get(URL, content=serve_ranges(content))
+
+    # When extracting the manifest and one of the large files
+    with open_remote_zip(URL, session=PortalSession()) as archive:
+        extracted_paths = extract_members(
+            archive, ["*.json", "Build/Data/level0"], str(tmp_path)
+        )
+
+    # Expect both files to be extracted with a request each, without fetching the other large file
+    assert sorted(extracted_paths) == sorted(
+        [
+            str(tmp_path / "Build" / "manifest.json"),
+            str(tmp_path / "Build" / "Data" / "level0"),
+        ]
+    )
+    assert (tmp_path / "Build" / "manifest.json").read_bytes() == members[
+        "Build/manifest.json"
+    ]
+    assert (tmp_path / "Build" / "Data" / "level0").read_bytes() == members[
+        "Build/Data/level0"
+    ]
+    assert not (tmp_path / "Build" / "config.ini").exists()
+    assert requests_mock.call_count == 3
+    assert requested_bytes(requests_mock) < len(content) - 400 * 1024
+
+
+def test_extract_fails_for_unknown_member(
+    requests_mock: requests_mock.Mocker, members, tmp_path
+):
+    # Given a remote archive
+    requests_mock.get(URL, content=serve_ranges(build_archive(members)))
+
+    # When extracting a file which is not in it
+    # Expect the extraction to fail
+    with (
+        open_remote_zip(URL, session=PortalSession()) as archive,
+        pytest.raises(KeyError, match="missing.txt"),
+    ):
+        extract_members(archive, ["missing.txt"], str(tmp_path))
+
+
+def test_diff_compares_central_directories(
+    requests_mock: requests_mock.Mocker, members
+):
+    # Given two builds, the second one with a changed config, a new and a removed file
+    other_members = dict(members, **{"Build/config.ini": b"[launch]\nfullscreen=0\n"})
+    del other_members["Build/Data/level0"]
+    other_members["Build/Data/level1"] = b"level"
+    requests_mock.get(URL, content=serve_ranges(build_archive(members)))
+    other_url = "https://storage.test.org/other.zip"
+    requests_mock.get(other_url, content=serve_ranges(build_archive(other_members)))
+
+    # When comparing both
+    with (
+        open_remote_zip(URL, session=PortalSession()) as archive,
+        open_remote_zip(other_url, session=PortalSession()) as other_archive,
+    ):
+        diff = diff_members(archive, other_archive)
+
+    # Expect the differences to be found from the archives' tails alone
+    assert diff["added"] == ["Build/Data/level1"]
+    assert diff["removed"] == ["Build/Data/level0"]
+    assert [member["name"] for member in diff["changed"]] == ["Build/config.ini"]
+    assert requests_mock.call_count == 2
+
+
+def test_archive_changing_while_reading_it_fails(
+    requests_mock: requests_mock.Mocker, members, tmp_path
+):
+    # Given an archive which gets replaced after its central directory has been read
+    content = build_archive(members)
+    requests_mock.get(
+        URL,
+        [
+            {"content": serve_ranges(content)},
+            {"content": serve_ranges(content[::-1], etag='"v2"')},
+        ],
+    )
+
+    # When extracting a member
+    # Expect the extraction to fail rather than to read the wrong data
+    with (
+        open_remote_zip(URL, session=PortalSession()) as archive,
+        pytest.raises(requests.HTTPError),
+    ):
+        extract_members(archive, ["Build/Data/level0"], str(tmp_path))
+
+
+def test_server_without_range_support_is_rejected(requests_mock: requests_mock.Mocker):
+    # Given a server ignoring range requests
+    requests_mock.get(URL, content=b"not a range")
+
+    # When opening the archive
+    # Expect an error rather than downloading all of it
+    with pytest.raises(ValueError, match="range requests"):
+        open_remote_zip(URL, session=PortalSession())
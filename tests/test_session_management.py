@@ -1,4 +1,7 @@
+import itertools
 import json
+import re
+from datetime import datetime, timedelta, timezone
 from io import StringIO
 from unittest.mock import patch
 from urllib.parse import parse_qs, urlparse
@@ -6,10 +9,14 @@ from urllib.parse import parse_qs, urlparse
 import pytest
 import requests
 
+from portal_client import parser
 from portal_client.session_management import (
     SessionManagementApiClient,
     extend_vm_expiration_cli,
+    get_vm_expiration,
+    keep_vms_alive,
     list_vms_cli,
+    watch_vms,
 )
 
 
@@ -162,3 +169,381 @@ class TestSessionManagementCLI:
         # Verify output
         output = mock_stdout.getvalue().strip()
         assert json.loads(output) == expected_response
+
+
+VMS_URL = "https://session-management.innoactive.io/VirtualMachines"
+
+
+class TestBulkExtendVmExpirationCLI:
+    @pytest.fixture(autouse=True)
+    def authentication(self):
+        with patch(
+            "portal_client.session_management.get_bearer_authorization_header",
+            return_value="Bearer test-token",
+        ):
+            yield
+
+    @staticmethod
+    def extend(*arguments):
+        args = parser.parse_args(
+            [
+                "vms",
+                "extend-expiration",
+                "--org-id",
+                "7",
+                "--time",
+                "01:00:00",
+                *arguments,
+            ]
+        )
+        args.func(args)
+
+    def serve_vms(self, requests_mock, count=200):
+        now = datetime.now(timezone.utc)
+        vms = [
+            {
+                "id": f"vm-{number}",
+                "status": "stopped" if number % 10 == 0 else "running",
+                "expiration": (now + timedelta(minutes=number)).isoformat(),
+            }
+            for number in range(count)
+        ]
+        requests_mock.get(VMS_URL, json={"vms": vms})
+        return requests_mock.put(
+            re.compile(f"{VMS_URL}/vm-[0-9]+/Expiration"), json={"extended": True}
+        )
+
+    def test_selected_vms_are_extended_at_once(self, requests_mock, capsys):
+        # Given 200 VMs, expiring a minute apart from each other
+        extension = self.serve_vms(requests_mock)
+
+        # When extending the running ones expiring within the next hour
+        self.extend(
+            "--filter", "status=running", "--expiring-within", "1h", "--workers", "16"
+        )
+
+        # Expect the VMs to be listed once and each of the selected ones to be extended
+        results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        expected_ids = [f"vm-{number}" for number in range(60) if number % 10 != 0]
+        assert [result["id"] for result in results] == expected_ids
+        assert {result["status"] for result in results} == {"extended"}
+        assert extension.call_count == len(expected_ids)
+        assert extension.last_request.json() == {"time": "01:00:00"}
+        assert (
+            sum(request.method == "GET" for request in requests_mock.request_history)
+            == 1
+        )
+
+    def test_ids_from_stdin_are_extended_without_listing(
+        self, requests_mock, capsys, monkeypatch
+    ):
+        # Given VMs, one of which cannot be extended
+        self.serve_vms(requests_mock)
+        requests_mock.put(
+            f"{VMS_URL}/vm-2/Expiration", status_code=409, json={"error": "Expired"}
+        )
+        monkeypatch.setattr("sys.stdin", StringIO("vm-1\nvm-2\nvm-3\nvm-1\n"))
+
+        # When extending the VMs whose ids are piped in
+        with pytest.raises(SystemExit, match="1 of 3 VMs could not be extended"):
+            self.extend("--ids-from", "-")
+
+        # Expect a result for every VM, without listing the VMs
+        results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [(result["id"], result["status"]) for result in results] == [
+            ("vm-1", "extended"),
+            ("vm-2", "error"),
+            ("vm-3", "extended"),
+        ]
+        assert {request.method for request in requests_mock.request_history} == {"PUT"}
+
+    def test_timeout_of_one_vm_does_not_abort_the_others(
+        self, requests_mock, capsys, monkeypatch
+    ):
+        # Given VMs, the extension of one of which times out
+        self.serve_vms(requests_mock)
+        requests_mock.put(
+            f"{VMS_URL}/vm-2/Expiration",
+            exc=requests.exceptions.ReadTimeout("Read timed out."),
+        )
+        monkeypatch.setattr("sys.stdin", StringIO("vm-1\nvm-2\nvm-3\n"))
+
+        # When extending them
+        with pytest.raises(SystemExit, match="1 of 3 VMs could not be extended"):
+            self.extend("--ids-from", "-")
+
+        # Expect a result for every VM nonetheless
+        results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert results[1] == {
+            "id": "vm-2",
+            "status": "error",
+            "error": "Read timed out.",
+        }
+        assert [result["status"] for result in results] == [
+            "extended",
+            "error",
+            "extended",
+        ]
+
+    def test_dry_run_only_prints_the_selection(self, requests_mock, capsys):
+        # Given VMs
+        extension = self.serve_vms(requests_mock, count=20)
+
+        # When extending every stopped one as a dry run
+        self.extend("--all", "--filter", "status!=running", "--dry-run")
+
+        # Expect the selection to be printed but not extended
+        assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [
+            {"id": "vm-0", "status": "selected"},
+            {"id": "vm-10", "status": "selected"},
+        ]
+        assert extension.call_count == 0
+
+
+@pytest.mark.parametrize(
+    ("expiration", "expected"),
+    [
+        ("2024-05-01T09:00:00Z", datetime(2024, 5, 1, 9, tzinfo=timezone.utc)),
+        (
+            "2024-05-01T09:00:00.1234567Z",
+            datetime(2024, 5, 1, 9, 0, 0, 123456, tzinfo=timezone.utc),
+        ),
+        (
+            "2024-05-01T11:00:00.5+02:00",
+            datetime(2024, 5, 1, 9, 0, 0, 500000, tzinfo=timezone.utc),
+        ),
+        ("2024-05-01T09:00:00", datetime(2024, 5, 1, 9, tzinfo=timezone.utc)),
+        ("next Tuesday", None),
+        (1714554000, None),
+    ],
+)
+def test_vm_expiration_is_parsed_leniently(expiration, expected):
+    # Given a VM with an expiration time as the service may format it
+    # When reading its expiration time
+    # Expect it to be parsed, or to be unknown if it cannot be
+    assert get_vm_expiration({"id": "vm-1", "expiration": expiration}) == expected
+
+
+class TestWatchVms:
+    @pytest.fixture(autouse=True)
+    def authentication(self):
+        with patch(
+            "portal_client.session_management.get_bearer_authorization_header",
+            return_value="Bearer test-token",
+        ):
+            yield
+
+    def test_only_changes_are_reported_while_polling_backs_off(self, requests_mock):
+        # Given VMs which stay the same for a while, before one of them starts and another one is deleted
+        starting = {"id": "vm-1", "status": "starting", "heartbeat": 1}
+        running = {"id": "vm-1", "status": "running", "heartbeat": 5}
+        other = {"id": "vm-2", "status": "running"}
+        requests_mock.get(
+            VMS_URL,
+            [{"json": {"vms": [starting, other]}}] * 4
+            + [{"json": {"vms": [running]}}, {"json": {"vms": [running]}}],
+        )
+
+        # When watching them
+        with patch("portal_client.session_management.time.sleep") as sleep:
+            events = list(
+                itertools.islice(
+                    watch_vms(
+                        SessionManagementApiClient(),
+                        7,
+                        min_interval=2,
+                        max_interval=10,
+                        ignored_fields={"heartbeat"},
+                    ),
+                    2,
+                )
+            )
+
+        # Expect the VMs to be reported once, then only what has changed, polling less often while nothing changes
+        assert events == [
+            [
+                {"event": "added", "id": "vm-1", "vm": starting},
+                {"event": "added", "id": "vm-2", "vm": other},
+            ],
+            [
+                {
+                    "event": "changed",
+                    "id": "vm-1",
+                    "changes": {"status": {"old": "starting", "new": "running"}},
+                },
+                {"event": "removed", "id": "vm-2", "vm": other},
+            ],
+        ]
+        assert [call.args[0] for call in sleep.call_args_list] == [2, 4, 8, 10]
+
+    def test_failed_polls_are_reported_and_watching_continues(self, requests_mock):
+        # Given VMs which cannot be listed for a while, e.g. because of a timeout and an expired token
+        starting = {"id": "vm-1", "status": "starting"}
+        running = {"id": "vm-1", "status": "running"}
+        requests_mock.get(
+            VMS_URL,
+            [
+                {"json": {"vms": [starting]}},
+                {"exc": requests.exceptions.ReadTimeout("Read timed out.")},
+                {"status_code": 401, "json": {"error": "Unauthorized"}},
+                {"json": {"vms": [running]}},
+            ],
+        )
+
+        # When watching them
+        with (
+            patch("portal_client.session_management.time.sleep") as sleep,
+            patch("sys.stdout", new_callable=StringIO) as stdout,
+        ):
+            events = list(
+                itertools.islice(
+                    watch_vms(SessionManagementApiClient(), 7, min_interval=2), 4
+                )
+            )
+
+        # Expect the failures to be reported, backed off from and the watch to carry on afterwards
+        assert [event["event"] for batch in events for event in batch] == [
+            "added",
+            "error",
+            "error",
+            "changed",
+        ]
+        assert events[1][0]["error"] == "Read timed out."
+        assert events[2][0]["error"].startswith("401 Client Error")
+        assert [call.args[0] for call in sleep.call_args_list] == [2, 4, 8]
+        # and only events to be written to stdout
+        assert stdout.getvalue() == ""
+
+
+class TestKeepVmsAlive:
+    @pytest.fixture(autouse=True)
+    def authentication(self):
+        with patch(
+            "portal_client.session_management.get_bearer_authorization_header",
+            return_value="Bearer test-token",
+        ):
+            yield
+
+    def test_vms_are_extended_just_in_time(self, requests_mock):
+        # Given two VMs expiring in 20 and 60 minutes, which are extended by an hour at a time
+        start = datetime(2024, 5, 1, 9, 0, tzinfo=timezone.utc)
+        clock = [start]
+        expirations = {
+            "vm-1": start + timedelta(minutes=20),
+            "vm-2": start + timedelta(minutes=60),
+        }
+
+        def list_vms(request, context):
+            return {
+                "vms": [
+                    {"id": vm_id, "expiration": expiration.isoformat()}
+                    for vm_id, expiration in expirations.items()
+                ]
+            }
+
+        def extend(request, context):
+            vm_id = request.path.split("/")[2]
+            expirations[vm_id] += timedelta(hours=1)
+            return {"id": vm_id, "expiration": expirations[vm_id].isoformat()}
+
+        def sleep(seconds):
+            clock[0] += timedelta(seconds=seconds)
+
+        requests_mock.get(VMS_URL, json=list_vms)
+        extension = requests_mock.put(
+            re.compile(f"{VMS_URL}/vm-[0-9]+/Expiration"), json=extend
+        )
+
+        # When keeping them alive for a while, extending them 15 minutes before they expire
+        extension_times = []
+        for event in itertools.islice(
+            keep_vms_alive(
+                SessionManagementApiClient(),
+                7,
+                "01:00:00",
+                min_remaining=15 * 60,
+                refresh_interval=30 * 60,
+                now=lambda: clock[0],
+                sleep=sleep,
+            ),
+            3,
+        ):
+            assert event["event"] == "extended"
+            extension_times.append((event["id"], clock[0] - start))
+
+        # Expect each VM to be extended only once it is about to expire
+        assert extension_times == [
+            ("vm-1", timedelta(minutes=5)),
+            ("vm-2", timedelta(minutes=45)),
+            ("vm-1", timedelta(minutes=65)),
+        ]
+        assert extension.call_count == 3
+        assert (
+            sum(request.method == "GET" for request in requests_mock.request_history)
+            == 3
+        )
+
+    def test_failures_are_reported_and_retried(self, requests_mock):
+        # Given a VM expiring in 20 minutes, whose first extension times out and which cannot be listed for a while
+        start = datetime(2024, 5, 1, 9, 0, tzinfo=timezone.utc)
+        clock = [start]
+        expiration = start + timedelta(minutes=20)
+        requests_mock.get(
+            VMS_URL,
+            [
+                {
+                    "json": {
+                        "vms": [{"id": "vm-1", "expiration": expiration.isoformat()}]
+                    }
+                },
+                {"status_code": 401, "json": {"error": "Unauthorized"}},
+            ],
+        )
+        requests_mock.put(
+            f"{VMS_URL}/vm-1/Expiration",
+            [
+                {"exc": requests.exceptions.ReadTimeout("Read timed out.")},
+                {"json": {"expiration": (expiration + timedelta(hours=1)).isoformat()}},
+            ],
+        )
+
+        def sleep(seconds):
+            clock[0] += timedelta(seconds=seconds)
+
+        # When keeping it alive
+        events = []
+        for event in itertools.islice(
+            keep_vms_alive(
+                SessionManagementApiClient(),
+                7,
+                "01:00:00",
+                min_remaining=15 * 60,
+                refresh_interval=10 * 60,
+                retry_delay=60,
+                now=lambda: clock[0],
+                sleep=sleep,
+            ),
+            3,
+        ):
+            events.append((event["event"], event.get("id"), clock[0] - start))
+
+        # Expect the failures to be reported and retried a minute later, rather than ending the keep-alive
+        assert events == [
+            ("error", "vm-1", timedelta(minutes=5)),
+            ("extended", "vm-1", timedelta(minutes=6)),
+            ("error", None, timedelta(minutes=10)),
+        ]
+
+    @pytest.mark.parametrize("timespan", ["00:10:00", "00:15:00", "10 minutes"])
+    def test_extensions_shorter_than_the_minimum_remaining_time_are_refused(
+        self, timespan
+    ):
+        # Given extensions which would leave a VM due for the next extension right away
+        # When keeping VMs alive with them
+        # Expect to be refused
+        with pytest.raises(ValueError, match="has to be longer"):
+            next(
+                keep_vms_alive(
+                    SessionManagementApiClient(), 7, timespan, min_remaining=15 * 60
+                )
+            )
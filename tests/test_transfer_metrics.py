@@ -0,0 +1,116 @@
+import json
+import os
+
+import pytest
+import requests_mock
+
+from portal_client.applications_v2 import download_application_build
+from portal_client.http_session import PortalSession
+from portal_client.portal_chunked_upload import ChunkedUploader
+from portal_client.transfer_metrics import open_transfer_metrics
+from portal_client.upload_stub_server import ChunkedUploadStubServer
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    "Keeps upload journals and the upload index of each test apart"
+    monkeypatch.setenv("PORTAL_CACHE_DIR", str(tmp_path / "cache"))
+
+
+def _upload(tmp_path, metrics):
+    upload_file = tmp_path / "build.zip"
+    upload_file.write_bytes(os.urandom(1 << 20))
+    with ChunkedUploadStubServer(drop_rate=0.2, seed=1) as server:
+        uploader = ChunkedUploader(
+            server.base_url,
+            "Bearer test-token",
+            session=PortalSession(),
+            metrics=metrics,
+        )
+        try:
+            uploader.upload_chunked_file(
+                upload_file, chunk_size_bytes=256 << 10, deduplicate=False
+            )
+        finally:
+            metrics.close()
+
+
+def test_upload_streams_chunk_events_and_summary_as_json_lines(tmp_path):
+    # Given metrics written as json lines
+    metrics_file = tmp_path / "metrics.jsonl"
+    metrics = open_transfer_metrics(str(metrics_file), "jsonl", "upload", "build.zip")
+
+    # When uploading a file to a server dropping some of the requests
+    _upload(tmp_path, metrics)
+
+    # Expect an event per chunk, followed by the summary of the upload
+    events = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    assert [event["event"] for event in events] == ["chunk"] * 4 + ["summary"]
+    assert [event["offset"] for event in events[:4]] == [
+        offset * (256 << 10) for offset in range(4)
+    ]
+    assert all(event["status"] == 200 for event in events[:4])
+    summary = events[-1]
+    assert summary["direction"] == "upload"
+    assert summary["name"] == "build.zip"
+    assert summary["bytes"] == 1 << 20
+    assert summary["retries"] == sum(event["retries"] for event in events[:4]) > 0
+    assert summary["latency_p50"] <= summary["latency_p95"] <= summary["latency_p99"]
+
+
+def test_upload_writes_summary_as_prometheus_textfile(tmp_path):
+    # Given metrics written for the node exporter's textfile collector
+    metrics_file = tmp_path / "upload.prom"
+    metrics = open_transfer_metrics(
+        str(metrics_file), "prometheus-textfile", "upload", "build.zip"
+    )
+
+    # When uploading a file
+    _upload(tmp_path, metrics)
+
+    # Expect the summary to be written in the exposition format
+    samples = dict(
+        line.rsplit(" ", 1)
+        for line in metrics_file.read_text().splitlines()
+        if not line.startswith("#")
+    )
+    labels = 'direction="upload",name="build.zip"'
+    assert samples[f"innoactive_portal_transfer_bytes{{{labels}}}"] == str(1 << 20)
+    assert (
+        samples[f"innoactive_portal_transfer_chunk_latency_seconds_count{{{labels}}}"]
+        == "4"
+    )
+    assert (
+        f'innoactive_portal_transfer_chunk_latency_seconds{{{labels},quantile="0.99"}}'
+        in samples
+    )
+    assert int(samples[f"innoactive_portal_transfer_retries{{{labels}}}"]) > 0
+
+
+def test_download_records_chunk_events(
+    requests_mock: requests_mock.Mocker, monkeypatch, tmp_path
+):
+    # Given a build of 20 MiB
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+    requests_mock.get(
+        "https://api.innoactive.io/api/v2/application-builds/42/",
+        json={"application_archive": "https://storage.test.org/build.zip"},
+    )
+    requests_mock.get("https://storage.test.org/build.zip", content=bytes(20 << 20))
+    metrics_file = tmp_path / "metrics.jsonl"
+    metrics = open_transfer_metrics(str(metrics_file), "jsonl", "download", "42")
+
+    # When downloading it
+    download_application_build("42", str(tmp_path / "build.zip"), metrics=metrics)
+    metrics.close()
+
+    # Expect the download to be reported in chunks of 8 MiB
+    events = [json.loads(line) for line in metrics_file.read_text().splitlines()]
+    assert [(event["event"], event.get("offset")) for event in events] == [
+        ("chunk", 0),
+        ("chunk", 8 << 20),
+        ("chunk", 16 << 20),
+        ("summary", None),
+    ]
+    assert events[-1]["direction"] == "download"
+    assert events[-1]["bytes"] == 20 << 20
@@ -0,0 +1,160 @@
+import os
+
+import pytest
+
+from portal_client.http_session import PortalSession
+from portal_client.portal_chunked_upload import ChunkedUploader
+from portal_client.transfer_metrics import TransferMetrics
+from portal_client.upload_benchmark import (
+    benchmark_upload_settings,
+    recommend_upload_settings,
+    size_argument,
+)
+from portal_client.upload_stub_server import ChunkedUploadStubServer
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    "Keeps upload journals and the upload index of each test apart"
+    monkeypatch.setenv("PORTAL_CACHE_DIR", str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def stub_server():
+    with ChunkedUploadStubServer() as server:
+        yield server
+
+
+def test_benchmark_runs_every_combination_against_stub_server(stub_server):
+    # Given a local stand-in server
+
+    # When benchmarking two chunk sizes at two concurrency levels
+    results = benchmark_upload_settings(
+        stub_server.base_url,
+        "Bearer benchmark",
+        size=size_argument("1M"),
+        chunk_sizes=[size_argument("256K"), size_argument("512K")],
+        parallel_chunks_levels=[1, 2],
+    )
+
+    # Expect every combination to have been uploaded and committed successfully
+    assert [
+        (result["chunk_size"], result["parallel_chunks"]) for result in results
+    ] == [
+        (256 << 10, 1),
+        (256 << 10, 2),
+        (512 << 10, 1),
+        (512 << 10, 2),
+    ]
+    assert all(result["error"] is None for result in results)
+    assert all(result["megabytes_per_second"] > 0 for result in results)
+    assert all(
+        result["latency_p50_ms"] <= result["latency_p99_ms"] for result in results
+    )
+    assert sum(upload["completed"] for upload in stub_server.uploads.values()) == 4
+
+    # Expect one of the combinations to be recommended
+    recommendation = recommend_upload_settings(results)
+    assert (recommendation["chunk_size"], recommendation["parallel_chunks"]) in [
+        (result["chunk_size"], result["parallel_chunks"]) for result in results
+    ]
+
+
+@pytest.mark.parametrize("accept_out_of_order", [True, False])
+def test_runs_falling_back_to_sequential_uploads_are_not_recommended(
+    accept_out_of_order,
+):
+    # Given a stand-in server which does or does not accept chunks out of order
+    with ChunkedUploadStubServer(
+        latency=0.01, accept_out_of_order=accept_out_of_order
+    ) as server:
+        # When benchmarking parallel chunk uploads
+        results = benchmark_upload_settings(
+            server.base_url,
+            "Bearer benchmark",
+            size=size_argument("1M"),
+            chunk_sizes=[size_argument("128K")],
+            parallel_chunks_levels=[4],
+        )
+
+    # Expect them to be measured if the server accepts them, and to be flagged and left out otherwise
+    assert results[0]["error"] is None
+    assert results[0]["sequential_fallback"] is not accept_out_of_order
+    recommendation = recommend_upload_settings(results)
+    if accept_out_of_order:
+        assert recommendation["parallel_chunks"] == 4
+    else:
+        assert recommendation is None
+
+
+def test_recommendation_prefers_fewer_parallel_chunks_at_similar_throughput():
+    # Given results where more parallel chunks are barely faster
+    results = [
+        {"chunk_size": 8 << 20, "parallel_chunks": 4, "megabytes_per_second": 10.2},
+        {"chunk_size": 8 << 20, "parallel_chunks": 1, "megabytes_per_second": 10.0},
+        {"chunk_size": 1 << 20, "parallel_chunks": 1, "megabytes_per_second": 5.0},
+        {"chunk_size": 32 << 20, "parallel_chunks": 1, "megabytes_per_second": None},
+    ]
+    for result in results:
+        result["error"] = None if result["megabytes_per_second"] else "413"
+
+    # When picking the settings to recommend
+    recommendation = recommend_upload_settings(results)
+
+    # Expect the simpler settings within the tolerance to win
+    assert recommendation == {
+        "chunk_size": 8 << 20,
+        "parallel_chunks": 1,
+        "megabytes_per_second": 10.0,
+    }
+
+
+def test_metrics_count_retries_of_dropped_chunks(tmp_path):
+    # Given a stand-in server hanging up on some of the requests
+    upload_file = tmp_path / "build.zip"
+    upload_file.write_bytes(os.urandom(1 << 20))
+    with ChunkedUploadStubServer(drop_rate=0.3, seed=1) as server:
+        metrics = TransferMetrics()
+        uploader = ChunkedUploader(
+            server.base_url,
+            "Bearer benchmark",
+            session=PortalSession(),
+            metrics=metrics,
+        )
+
+        # When uploading nonetheless
+        file_url = uploader.upload_chunked_file(
+            upload_file, chunk_size_bytes=256 << 10, deduplicate=False
+        )
+
+    # Expect the upload to succeed and the retries to be attributed to their chunks
+    assert file_url.startswith("http://127.0.0.1")
+    summary = metrics.summary()
+    assert summary["chunks"] == 4
+    assert summary["bytes"] == 1 << 20
+    assert summary["retries"] == sum(chunk["retries"] for chunk in metrics.chunks) > 0
+
+
+def test_corrupted_chunks_are_retried_on_their_own(tmp_path):
+    # Given a stand-in server on which some chunks arrive corrupted
+    upload_file = tmp_path / "build.zip"
+    upload_file.write_bytes(os.urandom(1 << 20))
+    with ChunkedUploadStubServer(corrupt_rate=0.3, seed=3) as server:
+        metrics = TransferMetrics()
+        uploader = ChunkedUploader(
+            server.base_url,
+            "Bearer benchmark",
+            session=PortalSession(),
+            metrics=metrics,
+        )
+
+        # When uploading the file
+        file_url = uploader.upload_chunked_file(
+            upload_file, chunk_size_bytes=128 << 10, deduplicate=False
+        )
+
+    # Expect the corrupted chunks to have been sent again within the same upload, which commits successfully
+    assert file_url.startswith("http://127.0.0.1")
+    assert len(server.uploads) == 1
+    assert sum(chunk["retries"] for chunk in metrics.chunks) > 0
+    assert all(chunk["status"] == 200 for chunk in metrics.chunks)
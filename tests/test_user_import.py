@@ -0,0 +1,115 @@
+import json
+
+import pytest
+import requests
+import requests_mock
+
+from portal_client import parser
+
+USERS_URL = "https://api.innoactive.io/api/users/"
+
+
+@pytest.fixture(autouse=True)
+def authentication(monkeypatch):
+    monkeypatch.setenv("PORTAL_BACKEND_ACCESS_TOKEN", "test-token")
+
+
+def create_users(throttle_once=(), fail=(), existing=(), time_out=()):
+    "Returns a requests_mock callback creating users, except for the given email addresses"
+    throttled = set()
+
+    def respond(request, context):
+        email = request.json()["email"]
+        if email in time_out:
+            raise requests.exceptions.ReadTimeout("Read timed out.")
+        if email in throttle_once and email not in throttled:
+            throttled.add(email)
+            context.status_code = 429
+            return {"detail": "Request was throttled."}
+        if email in existing:
+            context.status_code = 400
+            return {"email": ["user with this email already exists."]}
+        if email in fail:
+            context.status_code = 400
+            return {"organizations": ["Invalid pk - object does not exist."]}
+        context.status_code = 201
+        return dict(request.json(), id=email)
+
+    return respond
+
+
+def import_users(*arguments):
+    args = parser.parse_args(["users", "import", *arguments])
+    args.func(args)
+
+
+def test_import_creates_users_from_csv(
+    requests_mock: requests_mock.Mocker, tmp_path, capsys
+):
+    # Given a CSV file of users, one of whom exists already and one of whom is throttled at first
+    users_file = tmp_path / "trainees.csv"
+    users_file.write_text(
+        "email,first_name,last_name,organizations\n"
+        + "".join(f"user{row}@acme.org,User,{row},3;4\n" for row in range(20))
+    )
+    requests_mock.post(
+        USERS_URL,
+        json=create_users(
+            throttle_once=["user5@acme.org"], existing=["user7@acme.org"]
+        ),
+    )
+
+    # When importing them
+    import_users(str(users_file), "--workers", "4")
+
+    # Expect every user to be created, with a result per row in the order of the file
+    summary = json.loads(capsys.readouterr().out)
+    assert summary == {
+        "created": 19,
+        "exists": 1,
+        "results_file": str(tmp_path / "trainees.results.jsonl"),
+    }
+    results = [
+        json.loads(line)
+        for line in (tmp_path / "trainees.results.jsonl").read_text().splitlines()
+    ]
+    assert [result["row"] for result in results] == list(range(1, 21))
+    assert results[7]["status"] == "exists"
+    assert results[0]["input"] == {
+        "email": "user0@acme.org",
+        "first_name": "User",
+        "last_name": "0",
+        "organizations": ["3", "4"],
+    }
+    assert requests_mock.call_count == 21
+
+
+def test_results_file_retries_only_failures(
+    requests_mock: requests_mock.Mocker, tmp_path, capsys
+):
+    # Given an import during which one user could not be created and the request for another one timed out
+    users_file = tmp_path / "trainees.jsonl"
+    users_file.write_text(
+        "".join(
+            json.dumps({"email": f"user{row}@acme.org", "organizations": [3]}) + "\n"
+            for row in range(5)
+        )
+    )
+    requests_mock.post(
+        USERS_URL,
+        json=create_users(fail=["user2@acme.org"], time_out=["user3@acme.org"]),
+    )
+    with pytest.raises(SystemExit, match="2 users could not be created"):
+        import_users(str(users_file))
+    capsys.readouterr()
+
+    # When importing the results file, once the problems have been fixed
+    requests_mock.reset_mock()
+    requests_mock.post(USERS_URL, json=create_users())
+    import_users(str(tmp_path / "trainees.results.jsonl"))
+
+    # Expect only the failed users to be created again
+    assert json.loads(capsys.readouterr().out)["created"] == 2
+    assert sorted(
+        request.json()["email"] for request in requests_mock.request_history
+    ) == ["user2@acme.org", "user3@acme.org"]